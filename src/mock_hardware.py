@@ -1,4 +1,4 @@
-from unittest.mock import Mock
+from unittest.mock import AsyncMock, Mock
 
 FORWARD = "f"
 REVERSE = "r"
@@ -8,3 +8,5 @@ get_internal_temperature = Mock()
 init_motor = Mock()
 motor_on = Mock()
 motor_off = Mock()
+
+effects = Mock(run=AsyncMock())
@@ -0,0 +1,131 @@
+"""
+Keep track of every Guard that answers MARCO, so that one Fire-and-Ice can drive several trains.
+
+Guards are added to the `Fleet` as their POLO replies or status messages arrive, and each Guard's
+own `StatusMonitor` follows its status. A Guard is kept alive by any message it sends, including its
+link probes, as it does not publish a status in every state, eg: while driven by hand. Guards that
+fall silent are forgotten, until they reply to MARCO or publish a status again.
+Each Guard may be addressed by its id, as part of a named group or all together, and the controls
+for every Guard that changed are sent in a single CONTROL_MULTI message per tick.
+"""
+
+from protocol import Link, Message, StatusMonitor, Type, ticks_diff, ticks_ms
+
+PEER_TIMEOUT_MS = 5000  # forget Guards that have been silent for longer
+
+
+class Peer:
+    """A Guard that has answered MARCO."""
+
+    def __init__(self, guard_id: int, ip_address) -> None:
+        self.id = guard_id
+        self.ip_address = ip_address
+        self.last_seen = ticks_ms()
+        self.direction = 0
+        self.speed = 0
+        self.changed = False  # control not yet sent
+        self.status = StatusMonitor()
+
+
+class Fleet:
+    """A registry of Guards, addressed individually, by group or all together."""
+
+    def __init__(self, link: Link, timeout_ms: int = PEER_TIMEOUT_MS) -> None:
+        self.link = link
+        self.timeout_ms = timeout_ms
+        self.peers = {}  # Guard id: Peer
+        self.groups = {}  # name: set of Guard ids
+
+    def discover(self):
+        """Ask every Guard on the network to reply with POLO."""
+        self.link.send_marco()
+
+    def observe(self, message: Message) -> bool:
+        """
+        Record a received message, returning True if it introduced a new Guard.
+
+        STATUS messages are not observed here, see `status_of`.
+        """
+        peer = self.peers.get(message.sender)
+        if peer:
+            peer.last_seen = ticks_ms()
+            if message.ip_address:
+                peer.ip_address = message.ip_address
+            return False
+
+        if message.type not in (Type.POLO, Type.STATUS):
+            return False
+        self.peers[message.sender] = Peer(message.sender, message.ip_address)
+        return True
+
+    def is_active(self, peer: Peer) -> bool:
+        last_seen = self.link.heard.get(peer.id, peer.last_seen)
+        if ticks_diff(peer.last_seen, last_seen) > 0:
+            last_seen = peer.last_seen
+        return ticks_diff(ticks_ms(), last_seen) <= self.timeout_ms
+
+    def active_peers(self):
+        return [peer for peer in self.peers.values() if self.is_active(peer)]
+
+    def forget_inactive(self):
+        for guard_id, peer in list(self.peers.items()):
+            if not self.is_active(peer):
+                del self.peers[guard_id]
+
+    def status_of(self, message: Message):
+        """Return the `StatusMonitor` of the Guard that sent the message, or None if unknown."""
+        peer = self.peers.get(message.sender)
+        return peer.status if peer else None
+
+    def add_to_group(self, name: str, *guard_ids):
+        self.groups.setdefault(name, set()).update(guard_ids)
+
+    def select(self, target=None):
+        """Return the Guards for a Guard id, a group name, or all Guards if omitted."""
+        if target is None:
+            return list(self.peers.values())
+        if target in self.groups:
+            return [self.peers[i] for i in self.groups[target] if i in self.peers]
+        peer = self.peers.get(target)
+        return [peer] if peer else []
+
+    def set_control(self, direction: int, speed: int, target=None):
+        """Set the direction and speed of the selected Guards, to be sent by the next `flush`."""
+        for peer in self.select(target):
+            if peer.direction != direction or peer.speed != speed:
+                peer.direction = direction
+                peer.speed = speed
+                peer.changed = True
+
+    def flush(self) -> bool:
+        """Send the changed controls in a single message, returning False if none had changed."""
+        controls = [
+            (peer.id, peer.direction, peer.speed) for peer in self.peers.values() if peer.changed
+        ]
+        if not controls:
+            return False
+        self.link.send_control_multi(controls)
+        for peer in self.peers.values():
+            peer.changed = False
+        return True
+
+    def send(self, type, target=None):
+        """Send a message without a payload, eg: AUTO, to each of the selected Guards."""
+        for peer in self.select(target):
+            self.link.send(type, ip_address=peer.ip_address or self.link.wifi.broadcast)
+
+    def stop(self, target=None):
+        """
+        Send an acknowledged STOP to each of the selected Guards.
+
+        If none are selected, eg: all have been forgotten, STOP is broadcast to every Guard instead.
+        """
+        peers = self.select(target)
+        for peer in peers:
+            peer.direction = 0
+            peer.speed = 0
+            peer.changed = False
+        if peers:
+            self.send(Type.STOP, target)
+        else:
+            self.link.send(Type.STOP, ip_address=self.link.wifi.broadcast)
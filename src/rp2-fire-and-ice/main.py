@@ -54,20 +54,32 @@
 # Should shutdown state be triggered
 # - Both LEDs off
 
+import sys
 from time import sleep
 
+from effects import EffectsEngine, Flicker
+from fleet import Fleet
 from hardware import LED, Indicator, Slider, Switch, WiFi
-from stately import STATES, StateMachine
+from machine import unique_id
+from protocol import Link, Status, Type, sender_id
+from stately import STATES, StateMachine, state_names
+
+CONTROL_PERIOD = 20  # milliseconds between calls to the state functions
+PING_PERIOD = 1000  # milliseconds between link probes
 
 fwd_indicator = None
 rev_indicator = None
+effects = EffectsEngine()  # flickers the indicators at a fixed rate, whatever the loop rate
 
 fwd_switch = None
 rev_switch = None
 
 speed_knob = None
 
+state_machine = None
 wifi = None
+link = None
+fleet = None
 
 last_speed = None
 last_direction = None
@@ -82,15 +94,6 @@ class Direction:
     NONE = 0
     FORWARD = 1
 
-    @staticmethod
-    def letter(direction):
-        letters = {
-            -1: "R",
-            0: "N",
-            1: "F",
-        }
-        return letters[direction]
-
 
 def read_direction() -> Direction:
     """Read the direction switches and return the resulting Direction."""
@@ -103,19 +106,33 @@ def read_direction() -> Direction:
 def before_state():
     """For execution after the state function."""
     try:
-        fwd_indicator.show_guise(fwd_indicator.guise, effect="flicker")
-        rev_indicator.show_guise(fwd_indicator.guise, effect="flicker")
+        fleet.forget_inactive()
+        effects.update()
+        fwd_indicator.warn(link.stats.degraded)
+        rev_indicator.warn(link.stats.degraded)
     except AttributeError:
         # indicators have not been initialised yet
         pass
 
 
+def on_serial(stream):
+    """Print the link statistics and a state report when `s` is typed over serial."""
+    character = stream.read(1)
+    if not character:
+        state_machine.unregister(stream)  # nothing connected
+    elif character == "s" and link:
+        print(link.stats.report())
+        print(state_machine.report())
+
+
 def state_initialise():
     """Initialise hardware when power is first applied."""
-    global fwd_indicator, rev_indicator, fwd_switch, rev_switch, wifi, speed_knob
+    global fwd_indicator, rev_indicator, fwd_switch, rev_switch, wifi, link, fleet, speed_knob
 
     fwd_indicator = Indicator(10, 13, 12)
     rev_indicator = Indicator(21, 18, 19)
+    effects.play(Flicker(fwd_indicator))
+    effects.play(Flicker(rev_indicator))
 
     fwd_switch = Switch(17)
     # rev_switch = Switch(16)
@@ -127,6 +144,8 @@ def state_initialise():
     LED(26).pin.on()  # enable speed_knob
 
     wifi = WiFi()
+    link = Link(wifi, sender_id=sender_id(unique_id()), ping_period_ms=PING_PERIOD)
+    fleet = Fleet(link)
 
     return STATES.CONNECT
 
@@ -166,19 +185,22 @@ def state_identify():
     """
     global last_speed, last_direction
 
+    state_machine.unregister(getattr(wifi, "client", None))  # from a previous connection
     wifi.open_udp_socket()
+    state_machine.register(wifi.client, link.service)
 
-    # Put Guard into STOP state so that it can respond o the Marco Polo request
-    wifi.send("STOP", wifi.broadcast)
+    # Put Guards into STOP state so that they can respond o the Marco Polo request
+    link.send(Type.STOP, ip_address=wifi.broadcast)
 
-    while not wifi.receive_polo():
+    while not receive_polo():
         fwd_indicator.toggle(Indicator.ORANGE, Indicator.BLUE)
         rev_indicator.toggle(Indicator.BLUE, Indicator.ORANGE)
 
         if wifi.wlan.status() != 3:
             return STATES.CONNECT
 
-        wifi.send_marco()
+        fleet.discover()
+        sleep(0.3)
 
     last_speed = speed_knob.value()
     last_direction = read_direction()
@@ -186,11 +208,42 @@ def state_identify():
     return STATES.STOPPED
 
 
+def receive_polo() -> bool:
+    """Add any Guards that have replied to MARCO to the fleet, returning True if there were any."""
+    found = False
+    message = link.receive(include_ip_address=True)
+    while message is not None:
+        if message.type == Type.POLO and message.ip_address:
+            fleet.observe(message)
+            found = True
+        message = link.receive(include_ip_address=True)
+    return found
+
+
+def receive():
+    """Receive the next message, keeping the fleet up to date with any other Guards that reply."""
+    message = link.receive()
+    if message is not None:
+        fleet.observe(message)
+    return message
+
+
+def received():
+    """Yield every waiting message, so that none are left to go stale in the inbox."""
+    message = receive()
+    while message is not None:
+        yield message
+        message = receive()
+
+
 def state_stopped():
     """Reset now that automatic control has ended."""
     fwd_indicator.show_guise(Indicator.ORANGE)
     rev_indicator.show_guise(Indicator.ORANGE)
 
+    for _message in received():
+        pass  # discard, so that old status is not mistaken for new in TRANSITION
+
     new_speed = speed_knob.value()
     if new_speed >= 33 and new_speed <= 66:
         return STATES.TRANSITION
@@ -209,13 +262,15 @@ def state_transition():
     if new_speed == 0:
         return STATES.MANUAL
     elif new_speed == 100:
-        wifi.send("AUTO")
+        fleet.send(Type.AUTO)
 
-    message = wifi.receive()
-    if message is None:
-        pass  # skip further parsing
-    elif b"BOUNCE" in message:
-        return STATES.AUTOMATIC
+    for message in received():
+        guard_status = fleet.status_of(message) if message.type == Type.STATUS else None
+        if guard_status is None:
+            continue  # skip further parsing
+        guard_status.observe(message)
+        if guard_status.status == Status.BOUNCE:
+            return STATES.AUTOMATIC  # once any Guard has started
 
 
 def state_manual():
@@ -251,13 +306,14 @@ def state_manual():
 
     if direction_change_counter >= 4:
         direction_change_counter = 0
-        wifi.send("STOP")
+        fleet.stop()
         return STATES.STOPPED
     elif new_direction != last_direction or new_speed != last_speed:
-        message = f"CONTROL {Direction.letter(new_direction)} {new_speed}"
-        wifi.send(message)
+        fleet.set_control(new_direction, new_speed)
 
-    sleep(0.02)
+    fleet.flush()  # at most one message per tick, for every Guard
+    for _message in received():
+        pass  # keep the fleet up to date
 
     last_direction = new_direction
     last_speed = new_speed
@@ -276,29 +332,33 @@ def state_automatic():
     """
     global last_speed, last_direction
 
-    message = wifi.receive()
-    if message is None:
-        pass  # skip further parsing
-    elif b"FORWARD_END" in message:
-        fwd_indicator.show_guise(Indicator.ORANGE)
-        rev_indicator.show_guise(Indicator.BLUE)
-    elif b"REVERSE_END" in message:
-        fwd_indicator.show_guise(Indicator.BLUE)
-        rev_indicator.show_guise(Indicator.ORANGE)
-    elif b"STOPPED" in message:
-        return STATES.STOPPED
-    else:
-        fwd_indicator.show_guise(Indicator.BLUE)
-        rev_indicator.show_guise(Indicator.BLUE)
+    # the Guard only sends its status when it changes, plus a heartbeat
+    for message in received():
+        guard_status = fleet.status_of(message) if message.type == Type.STATUS else None
+        if guard_status is None:
+            pass  # skip further parsing
+        elif not guard_status.observe(message):
+            pass  # unchanged
+        elif guard_status.status == Status.FORWARD_END:
+            fwd_indicator.show_guise(Indicator.ORANGE)
+            rev_indicator.show_guise(Indicator.BLUE)
+        elif guard_status.status == Status.REVERSE_END:
+            fwd_indicator.show_guise(Indicator.BLUE)
+            rev_indicator.show_guise(Indicator.ORANGE)
+        elif guard_status.status == Status.STOPPED:
+            return STATES.STOPPED
+        else:
+            fwd_indicator.show_guise(Indicator.BLUE)
+            rev_indicator.show_guise(Indicator.BLUE)
 
     new_speed = speed_knob.value()
     new_direction = read_direction()
 
     if new_direction != Direction.NONE:
-        wifi.send("TRIGGER")
+        fleet.send(Type.TRIGGER)
 
     if abs(new_speed - last_speed) >= 2:
-        wifi.send("STOP")
+        fleet.stop()
 
 
 def state_shutdown():
@@ -322,6 +382,12 @@ if __name__ == "__main__":
         STATES.SHUTDOWN: state_shutdown,
     }
     state_machine = StateMachine(
-        state_functions, on_before_state=before_state, interrupt_state=STATES.SHUTDOWN
+        state_functions,
+        on_before_state=before_state,
+        interrupt_state=STATES.SHUTDOWN,
+        period_ms=CONTROL_PERIOD,
+        names=state_names(STATES),
     )
+    state_machine.register(sys.stdin, on_serial)
     state_machine.run_loop()
+    print(state_machine.report())
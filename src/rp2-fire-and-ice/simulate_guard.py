@@ -1,44 +1,449 @@
-# Simulate the Guard semi-automatic driver
 """
-Simple udp socket server.
+Emulate one or more Guards on CPython, for testing Fire-and-Ice without hardware.
 
-sources:
- - https://docs.python.org/3/library/socket.html#example
- - https://gist.github.com/ninedraft/7c47282f8b53ac015c1e326fffb664b5
+Each Guard runs the real `rp2-guard/main.py` state machine in its own process, with fake `machine`,
+`network` and `utime` modules. The fake motor pins drive a simple model of a train shuttling along
+a straight track, whose position triggers the virtual end sensors, so automatic mode works too.
+
+Run Guards on the usual port, to be driven by anything on the network:
+
+```sh
+python src/rp2-fire-and-ice/simulate_guard.py
+```
+
+Or run several Guards on consecutive ports and drive them from a simulated Fire-and-Ice,
+reporting the latency from each CONTROL command to the change in motor output:
+
+```sh
+python src/rp2-fire-and-ice/simulate_guard.py --guards 8 --drive --rate 20 --duration 10
+```
 """
 
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import runpy
 import socket
+import struct
+import sys
+import time
+import types
+from pathlib import Path
+
+GUARD_DIR = Path(__file__).resolve().parent.parent / "rp2-guard"
+BASE_PORT = 50007
+TELEMETRY_PORT = 50099
+DRIVER_ID = 0xFD
+
+FWD_MOTOR_PIN = 2  # motor 0 on the Simply Robotics board
+REV_MOTOR_PIN = 5
+STOP_BUTTON_PIN = 21
+REV_SENSOR_PIN = 26
+FWD_SENSOR_PIN = 27
+
+
+class Train:
+    """A train on a straight track between two end sensors, driven by the Guard's motor."""
+
+    def __init__(
+        self, length_mm=1500, max_speed_mm_s=2000, time_constant_s=0.3, sensor_mm=50, telemetry=None
+    ):
+        self.length_mm = length_mm
+        self.max_speed_mm_s = max_speed_mm_s
+        self.time_constant_s = time_constant_s
+        self.sensor_mm = sensor_mm
+        self.telemetry = telemetry
+        self.position = length_mm / 2
+        self.velocity = 0.0
+        self.drive = 0.0  # -1.0 to 1.0
+        self.duty = {FWD_MOTOR_PIN: 0, REV_MOTOR_PIN: 0}
+        self._last = time.monotonic()
+
+    def advance(self):
+        """Move the train on to the current time."""
+        now = time.monotonic()
+        dt = now - self._last
+        self._last = now
+
+        target = self.drive * self.max_speed_mm_s
+        self.velocity += (target - self.velocity) * min(1.0, dt / self.time_constant_s)
+        self.position += self.velocity * dt
+        if not 0 <= self.position <= self.length_mm:
+            # hit the buffers
+            self.position = max(0, min(self.position, self.length_mm))
+            self.velocity = 0.0
+
+    def set_duty(self, pin_id, duty):
+        if pin_id not in self.duty:
+            return
+        self.advance()
+        self.duty[pin_id] = duty
+        drive = (self.duty[FWD_MOTOR_PIN] - self.duty[REV_MOTOR_PIN]) / 65535
+        if drive != self.drive:
+            self.drive = drive
+            if self.telemetry:
+                self.telemetry(self)
+
+    def read_pin(self, pin_id, value):
+        """Return the value of an input pin, inverted as the real switches are active low."""
+        if pin_id == FWD_SENSOR_PIN:
+            self.advance()
+            return 0 if self.position >= self.length_mm - self.sensor_mm else 1
+        if pin_id == REV_SENSOR_PIN:
+            self.advance()
+            return 0 if self.position <= self.sensor_mm else 1
+        if pin_id == STOP_BUTTON_PIN:
+            return 1  # never pressed
+        return value
+
+
+class Pin:
+    """A fake `machine.Pin`, whose inputs are read from the emulated train."""
+
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    PULL_DOWN = 2
+
+    train = None
+
+    def __init__(self, id, mode=-1, pull=-1):
+        self.id = id
+        self._value = 0
+
+    def value(self, value=None):
+        if value is None:
+            return self.train.read_pin(self.id, self._value)
+        self._value = int(value)
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+    def toggle(self):
+        self._value = 1 - self._value
+
+
+class PWM:
+    """A fake `machine.PWM`, whose duty cycle drives the emulated train."""
+
+    def __init__(self, pin):
+        self.pin = pin
+        self._duty = 0
+
+    def freq(self, frequency=None):
+        pass
+
+    def duty_u16(self, duty=None):
+        if duty is None:
+            return self._duty
+        self._duty = duty
+        self.pin.train.set_duty(self.pin.id, duty)
+
+
+class ADC:
+    """A fake `machine.ADC`, reading zero."""
+
+    def __init__(self, pin):
+        pass
+
+    def read_u16(self):
+        return 0
+
+
+def fake_machine(train: Train, unique_id: bytes):
+    """Return a `machine` module whose pins are connected to the train."""
+    Pin.train = train
+    machine = types.ModuleType("machine")
+    machine.Pin = Pin
+    machine.PWM = PWM
+    machine.ADC = ADC
+    machine.unique_id = lambda: unique_id
+    return machine
+
+
+def fake_network():
+    network = types.ModuleType("network")
+    network.STA_IF = 0
+    network.AP_IF = 1
+
+    class WLAN:
+        def __init__(self, interface=0):
+            self._active = False
+
+        def config(self, **kwargs):
+            pass
+
+        def active(self, active=None):
+            if active is None:
+                return self._active
+            self._active = active
+
+        def connect(self, ssid, password):
+            pass
+
+        def status(self):
+            return 3  # connected
+
+        def ifconfig(self):
+            return ("127.0.0.1", "255.0.0.0", "127.0.0.1", "127.0.0.1")
 
-HOST = ""  # Symbolic name meaning all available interfaces
-PORT = 50007  # Arbitrary non-privileged port
-with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as server:
-    # Enable port reusage so we will be able to run multiple clients and servers on single (host, port).
-    # Do not use socket.SO_REUSEADDR except you using linux(kernel<3.9): goto https://stackoverflow.com/questions/14388706/how-do-so-reuseaddr-and-so-reuseport-differ for more information.
-    # For linux hosts all sockets that want to share the same address and port combination must belong to processes that share the same effective user ID!
-    # So, on linux(kernel>=3.9) you have to run multiple servers and clients under one user to share the same (host, port).
-    # Thanks to @stevenreddie
-    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        def disconnect(self):
+            pass
 
-    # Set a timeout so the socket does not block
-    # indefinitely when trying to receive data.
-    server.settimeout(0.1)
+        def deinit(self):
+            pass
 
-    server.bind((HOST, PORT))
+    network.WLAN = WLAN
+    return network
 
-    while True:
+
+def fake_utime():
+    utime = types.ModuleType("utime")
+    utime.ticks_ms = lambda: int(time.monotonic() * 1000)
+    utime.ticks_add = lambda ticks, delta: ticks + delta
+    utime.ticks_diff = lambda ticks_1, ticks_2: ticks_1 - ticks_2
+    utime.sleep = time.sleep
+    utime.sleep_ms = lambda ms: time.sleep(ms / 1000)
+    return utime
+
+
+def run_guard(index, port, peer_port=None, telemetry_port=None):
+    """Run the real Guard main.py against an emulated train, until interrupted."""
+    telemetry = None
+    if telemetry_port:
+        telemetry_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        def telemetry(train: Train):
+            report = {
+                "guard": index,
+                "t": time.monotonic(),
+                "drive": train.drive,
+                "position": round(train.position),
+                "velocity": round(train.velocity),
+            }
+            telemetry_socket.sendto(json.dumps(report).encode(), ("127.0.0.1", telemetry_port))
+
+    train = Train(telemetry=telemetry)
+    sys.modules["machine"] = fake_machine(train, bytes((0xE0, index + 1)))
+    sys.modules["network"] = fake_network()
+    sys.modules["utime"] = fake_utime()
+    sys.path.insert(0, str(GUARD_DIR))
+
+    import hardware
+
+    hardware.WiFi.port = port
+    if peer_port:
+        # talk to a local driver rather than broadcasting to the network
+        hardware.WiFi.host = "127.0.0.1"
+        hardware.WiFi.broadcast = "127.0.0.1"
+        hardware.WiFi.peer_port = peer_port
+
+    try:
+        runpy.run_path(str(GUARD_DIR / "main.py"), run_name="__main__")
+    except KeyboardInterrupt:
+        pass
+
+
+def start_guards(count, base_port, peer_port=None, telemetry_port=None):
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    for index in range(count):
+        process = context.Process(
+            target=run_guard,
+            args=(index, base_port + index, peer_port, telemetry_port),
+            daemon=True,
+        )
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def percentile(samples, fraction):
+    """Return the nearest-rank percentile of pre-sorted samples."""
+    if not samples:
+        return float("nan")
+    return samples[min(len(samples) - 1, max(0, int(round(fraction * len(samples))) - 1))]
+
+
+class Driver(asyncio.DatagramProtocol):
+    """A simulated Fire-and-Ice, sending CONTROL to every Guard and timing the motor response."""
+
+    def __init__(self, guard_ports) -> None:
+        from protocol import Message, Status, Type, encode
+
+        self.Message, self.Status, self.Type, self.encode = Message, Status, Type, encode
+        self.guard_ports = guard_ports
+        self.discovered = set()
+        self.sequence = 0
+        self.sent = {}  # guard index: time the last CONTROL was sent
+        self.latencies = []
+        self.lost = 0
+        self.acks = {}  # sequence: time the STOP was sent
+        self.ack_latencies = []
+        self.ends = 0
+        self.seen = set()  # (sender, sequence) of reliable messages received
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def send(self, index, message_type, payload=b""):
+        self.sequence = (self.sequence + 1) & 0xFFFF
+        packet = self.encode(message_type, DRIVER_ID, self.sequence, payload)
+        self.transport.sendto(packet, ("127.0.0.1", self.guard_ports[index]))
+        return self.sequence
+
+    def datagram_received(self, data, address):
+        message = self.Message()
+        if not message.parse(data):
+            return
+        index = self.guard_ports.index(address[1]) if address[1] in self.guard_ports else None
+        if message.is_reliable() and index is not None:
+            ack = struct.pack("!HH", message.sender, message.sequence)
+            self.send(index, self.Type.ACK, ack)
+            if (message.sender, message.sequence) in self.seen:
+                return  # a retransmission
+            self.seen.add((message.sender, message.sequence))
+        if message.type == self.Type.POLO and index is not None:
+            self.discovered.add(index)
+        elif message.type == self.Type.PING and index is not None:
+            pong = struct.pack("!H", message.sender) + bytes(message.payload)
+            self.send(index, self.Type.PONG, pong)
+        elif message.type == self.Type.ACK:
+            sent_at = self.acks.pop(message.acknowledged()[1], None)
+            if sent_at is not None:
+                self.ack_latencies.append((time.monotonic() - sent_at) * 1000)
+        elif message.type == self.Type.STATUS and message.status() in (
+            self.Status.FORWARD_END,
+            self.Status.REVERSE_END,
+        ):
+            self.ends += 1
+
+    def telemetry_received(self, report):
+        sent_at = self.sent.pop(report["guard"], None)
+        if sent_at is not None:
+            self.latencies.append((report["t"] - sent_at) * 1000)
+
+    async def discover(self, timeout=10):
+        deadline = time.monotonic() + timeout
+        while len(self.discovered) < len(self.guard_ports) and time.monotonic() < deadline:
+            for index in range(len(self.guard_ports)):
+                self.send(index, self.Type.MARCO)
+            await asyncio.sleep(0.3)
+        return len(self.discovered)
+
+    async def drive(self, index, rate, duration):
+        """Send CONTROL with a new speed at the given rate, waiting for the motor to respond."""
+        self.send(index, self.Type.CONTROL, bytes((1, 0)))  # enter manual mode
+        await asyncio.sleep(0.1)
+        speed = 0
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            if index in self.sent:
+                self.lost += 1  # the previous command never moved the motor
+            speed = random.choice([s for s in range(10, 101, 10) if s != speed])
+            direction = random.choice((-1, 1))
+            self.sent[index] = time.monotonic()
+            self.send(index, self.Type.CONTROL, bytes((direction & 0xFF, speed)))
+            await asyncio.sleep(1 / rate)
+        await self.stop(index)
+
+    async def automate(self, index, duration):
+        """Put the Guard into automatic mode, counting the end sensors as the train shuttles."""
+        self.send(index, self.Type.AUTO)
+        await asyncio.sleep(duration)
+        await self.stop(index)
+
+    async def stop(self, index, retransmit_s=0.1, attempts=20):
+        sequence = self.send(index, self.Type.STOP)
+        self.acks[sequence] = time.monotonic()
+        for _ in range(attempts):
+            await asyncio.sleep(retransmit_s)
+            if sequence not in self.acks:
+                return
+            packet = self.encode(self.Type.STOP, DRIVER_ID, sequence)
+            self.transport.sendto(packet, ("127.0.0.1", self.guard_ports[index]))
+
+
+class Telemetry(asyncio.DatagramProtocol):
+    """Pass motor changes reported by the Guards to the driver."""
+
+    def __init__(self, driver: Driver) -> None:
+        self.driver = driver
+
+    def datagram_received(self, data, address):
+        self.driver.telemetry_received(json.loads(data))
+
+
+async def drive_guards(args, guard_ports):
+    loop = asyncio.get_running_loop()
+    driver_transport, driver = await loop.create_datagram_endpoint(
+        lambda: Driver(guard_ports), local_addr=("127.0.0.1", args.peer_port)
+    )
+    telemetry_transport, _ = await loop.create_datagram_endpoint(
+        lambda: Telemetry(driver), local_addr=("127.0.0.1", TELEMETRY_PORT)
+    )
+
+    found = await driver.discover()
+    print(f"Discovered {found} of {len(guard_ports)} Guards")
+
+    if args.auto:
+        await asyncio.gather(*(driver.automate(i, args.duration) for i in driver.discovered))
+    else:
+        await asyncio.gather(
+            *(driver.drive(i, args.rate, args.duration) for i in driver.discovered)
+        )
+    await asyncio.sleep(0.5)  # let the last replies arrive
+
+    driver_transport.close()
+    telemetry_transport.close()
+
+    if args.auto:
+        print(f"End sensors reported: {driver.ends}")
+    else:
+        samples = sorted(driver.latencies)
+        print(f"\nCommand to motion latency, {len(samples)} commands ({driver.lost} lost)")
+        for label, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0)):
+            print(f"  {label} {percentile(samples, fraction):7.2f} ms")
+    acks = sorted(driver.ack_latencies)
+    print(f"STOP acknowledged by {len(acks)} Guards, p99 {percentile(acks, 0.99):.2f} ms")
+    return 0 if found == len(guard_ports) and len(acks) == found else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--guards", type=int, default=1, help="number of Guards to emulate")
+    parser.add_argument("--port", type=int, default=BASE_PORT, help="port of the first Guard")
+    parser.add_argument("--drive", action="store_true", help="drive the Guards and report")
+    parser.add_argument("--auto", action="store_true", help="drive the Guards in automatic mode")
+    parser.add_argument("--peer-port", type=int, default=BASE_PORT - 1, help="driver's port")
+    parser.add_argument("--rate", type=float, default=10, help="commands per second per Guard")
+    parser.add_argument("--duration", type=float, default=5, help="seconds")
+    args = parser.parse_args()
+
+    if not (args.drive or args.auto):
+        processes = start_guards(args.guards, args.port)
         try:
-            message, (ip_address, _port) = server.recvfrom(1024)
-            print(f"Rx [{ip_address}] {message}")
-
-            if b"ECHO" in message:
-                pass
-            elif b"MARCO" in message:
-                server.sendto(b"POLO", (ip_address, PORT))
-                print(f"Tx [{ip_address}] {b'POLO'}")
-            else:
-                message = b"ECHO " + message
-                server.sendto(message, (ip_address, PORT))
-                print(f"Tx [{ip_address}] {message}")
-
-        except TimeoutError:
-            pass  # this is to be expected if no message has been received
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            pass
+        return
+
+    sys.path.insert(0, str(GUARD_DIR))
+    processes = start_guards(args.guards, args.port, args.peer_port, TELEMETRY_PORT)
+    guard_ports = [args.port + index for index in range(args.guards)]
+    try:
+        sys.exit(asyncio.run(drive_guards(args, guard_ports)))
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()
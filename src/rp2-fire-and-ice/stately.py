@@ -1,5 +1,22 @@
 # State machine module class.
 
+import select
+
+try:
+    from utime import ticks_add, ticks_diff, ticks_ms
+except ImportError:
+    # running under CPython, eg: in a simulator
+    from time import monotonic
+
+    def ticks_ms():
+        return int(monotonic() * 1000)
+
+    def ticks_add(ticks, delta):
+        return ticks + delta
+
+    def ticks_diff(ticks_1, ticks_2):
+        return ticks_1 - ticks_2
+
 
 class STATES:
     """State machine state constants."""
@@ -14,32 +31,205 @@ class STATES:
     SHUTDOWN = 7
 
 
+TRACE_SIZE = 16  # transitions remembered by `StateMachine.trace`
+
+
+def state_names(states) -> dict:
+    """Return a {value: name} dictionary of the constants in a STATES class, for reports."""
+    return {value: name for name, value in states.__dict__.items() if not name.startswith("_")}
+
+
+class StateStats:
+    """Counters of the time spent in one state."""
+
+    def __init__(self) -> None:
+        self.entries = 0
+        self.iterations = 0
+        self.dwell_ms = 0  # total of completed visits
+
+
 class StateMachine:
     """
     State machine object class.
 
     Calls the appropriate function based on its current state.
 
-    The functions should return a STATES enum to set the next state to enter.
+    The functions should return a STATES enum to set the next state to enter, or None to stay.
+    Transitions may also be declared as a `{state: {event: next_state}}` table and taken by calling
+    `handle(event)`. `on_enter` and `on_exit` map states to hooks called as they are entered and
+    left, and `on_transition(old_state, new_state)` is called on every transition.
+
+    Recent transitions are kept in a ring buffer and the time spent in each state is counted,
+    so nothing needs to be printed while running, see `trace` and `report`.
+
+    If `period_ms` is given, the state function is called at that fixed rate and the time in between
+    is spent waiting in `select.poll` for registered streams, whose handlers are called as soon as
+    they become readable. Otherwise the state function is called as fast as possible.
     """
 
-    def __init__(self, state_functions, on_before_state=None, interrupt_state=None) -> None:
-        self.state = 0  # first state in the states enum
+    def __init__(
+        self,
+        state_functions,
+        on_before_state=None,
+        interrupt_state=None,
+        period_ms=None,
+        transitions=None,
+        on_enter=None,
+        on_exit=None,
+        on_transition=None,
+        initial_state=0,
+        names=None,
+        trace_size=TRACE_SIZE,
+    ) -> None:
+        self.state = initial_state  # first state in the states enum by default
         self.state_functions = state_functions
         self.on_before_state = on_before_state
         self.interrupt_state = interrupt_state
+        self.period_ms = period_ms
+        self.transitions = transitions or {}
+        self.on_enter = on_enter or {}
+        self.on_exit = on_exit or {}
+        self.on_transition = on_transition
+        self.names = names or {}
+        self.stats = {}
+        self._trace = [None] * trace_size
+        self._trace_index = 0
+        self._entered = ticks_ms()
+        self._current = self._stats_for(initial_state)
+        self._current.entries += 1
+        self._poller = select.poll()
+        self._poll = getattr(self._poller, "ipoll", self._poller.poll)  # ipoll does not allocate
+        self._handlers = {}
+
+    def register(self, stream, on_readable):
+        """Call `on_readable(stream)` whenever the stream, eg: a socket, has data to read."""
+        self.unregister(stream)
+        self._poller.register(stream, select.POLLIN)
+        self._handlers[stream] = (stream, on_readable)
+        if hasattr(stream, "fileno"):
+            # CPython's poll returns file descriptors rather than streams
+            self._handlers[stream.fileno()] = (stream, on_readable)
+
+    def unregister(self, stream):
+        # remove the file descriptor key too, found by stream as a closed one has no descriptor
+        keys = [
+            key for key, (registered, _handler) in self._handlers.items() if registered is stream
+        ]
+        if not keys:
+            return
+        for key in keys:
+            del self._handlers[key]
+        try:
+            self._poller.unregister(stream)
+        except (KeyError, OSError, ValueError):
+            pass  # already closed
+
+    def poll(self, timeout_ms: int):
+        """Wait up to timeout_ms for registered streams, calling the handlers of readable ones."""
+        for key, _event in self._poll(timeout_ms):
+            handler = self._handlers.get(key)
+            if handler:
+                stream, on_readable = handler
+                on_readable(stream)
+
+    def transition(self, next_state):
+        """Leave the current state for the next one, unless it is None or the current state."""
+        if next_state is None or next_state == self.state:
+            return
+
+        previous_state = self.state
+        hook = self.on_exit.get(previous_state)
+        if hook:
+            hook()
+
+        now = ticks_ms()
+        self._current.dwell_ms += ticks_diff(now, self._entered)
+        self._trace[self._trace_index] = (now, previous_state, next_state)
+        self._trace_index = (self._trace_index + 1) % len(self._trace)
+
+        self.state = next_state
+        self._entered = now
+        self._current = self._stats_for(next_state)
+        self._current.entries += 1
+
+        if self.on_transition:
+            self.on_transition(previous_state, next_state)
+        hook = self.on_enter.get(next_state)
+        if hook:
+            hook()
+
+    def handle(self, event) -> bool:
+        """Take the transition declared for the event, returning False if there is none."""
+        events = self.transitions.get(self.state)
+        if events is None or event not in events:
+            return False
+        self.transition(events[event])
+        return True
+
+    def step(self):
+        """Call the current state function once."""
+        if self.on_before_state:
+            self.on_before_state()
+        self._current.iterations += 1
+        self.transition(self.state_functions[self.state]())
 
     def run_loop(self):
         """Execute the state machine functions in a loop."""
         try:
+            deadline = ticks_ms()
             while True:
-                print(f"state={self.state}")  # TODO: remove debug print statement
-                if self.on_before_state:
-                    self.on_before_state()
-                next_state = self.state_functions[self.state]()
-                self.state = next_state or self.state
+                if self.period_ms is None:
+                    self.poll(0)
+                    self.step()
+                    continue
+
+                wait_ms = ticks_diff(deadline, ticks_ms())
+                if wait_ms > 0:
+                    self.poll(wait_ms)
+                    continue
+
+                self.step()
+                deadline = ticks_add(deadline, self.period_ms)
+                if ticks_diff(ticks_ms(), deadline) > 0:
+                    deadline = ticks_ms()  # overran, so start afresh rather than catch up
         except KeyboardInterrupt:
             # Keyboard interrupt is an expected way to stop the state machine
-            if self.interrupt_state:
-                next_state = self.state_functions[self.interrupt_state]()
-                self.state = next_state or self.state
+            if self.interrupt_state is not None:
+                self.transition(self.interrupt_state)
+                self.transition(self.state_functions[self.interrupt_state]())
+
+    def name(self, state) -> str:
+        return self.names.get(state, str(state))
+
+    def dwell_ms(self, state) -> int:
+        """Return the total time spent in the state, including the current visit."""
+        stats = self.stats.get(state)
+        if stats is None:
+            return 0
+        if state == self.state:
+            return stats.dwell_ms + ticks_diff(ticks_ms(), self._entered)
+        return stats.dwell_ms
+
+    def trace(self):
+        """Return the recent transitions as (ticks_ms, old_state, new_state), oldest first."""
+        index = self._trace_index
+        return [entry for entry in self._trace[index:] + self._trace[:index] if entry]
+
+    def report(self) -> str:
+        """Return a summary of the time spent in each state and the recent transitions."""
+        lines = [f"{'state':<16}{'entries':>8}{'dwell s':>9}{'loops/s':>9}"]
+        for state, stats in self.stats.items():
+            dwell_ms = self.dwell_ms(state)
+            rate = stats.iterations * 1000 / dwell_ms if dwell_ms else 0
+            lines.append(
+                f"{self.name(state):<16}{stats.entries:>8}{dwell_ms / 1000:>9.1f}{rate:>9.1f}"
+            )
+        for ticks, old_state, new_state in self.trace():
+            lines.append(f"{ticks:>10} {self.name(old_state)} -> {self.name(new_state)}")
+        return "\n".join(lines)
+
+    def _stats_for(self, state) -> StateStats:
+        stats = self.stats.get(state)
+        if stats is None:
+            stats = self.stats[state] = StateStats()
+        return stats
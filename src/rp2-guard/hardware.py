@@ -78,6 +78,9 @@ class Indicator:
     ORANGE = ((1, 0.2, 0), (1, 0.8, 0))
     BLUE = ((0, 0, 1), (0.2, 0.2, 1))
     PURPLE = ((0.7, 0, 0.7), (1, 0, 1))
+    RED = ((1, 0, 0), (1, 0.05, 0))
+
+    WARNING_BLINK_MS = 250
 
     def __init__(self, red_gpio, green_gpio, blue_gpio) -> None:
         self.red_pin = Pin(red_gpio, Pin.OUT)
@@ -93,6 +96,7 @@ class Indicator:
         self.blue_pwm.freq(1024)
 
         self.guise = self.OFF
+        self._warning = False
 
     def pwm_led(self, red: int, green: int, blue: int):
         """Set the led to the given PWM values out of 65535."""
@@ -107,6 +111,10 @@ class Indicator:
             if probability_change >= 0.005:
                 return
 
+        self.guise = guise
+        if self._warning:
+            guise = self.RED
+
         ((red_low, green_low, blue_low), (red_high, green_high, blue_high)) = guise
 
         red_value = random.randint(int(red_low * self.MAX_PWM), int(red_high * self.MAX_PWM))
@@ -115,6 +123,13 @@ class Indicator:
 
         self.pwm_led(red_value, green_value, blue_value)
 
+    def warn(self, warning: bool):
+        """Blink red over the current guise while warning, eg: of a degraded link."""
+        blink = warning and (time.ticks_ms() // self.WARNING_BLINK_MS) % 4 == 0
+        if blink != self._warning:
+            self._warning = blink
+            self.show_guise(self.guise)
+
     def toggle(self, guise_1, guise_2):
         if self.guise == guise_1:
             self.show_guise(guise_2)
@@ -130,6 +145,8 @@ class WiFi:
     broadcast = "255.255.255.255"
     host = "0.0.0.0"
     port = 50007  # arbitrary non-privileged port
+    peer_port = None  # port to send to, if not the same as our own, eg: when emulated
+    buffer_size = 256  # largest message that can be received
 
     def share_access_point(self):
         wlan = network.WLAN(network.AP_IF)
@@ -183,9 +200,9 @@ class WiFi:
         # Enable broadcasting mode
         client.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
 
-        # Set a timeout so the socket does not block
-        # indefinitely when trying to receive data.
-        client.settimeout(0.1)
+        # Never block when trying to receive data,
+        # the state machine polls the socket to learn when data has arrived.
+        client.setblocking(False)
 
         # Bind socket to port
         addr = socket.getaddrinfo(self.host, self.port, socket.AF_INET, socket.SOCK_DGRAM)[0][-1]
@@ -193,49 +210,78 @@ class WiFi:
 
         self.client = client
 
+        # Preallocate the receive buffer and resolve the broadcast address once
+        self._buffer = bytearray(self.buffer_size)
+        self._view = memoryview(self._buffer)
+        self._addresses = {}
+        self.broadcast_address = self.address(self.broadcast)
+
     def close_udp_socket(self):
         try:
             self.client.close()
         except Exception:
             pass  # ignore all exceptions, we just want to close
 
+    def address(self, ip_address):
+        """Return the socket address for the IP address, resolving it only on first use."""
+        address = self._addresses.get(ip_address)
+        if address is None:
+            address = socket.getaddrinfo(
+                ip_address,
+                self.peer_port or self.port,
+                socket.AF_INET,
+                socket.SOCK_DGRAM,
+            )[0][-1]
+            self._addresses[ip_address] = address
+        return address
+
     def send(self, message, ip_address=None):
+        """Send a str or bytes message to the IP address, or to the server if omitted."""
         if ip_address is None:
             ip_address = self.server_ip_address
 
-        address = socket.getaddrinfo(
-            ip_address,
-            self.port,
-            socket.AF_INET,
-            socket.SOCK_DGRAM,
-        )[0][-1]
-        self.client.sendto(message.encode(), address)
+        if isinstance(message, str):
+            message = message.encode()
+        self.client.sendto(message, self.address(ip_address))
 
-    def send_marco(self):
-        self.send("MARCO", ip_address=self.broadcast)
-        time.sleep(0.3)
+    def receive_into(self, include_ip_address=False):
+        """
+        Receive a message into the preallocated buffer without allocating a new one.
 
-    def receive(self, include_ip_address=False):
+        Returns a memoryview of the message, which is only valid until the next receive,
+        or None if no message has been received.
+        """
+        ip_address = None
         try:
-            data, (ip_address, _port) = self.client.recvfrom(1024)
-        except OSError:  # OSError: [Errno 110] ETIMEDOUT
+            if hasattr(self.client, "recvfrom_into"):
+                size, (ip_address, _port) = self.client.recvfrom_into(self._buffer)
+            elif include_ip_address:
+                # MicroPython sockets can only report the sender by allocating a new buffer
+                data, (ip_address, _port) = self.client.recvfrom(self.buffer_size)
+                size = len(data)
+                self._buffer[:size] = data
+            else:
+                size = self.client.readinto(self._buffer)
+        except OSError:  # OSError: [Errno 11] EAGAIN
             # To be expected if no message has been received
             return None
 
-        if include_ip_address:
-            return data, ip_address
+        if not size:
+            return None
 
-        return data
+        if include_ip_address:
+            return self._view[:size], ip_address
 
-    def receive_polo(self):
-        data = self.receive(include_ip_address=True)
+        return self._view[:size]
 
+    def receive(self, include_ip_address=False):
+        """Receive a message as bytes, or None if no message has been received."""
+        data = self.receive_into(include_ip_address)
         if data is None:
-            return
-
-        message, ip_address = data
+            return None
 
-        if "POLO" in message:
-            self.server_ip_address = ip_address
+        if include_ip_address:
+            view, ip_address = data
+            return bytes(view), ip_address
 
-            return True
+        return bytes(data)
@@ -1,18 +1,27 @@
 """Create host WiFi network."""
 
 import random
+import sys
 
 import utime
 from hardware import LED, PWM_LED, CorelessMotor, Switch, WiFi
-from stately import STATES, StateMachine
+from machine import unique_id
+from protocol import CONTROL_TYPES, Link, Status, StatusPublisher, Type, sender_id
+from stately import STATES, StateMachine, state_names
 
-ACCELERATION = 4  # percent / iteration
-DECELERATION = 100  # percent / iteration
+CONTROL_PERIOD = 10  # milliseconds between calls to the state functions
+ACCELERATION = 40 * CONTROL_PERIOD / 1000  # 40 percent / second
+DECELERATION = 1000 * CONTROL_PERIOD / 1000  # 1000 percent / second
 MAX_SPEED_AUTO = 40  # percent of maximum
 MIN_WAIT_BEFORE_CHANGING_DIRECTION = 1000  # milliseconds
 MAX_WAIT_BEFORE_CHANGING_DIRECTION = 7000  # milliseconds
+STATUS_HEARTBEAT = 1000  # milliseconds between repeats of an unchanged status
+PING_PERIOD = 1000  # milliseconds between link probes
 
+state_machine = None
 wifi = None
+link = None
+status = None
 stop_button = None
 fwd_sensor = None
 rev_sensor = None
@@ -35,24 +44,6 @@ class Direction:
     NONE = 0
     FORWARD = 1
 
-    @staticmethod
-    def letter(direction_number):
-        letters = {
-            -1: "R",
-            0: "N",
-            1: "F",
-        }
-        return letters[direction_number]
-
-    @staticmethod
-    def number(direction_letter):
-        numbers = {
-            "R": -1,
-            "N": 0,
-            "F": 1,
-        }
-        return numbers[direction_letter]
-
 
 def is_wait_over(wait_milliseconds):
     """Wait for the given period and return True after the period has passed."""
@@ -69,9 +60,19 @@ def is_wait_over(wait_milliseconds):
     return False
 
 
+def on_serial(stream):
+    """Print the link statistics and a state report when `s` is typed over serial."""
+    character = stream.read(1)
+    if not character:
+        state_machine.unregister(stream)  # nothing connected
+    elif character == "s" and link:
+        print(link.stats.report())
+        print(state_machine.report())
+
+
 def state_initialise():
     """Initialise state."""
-    global wifi_led, wifi, speed_led, motor, fwd_sensor, rev_sensor, stop_button
+    global wifi_led, wifi, link, status, speed_led, motor, fwd_sensor, rev_sensor, stop_button
 
     wifi_led = LED()
     stop_button = Switch(21)
@@ -81,6 +82,8 @@ def state_initialise():
     motor = CorelessMotor(0, scale_max_speed=0.3)
 
     wifi = WiFi()
+    link = Link(wifi, sender_id=sender_id(unique_id()), ping_period_ms=PING_PERIOD)
+    status = StatusPublisher(link, heartbeat_ms=STATUS_HEARTBEAT)
     wifi_led.pin.on()
 
     return STATES.CONNECT
@@ -92,6 +95,7 @@ def state_connect():
         wifi.share_access_point()
         utime.sleep(0.5)
         wifi.open_udp_socket()
+        state_machine.register(wifi.client, link.service)
         utime.sleep(0.5)
 
         return STATES.STOP
@@ -103,11 +107,11 @@ def state_stop():
     """Stop state."""
     global last_button_state, button_state_counter
 
-    wifi_led.pin.toggle()
+    wifi_led.pin.value((utime.ticks_ms() // 200) % 2)  # blink independently of the loop rate
     speed_led.off()
     motor.off()
 
-    wifi.send("STOPPED", wifi.broadcast)
+    status.publish(Status.STOPPED)
 
     current_button_state = stop_button.is_active()
 
@@ -122,16 +126,14 @@ def state_stop():
 
     last_button_state = current_button_state
 
-    data = wifi.receive(include_ip_address=True)
-    if data is None:
-        return  # skip further parsing
-
-    message, ip_address = data
-    if b"MARCO" in message:
-        wifi.send("POLO", ip_address)
-    elif b"CONTROL" in message:
+    message = link.receive()
+    if message is None:
+        pass  # skip further parsing
+    elif message.type == Type.MARCO:
+        link.send(Type.POLO, ip_address=wifi.broadcast)
+    elif message.type in CONTROL_TYPES and message.control_for(link.sender_id):
         return STATES.MANUAL
-    elif b"AUTO" in message:
+    elif message.type == Type.AUTO:
         return STATES.WAIT
 
 
@@ -142,16 +144,19 @@ def state_manual():
     if stop_button.is_active():
         return STATES.STOP
 
-    message = wifi.receive()
+    message = link.receive()
     if message is None:
         pass  # skip further parsing
-    elif b"CONTROL" in message:
-        _control, direction, speed = message.split()  # eg: CONTROL F 100 --> forward full speed
+    elif message.type in CONTROL_TYPES:
+        control = message.control_for(link.sender_id)
+        if control is None:
+            return  # only for other Guards
+        direction, speed = control  # eg: (1, 100) --> forward full speed
 
         speed_led.on()
-        speed_led.brightness(int(speed))
-        motor.on(Direction.number(direction.decode()), int(speed) / 100)
-    elif b"STOP" in message:
+        speed_led.brightness(speed)
+        motor.on(direction, speed / 100)
+    elif message.type == Type.STOP:
         return STATES.STOP
 
 
@@ -167,18 +172,18 @@ def state_forward():
     speed_led.brightness(new_speed)
     motor.on(current_direction, new_speed / 100)
 
-    wifi.send("FORWARD", wifi.broadcast)
+    status.publish(Status.FORWARD, new_speed)
 
     if stop_button.is_active():
         return STATES.STOP
     if fwd_sensor.is_active():
-        wifi.send("FORWARD_END", wifi.broadcast)
+        status.publish(Status.FORWARD_END, new_speed)
         return STATES.SLOW
 
-    message = wifi.receive()
+    message = link.receive()
     if message is None:
         pass  # skip further parsing
-    elif b"STOP" in message:
+    elif message.type == Type.STOP:
         return STATES.STOP
 
 
@@ -194,18 +199,18 @@ def state_reverse():
     speed_led.brightness(new_speed)
     motor.on(current_direction, new_speed / 100)
 
-    wifi.send("REVERSE", wifi.broadcast)
+    status.publish(Status.REVERSE, new_speed)
 
     if stop_button.is_active():
         return STATES.STOP
     if rev_sensor.is_active():
-        wifi.send("REVERSE_END", wifi.broadcast)
+        status.publish(Status.REVERSE_END, new_speed)
         return STATES.SLOW
 
-    message = wifi.receive()
+    message = link.receive()
     if message is None:
         pass  # skip further parsing
-    elif b"STOP" in message:
+    elif message.type == Type.STOP:
         return STATES.STOP
 
 
@@ -224,10 +229,10 @@ def state_slow():
     if fwd_sensor.is_active() and rev_sensor.is_active():
         return STATES.ERROR
 
-    message = wifi.receive()
+    message = link.receive()
     if message is None:
         pass  # skip further parsing
-    elif b"STOP" in message:
+    elif message.type == Type.STOP:
         return STATES.STOP
 
 
@@ -244,6 +249,13 @@ def state_wait():
     if is_wait_over(wait_milliseconds):
         return STATES.BOUNCE
 
+    message = link.receive()
+    if message is None:
+        pass  # skip further parsing
+    elif message.type == Type.STOP:
+        future_ticks = None
+        return STATES.STOP
+
 
 def state_bounce():
     """Change direction."""
@@ -252,7 +264,7 @@ def state_bounce():
     motor.off()
     wifi_led.pin.off()
 
-    wifi.send("BOUNCE", wifi.broadcast)
+    status.publish(Status.BOUNCE)
 
     # wait for button to be released before continuing to prevent unintentional stop signal
     if stop_button.is_active():
@@ -270,15 +282,15 @@ def state_error():
     speed_led.off()
     motor.off()
 
-    wifi.send("ERROR", wifi.broadcast)
+    status.publish(Status.ERROR)
 
     if stop_button.is_active():
         return STATES.STOP
 
-    message = wifi.receive()
+    message = link.receive()
     if message is None:
         pass  # skip further parsing
-    elif b"STOP" in message:
+    elif message.type == Type.STOP:
         return STATES.STOP
 
 
@@ -306,5 +318,12 @@ if __name__ == "__main__":
         STATES.ERROR: state_error,
         STATES.SHUTDOWN: state_shutdown,
     }
-    state_machine = StateMachine(state_functions, interrupt_state=STATES.SHUTDOWN)
+    state_machine = StateMachine(
+        state_functions,
+        interrupt_state=STATES.SHUTDOWN,
+        period_ms=CONTROL_PERIOD,
+        names=state_names(STATES),
+    )
+    state_machine.register(sys.stdin, on_serial)
     state_machine.run_loop()
+    print(state_machine.report())
@@ -0,0 +1,505 @@
+"""
+A compact binary protocol for the Guard and Fire-and-Ice UDP link.
+
+Every packet starts with a five byte header followed by a type-specific payload:
+
+    | type (1) | sender (2, big-endian) | sequence (2, big-endian) | payload... |
+
+The sender is the low 16 bits of the board's unique id, see `sender_id`, so that boards rarely share
+one. Should two boards share an id anyway, each drops the other's messages as its own broadcasts,
+so a MARCO or POLO that claims our id but that we did not send is counted as a collision.
+
+Safety-critical commands (STOP) are acknowledged by the receiver and retransmitted by the sender
+until they are acknowledged, so a stop arrives in bounded time even if packets are dropped.
+Receivers suppress duplicates by remembering the latest sequence numbers from each sender.
+Acknowledgements and POLO replies are broadcast, so neither side needs the sender's address.
+
+Guard status is broadcast by a `StatusPublisher` only when it changes, plus a periodic heartbeat.
+Each status carries its own counter so a `StatusMonitor` can count the ones that were lost.
+The heartbeat only repeats steady statuses, so transient ones, eg: BOUNCE, are acknowledged and
+retransmitted like STOP, as a lost one would otherwise never be seen.
+
+Either end may probe the link with PING, answered with PONG, to measure round-trip times and loss.
+"""
+
+import struct
+from array import array
+
+try:
+    from utime import ticks_add, ticks_diff, ticks_ms
+except ImportError:
+    # running under CPython, eg: in a simulator
+    from time import monotonic
+
+    def ticks_ms():
+        return int(monotonic() * 1000)
+
+    def ticks_add(ticks, delta):
+        return ticks + delta
+
+    def ticks_diff(ticks_1, ticks_2):
+        return ticks_1 - ticks_2
+
+
+HEADER = "!BHH"
+HEADER_SIZE = 5
+RETRANSMIT_MS = 100
+MAX_RETRANSMITS = 20  # give up after two seconds
+HEARTBEAT_MS = 1000  # repeat an unchanged status this often
+STALE_STATUS_WINDOW = 256  # status counters behind the latest that are late rather than a restart
+DUPLICATE_HISTORY = 8  # sequence numbers remembered per sender
+INBOX_SIZE = 8  # messages queued by `Link.service` until they are received, dropping the oldest
+COLLISION_WINDOW = 64  # sequence numbers of our own recent messages, as echoed by broadcast
+PROBE_HISTORY = 32  # probes remembered by `LinkStats`
+DEGRADED_RTT_MS = 100  # 90th percentile round-trip time of a degraded link
+DEGRADED_LOSS = 0.2  # fraction of probes lost on a degraded link
+
+
+class Type:
+    """Message type constants, the first byte of every packet."""
+
+    MARCO = 1  # discover Guards
+    POLO = 2  # reply to MARCO
+    STOP = 3  # stop the train, acknowledged
+    CONTROL = 4  # payload: direction (int8), speed percent (uint8)
+    AUTO = 5  # start automatic mode
+    TRIGGER = 6  # manual trigger during automatic mode
+    STATUS = 7  # payload: Status (uint8), speed percent (uint8), status counter (uint16)
+    ACK = 8  # payload: acknowledged sender (uint16), acknowledged sequence (uint16)
+    CONTROL_MULTI = 9  # payload: repeated Guard id (uint16), direction (int8), speed (uint8)
+    PING = 10  # payload: probe (uint16), sent ticks_ms (uint32)
+    PONG = 11  # payload: probing sender (uint16), then the PING payload
+
+
+RELIABLE_TYPES = (Type.STOP,)
+CONTROL_TYPES = (Type.CONTROL, Type.CONTROL_MULTI)
+
+
+class Status:
+    """Guard status constants, the payload of STATUS messages."""
+
+    STOPPED = 0
+    FORWARD = 1
+    REVERSE = 2
+    FORWARD_END = 3
+    REVERSE_END = 4
+    BOUNCE = 5
+    ERROR = 6
+
+
+TRANSIENT_STATUSES = (Status.FORWARD_END, Status.REVERSE_END, Status.BOUNCE)
+
+
+def sender_id(board_id: bytes) -> int:
+    """Return the sender id for a board, from the last two bytes of `machine.unique_id()`."""
+    return (board_id[-2] << 8) | board_id[-1]
+
+
+def encode(type, sender, sequence, payload=b""):
+    """Return a packet for the message."""
+    return struct.pack(HEADER, type, sender, sequence) + payload
+
+
+class Message:
+    """A received message, whose payload is only valid until the next message is received."""
+
+    def __init__(self) -> None:
+        self.type = None
+        self.sender = None
+        self.sequence = None
+        self.payload = None
+        self.ip_address = None
+
+    def parse(self, packet, ip_address=None) -> bool:
+        """Parse the packet in place, returning False if it is too short to be a message."""
+        if len(packet) < HEADER_SIZE:
+            return False
+        self.type = packet[0]
+        self.sender = (packet[1] << 8) | packet[2]
+        self.sequence = (packet[3] << 8) | packet[4]
+        self.payload = packet[HEADER_SIZE:]
+        self.ip_address = ip_address
+        return True
+
+    def control(self):
+        """Return the (direction, speed) of a CONTROL message."""
+        direction = self.payload[0]
+        if direction > 127:
+            direction -= 256
+        return direction, self.payload[1]
+
+    def control_for(self, guard_id: int):
+        """Return the (direction, speed) for the Guard in either kind of control message, or None."""
+        if self.type == Type.CONTROL:
+            return self.control()
+        payload = self.payload
+        for index in range(0, len(payload) - 3, 4):
+            if (payload[index] << 8) | payload[index + 1] == guard_id:
+                direction = payload[index + 2]
+                if direction > 127:
+                    direction -= 256
+                return direction, payload[index + 3]
+        return None
+
+    def status(self):
+        """Return the Status of a STATUS message."""
+        return self.payload[0]
+
+    def speed(self):
+        """Return the speed percent of a STATUS message."""
+        return self.payload[1]
+
+    def counter(self):
+        """Return the status counter of a STATUS message."""
+        return (self.payload[2] << 8) | self.payload[3]
+
+    def is_reliable(self) -> bool:
+        """Return whether the message must be acknowledged."""
+        if self.type == Type.STATUS:
+            return self.status() in TRANSIENT_STATUSES
+        return self.type in RELIABLE_TYPES
+
+    def acknowledged(self):
+        """Return the (sender, sequence) acknowledged by an ACK message."""
+        payload = self.payload
+        return (payload[0] << 8) | payload[1], (payload[2] << 8) | payload[3]
+
+
+class LinkStats:
+    """Rolling round-trip times and loss of link probes, kept in fixed-size arrays."""
+
+    def __init__(self, size: int = PROBE_HISTORY) -> None:
+        self.size = size
+        self.rtt_ms = array("H", [0] * size)
+        self.answered = array("B", [0] * size)
+        self.probes = 0  # sent
+        self.replies = 0
+        self.samples = 0  # round-trip times recorded
+        self.degraded = False
+
+    def sent(self) -> int:
+        """Record a new probe, returning its number."""
+        probe = self.probes & 0xFFFF
+        self.degraded = self.loss() >= DEGRADED_LOSS or self.percentile(0.9) >= DEGRADED_RTT_MS
+        self.answered[probe % self.size] = 0
+        self.probes += 1
+        return probe
+
+    def replied(self, probe: int, rtt_ms: int):
+        index = probe % self.size
+        if self.answered[index] or (self.probes - 1 - probe) & 0xFFFF >= self.size:
+            return  # already answered, eg: by another Guard, or too old to remember
+        self.answered[index] = 1
+        self.rtt_ms[self.samples % self.size] = min(rtt_ms, 0xFFFF)
+        self.samples += 1
+        self.replies += 1
+
+    def loss(self) -> float:
+        """Return the fraction of recent probes that were not answered, ignoring the latest."""
+        count = min(self.probes - 1, self.size - 1)
+        if count <= 0:
+            return 0.0
+        latest = (self.probes - 1) % self.size
+        lost = 0
+        for offset in range(1, count + 1):
+            lost += 1 - self.answered[(latest - offset) % self.size]
+        return lost / count
+
+    def percentile(self, fraction: float) -> int:
+        """Return a percentile of the recent round-trip times in milliseconds, or 0 if none."""
+        count = min(self.samples, self.size)
+        if count == 0:
+            return 0
+        samples = sorted(self.rtt_ms[:count])
+        return samples[min(count - 1, max(0, int(fraction * count + 0.5) - 1))]
+
+    def report(self) -> str:
+        return (
+            f"probes={self.probes} replies={self.replies} loss={self.loss():.0%} "
+            f"rtt p50={self.percentile(0.5)}ms p90={self.percentile(0.9)}ms "
+            f"p99={self.percentile(0.99)}ms degraded={self.degraded}"
+        )
+
+
+class Link:
+    """Sequenced messages over a `WiFi` connection, with retransmission of reliable messages."""
+
+    def __init__(self, wifi, sender_id: int, ping_period_ms: int = None) -> None:
+        self.wifi = wifi
+        self.sender_id = sender_id & 0xFFFF
+        self.message = Message()
+        self.stats = LinkStats()
+        self.ping_period_ms = ping_period_ms
+        self._ping_deadline = ticks_ms()
+        self.retransmits = 0
+        self.failures = 0  # reliable messages that were never acknowledged
+        self.collisions = 0  # messages from another board with our sender id
+        self.dropped = 0  # messages dropped from a full inbox before they were received
+        self._sequence = 0
+        self._pending = {}  # sequence: [packet, ip_address, deadline, attempts]
+        self._history = {}  # sender: recent sequence numbers
+        self.heard = {}  # sender: ticks_ms of its latest message, link messages included
+        # preallocated (buffer, Message) slots for messages read ahead by `service`
+        self._inbox = [(bytearray(wifi.buffer_size), Message()) for _ in range(INBOX_SIZE)]
+        self._inbox_start = 0
+        self._inbox_count = 0
+
+    def send(self, type, payload=b"", ip_address=None, reliable=None) -> int:
+        """
+        Send a message, returning its sequence number.
+
+        Messages are retransmitted until acknowledged if reliable, by default if of a reliable type.
+        """
+        self._sequence = (self._sequence + 1) & 0xFFFF
+        packet = encode(type, self.sender_id, self._sequence, payload)
+        self.wifi.send(packet, ip_address)
+        if reliable is None:
+            reliable = type in RELIABLE_TYPES
+        if reliable:
+            # a repeated command supersedes any earlier copy still awaiting acknowledgement
+            for sequence, pending in list(self._pending.items()):
+                if pending[0][0] == type and pending[1] == ip_address:
+                    del self._pending[sequence]
+            deadline = ticks_add(ticks_ms(), RETRANSMIT_MS)
+            self._pending[self._sequence] = [packet, ip_address, deadline, 1]
+        return self._sequence
+
+    def send_control(self, direction: int, speed: int, ip_address=None) -> int:
+        return self.send(Type.CONTROL, bytes((direction & 0xFF, speed)), ip_address)
+
+    def send_control_multi(self, controls) -> int:
+        """Broadcast a (guard_id, direction, speed) control for each Guard in one message."""
+        payload = bytearray()
+        for guard_id, direction, speed in controls:
+            payload.extend(struct.pack("!HBB", guard_id, direction & 0xFF, speed))
+        return self.send(Type.CONTROL_MULTI, bytes(payload), self.wifi.broadcast)
+
+    def send_status(self, status: int, speed: int = 0, counter: int = 0) -> int:
+        payload = bytes((status, speed, (counter >> 8) & 0xFF, counter & 0xFF))
+        reliable = status in TRANSIENT_STATUSES
+        return self.send(Type.STATUS, payload, self.wifi.broadcast, reliable)
+
+    def send_marco(self) -> int:
+        return self.send(Type.MARCO, ip_address=self.wifi.broadcast)
+
+    def ping(self, ip_address=None) -> int:
+        """Probe the link, to the broadcast address if omitted, returning the probe number."""
+        probe = self.stats.sent()
+        payload = struct.pack("!HI", probe, ticks_ms() & 0xFFFFFFFF)
+        self.send(Type.PING, payload, ip_address or self.wifi.broadcast)
+        return probe
+
+    def is_pending(self, sequence=None) -> bool:
+        """Return whether the reliable message, or any if omitted, awaits acknowledgement."""
+        if sequence is None:
+            return len(self._pending) > 0
+        return sequence in self._pending
+
+    def retransmit(self):
+        """Resend reliable messages whose acknowledgement is overdue, and probe if it is due."""
+        now = ticks_ms()
+        if self.ping_period_ms and ticks_diff(self._ping_deadline, now) <= 0:
+            self._ping_deadline = ticks_add(now, self.ping_period_ms)
+            self.ping()
+        if not self._pending:
+            return
+        for sequence, pending in list(self._pending.items()):
+            packet, ip_address, deadline, attempts = pending
+            if ticks_diff(deadline, now) > 0:
+                continue
+            if attempts > MAX_RETRANSMITS:
+                del self._pending[sequence]
+                self.failures += 1
+                continue
+            self.wifi.send(packet, ip_address)
+            pending[2] = ticks_add(now, RETRANSMIT_MS)
+            pending[3] = attempts + 1
+            self.retransmits += 1
+
+    def service(self, _stream=None):
+        """
+        Read every waiting message into the inbox, dropping the oldest if it is full.
+
+        Intended as a `StateMachine.register` handler, so that acknowledgements, probes and
+        duplicates are handled as soon as a message arrives rather than when the next state function
+        runs. The socket is always emptied, as otherwise it stays readable and the poll spins.
+        """
+        self.retransmit()
+        while True:
+            packet = self._read(False)
+            if packet is None:
+                return
+            if self._inbox_count == INBOX_SIZE:
+                self._inbox_start = (self._inbox_start + 1) % INBOX_SIZE
+                self._inbox_count -= 1
+                self.dropped += 1
+            index = (self._inbox_start + self._inbox_count) % INBOX_SIZE
+            buffer, message = self._inbox[index]
+            size = len(packet)
+            buffer[:size] = packet
+            message.parse(memoryview(buffer)[:size], self.message.ip_address)
+            self._inbox_count += 1
+
+    def receive(self, include_ip_address=False):
+        """
+        Receive the next new message, or None if there is none.
+
+        Messages already read by `service` are returned first.
+        Acknowledgements are handled here and duplicates are suppressed, so neither is returned.
+        The returned Message is reused by later calls.
+        """
+        self.retransmit()
+        if self._inbox_count:
+            _buffer, message = self._inbox[self._inbox_start]
+            self._inbox_start = (self._inbox_start + 1) % INBOX_SIZE
+            self._inbox_count -= 1
+            return message
+
+        if self._read(include_ip_address) is None:
+            return None
+        return self.message
+
+    def _read(self, include_ip_address):
+        """Parse the next new message from the socket into `self.message`, returning its packet."""
+        while True:
+            data = self.wifi.receive_into(include_ip_address)
+            if data is None:
+                return None
+            if include_ip_address:
+                packet, ip_address = data
+            else:
+                packet, ip_address = data, None
+
+            message = self.message
+            if not message.parse(packet, ip_address):
+                continue  # malformed
+            if message.sender == self.sender_id:
+                self._check_collision(message)
+                continue  # our own broadcast
+
+            self.heard[message.sender] = ticks_ms()
+            if self._handle_link_message(message):
+                continue
+
+            if message.is_reliable():
+                # acknowledge every copy, in case an earlier acknowledgement was lost
+                ack = struct.pack("!HH", message.sender, message.sequence)
+                self.send(Type.ACK, ack, self.wifi.broadcast)
+
+            if self._is_duplicate(message.sender, message.sequence):
+                continue
+
+            return packet
+
+    def _handle_link_message(self, message) -> bool:
+        """Handle messages about the link itself, returning False for any other message."""
+        if message.type == Type.ACK:
+            sender, sequence = message.acknowledged()
+            if sender == self.sender_id:
+                self._pending.pop(sequence, None)
+        elif message.type == Type.PING:
+            pong = struct.pack("!H", message.sender) + bytes(message.payload)
+            self.send(Type.PONG, pong, self.wifi.broadcast)
+        elif message.type == Type.PONG:
+            if (message.payload[0] << 8) | message.payload[1] == self.sender_id:
+                probe, sent_ticks = struct.unpack_from("!HI", message.payload, 2)
+                self.stats.replied(probe, ticks_diff(ticks_ms() & 0xFFFFFFFF, sent_ticks))
+        else:
+            return False
+        return True
+
+    def _check_collision(self, message):
+        """Count a discovery message with our sender id but a sequence we have not recently sent."""
+        if message.type not in (Type.MARCO, Type.POLO):
+            return
+        if (self._sequence - message.sequence) & 0xFFFF < COLLISION_WINDOW:
+            return  # most likely our own broadcast
+        self.collisions += 1
+        print(f"Sender id {self.sender_id:#06x} is also used by another board")
+
+    def _is_duplicate(self, sender, sequence) -> bool:
+        history = self._history.get(sender)
+        if history is None:
+            history = self._history[sender] = []
+        if sequence in history:
+            return True
+        history.append(sequence)
+        if len(history) > DUPLICATE_HISTORY:
+            history.pop(0)
+        return False
+
+
+class StatusPublisher:
+    """
+    Broadcast the status when it or the speed changes, otherwise only as a heartbeat.
+
+    Transient statuses are sent reliably by `Link.send_status`, as the heartbeat is soon replaced.
+    """
+
+    def __init__(self, link: Link, heartbeat_ms: int = HEARTBEAT_MS) -> None:
+        self.link = link
+        self.heartbeat_ms = heartbeat_ms
+        self.counter = 0
+        self.suppressed = 0
+        self._status = None
+        self._speed = None
+        self._deadline = None
+
+    def publish(self, status: int, speed: int = 0) -> bool:
+        """Broadcast the status if it is new or a heartbeat is due, returning whether it was sent."""
+        speed = max(0, min(int(speed), 255))
+        now = ticks_ms()
+        if status == self._status and speed == self._speed and ticks_diff(self._deadline, now) > 0:
+            self.suppressed += 1
+            return False
+
+        self.counter = (self.counter + 1) & 0xFFFF
+        self.link.send_status(status, speed, self.counter)
+        self._status = status
+        self._speed = speed
+        self._deadline = ticks_add(now, self.heartbeat_ms)
+        return True
+
+
+class StatusMonitor:
+    """Follow the status published by a Guard, counting the status messages that went missing."""
+
+    def __init__(self) -> None:
+        self.status = None
+        self.speed = None
+        self.received = 0
+        self.lost = 0
+        self.late = 0  # older statuses received after a newer one
+        self.last_ticks = None
+        self._counter = None
+
+    def observe(self, message: Message) -> bool:
+        """
+        Record a STATUS message, returning True if the status differs from the last one.
+
+        A status older than the last one, eg: a late retransmitted BOUNCE, is counted but otherwise
+        ignored, so that it does not replace the newer status.
+        """
+        counter = message.counter()
+        self.received += 1
+        self.last_ticks = ticks_ms()
+        if self._counter is not None:
+            gap = (counter - self._counter) & 0xFFFF
+            if gap < 0x8000:
+                self.lost += max(0, gap - 1)
+            elif (self._counter - counter) & 0xFFFF < STALE_STATUS_WINDOW:
+                # a retransmitted transient status, already counted as lost
+                self.lost = max(0, self.lost - 1)
+                self.late += 1
+                return False
+            # otherwise the Guard has restarted its counter
+        self._counter = counter
+
+        changed = message.status() != self.status
+        self.status = message.status()
+        self.speed = message.speed()
+        return changed
+
+    def is_silent(self, timeout_ms: int = 3 * HEARTBEAT_MS) -> bool:
+        """Return whether no status has been received for longer than a few heartbeats."""
+        return self.last_ticks is None or ticks_diff(ticks_ms(), self.last_ticks) > timeout_ms
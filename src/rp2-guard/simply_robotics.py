@@ -40,13 +40,17 @@ class Direction:
 class PWM_Motor:
     """A motor controlled using PWM."""
 
-    def __init__(self, motor_number, frequency, scale_max_speed=1.0):
+    BAND_HYSTERESIS = 0.02  # fraction of full speed to lose before dropping to a lower band
+
+    def __init__(self, motor_number, frequency, scale_max_speed=1.0, frequency_bands=None):
         """
         Create a new motor from the given motor number (1-4).
 
         The base frequency of the PWM signal - depends on motor type.
         The maximum speed can be reduced by setting scale_max_speed to (0.0-1.0).
         Coreless motors should set frequency to 20_000 Hz.
+        The frequency can instead follow the speed with a table of (upper speed, frequency) bands,
+        the last of which covers all higher speeds.
         """
         forwardPin, reversePin = MOTOR_CONNECTIONS[motor_number]
 
@@ -54,6 +58,8 @@ class PWM_Motor:
         self.reversePin = PWM(Pin(reversePin))
         self.scale_max_speed = scale_max_speed
         self.frequency = frequency
+        self.frequency_bands = frequency_bands or ((1.0, frequency),)
+        self.band = 0
         self.forwardPin.freq(frequency)
         self.reversePin.freq(frequency)
 
@@ -68,6 +74,13 @@ class PWM_Motor:
         # Restrict speed to 0.0 - 1.0
         speed = max(0.0, min(speed, 1.0))
 
+        frequency = self.select_frequency(speed)
+        if frequency != self.frequency:
+            # only reprogram the PWM divider when the band changes
+            self.forwardPin.freq(frequency)
+            self.reversePin.freq(frequency)
+            self.frequency = frequency
+
         # Convert 0-1 to 0-65535
         pwmVal = int(speed * self.scale_max_speed * 65535)
 
@@ -86,6 +99,20 @@ class PWM_Motor:
         else:
             raise RuntimeError(f"The provided direction '{direction}' is invalid.")
 
+    def select_frequency(self, speed):
+        """Return the frequency of the band for the speed, switching down bands with hysteresis."""
+        bands = self.frequency_bands
+        band = self.band
+
+        while band < len(bands) - 1 and speed >= bands[band][0]:
+            band += 1
+
+        while band > 0 and speed < bands[band - 1][0] - self.BAND_HYSTERESIS:
+            band -= 1
+
+        self.band = band
+        return bands[band][1]
+
     def off(self):
         """Turn off motor, setting direction to neutral and speed to zero."""
         self.on(Direction.NEUTRAL, 0)
@@ -94,9 +121,14 @@ class PWM_Motor:
 class DC_Motor(PWM_Motor):
     """A DC motor controller."""
 
-    def __init__(self, motor_number, scale_max_speed=1.0, frequency=100):
+    def __init__(self, motor_number, scale_max_speed=1.0, frequency=100, frequency_bands=None):
         """Create a new DC motor from the given motor number (1-4)."""
-        super().__init__(motor_number, scale_max_speed=scale_max_speed, frequency=frequency)
+        super().__init__(
+            motor_number,
+            scale_max_speed=scale_max_speed,
+            frequency=frequency,
+            frequency_bands=frequency_bands,
+        )
 
 
 class CorelessMotor(PWM_Motor):
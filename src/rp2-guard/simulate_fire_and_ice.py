@@ -9,8 +9,11 @@ sources:
 
 import socket
 import time
-from random import choice
+from random import choice, randint
 
+from protocol import Type, encode
+
+SENDER_ID = 0xFD
 HOST = ""  # Symbolic name meaning all available interfaces
 PORT = 50007  # Arbitrary non-privileged port
 with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as client:
@@ -31,8 +34,11 @@ with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as cli
     client.bind((HOST, PORT))
 
     for count in range(100):
-        message = f"{count}|{choice(['A very important message', 'MARCO'])}"
+        message_type = choice([Type.MARCO, Type.CONTROL])
+        payload = b""
+        if message_type == Type.CONTROL:
+            payload = bytes((choice([-1, 1]) & 0xFF, randint(0, 100)))  # direction, speed
         ip_address = "<broadcast>"
-        client.sendto(message.encode(), (ip_address, PORT))
-        print(f"Tx [{ip_address}] {message}")
+        client.sendto(encode(message_type, SENDER_ID, count, payload), (ip_address, PORT))
+        print(f"Tx [{ip_address}] {message_type} #{count} {payload}")
         time.sleep(2)
@@ -14,10 +14,18 @@ API:
             degrees - angle to go to (0 - 180)
             radians - radians to go to (0 - 3.1416 (Pi to four digits))
             period - pulse length to output in uSec (500 - 2500)    
+
+    servoMover - moves many servos smoothly, a few at a time, to limit the current drawn
+        servoMover.moveToPosition(WHICH_SERVO, degrees): Queues a servo to move to a position in degrees.
+        servoMover.moveToPeriod(WHICH_SERVO, period): Queues a servo to move to a pulse length period.
+        servoMover.isMoving(): Whether any servo is still moving or waiting to move.
+        servoMover.startTimer(): Moves the servos in the background, stopping once they have all arrived.
         
     motors[] - array of 4 motors
         motors[WHICH_MOTOR].on(direction, speed): Turns the motor on at a speed in the direction.
         motors[WHICH_MOTOR].off(): Turns the motor off.
+        motors[WHICH_MOTOR].selectBand(speed): Returns the PWM frequency for the speed, with hysteresis.
+        motors[WHICH_MOTOR].stats(): Counts of PWM register writes made and skipped as unchanged.
             where:
             WHICH_MOTOR - the motor to control (0 - 3)
             direction - either forwards or reverse ("f" or "r")
@@ -29,13 +37,26 @@ API:
             where:
             WHICH_STEPPER - the stepper motor to control (0 or 1)
             direction - either forwards or reverse ("f" or "r")
+        steppers[WHICH_STEPPER].moveTo(position, maxRate, acceleration, halfStep): Starts moving to the
+            position in the background, ramping the step rate up and down, and returns immediately.
+        steppers[WHICH_STEPPER].isMoving(): Whether a moveTo is still in progress.
+        steppers[WHICH_STEPPER].stop(): Stops a moveTo at the current position.
+        steppers[WHICH_STEPPER].position: The number of full steps from the start, eg: 2.5.
+            where:
+            position - full steps from where the stepper started, eg: 2.5 if half stepping
+            maxRate - fastest steps (or half steps) per second, starting slower if above 50
+            acceleration - steps (or half steps) per second per second
+            halfStep - True to move by half steps
         
         Note: stepper 0 should be connected to motors 0 and 1,
               stepper 1 should be connected to motors 3 and 4
 """
 
 
-from machine import PWM, Pin
+from math import sqrt
+
+from machine import PWM, Pin, Timer
+from utime import ticks_add, ticks_diff, ticks_ms
 
 from rp2 import PIO, StateMachine, asm_pio
 
@@ -46,6 +67,11 @@ It makes no assumptions about steps per rev - that is upto the higher level code
 This class will drive 4 wire, bipolar steppers. 
 These have 2 coils which are alternately energised to make a step.
 The class is passed the pairs of motors from the board as these are analogous to the coils.
+
+moveTo plays a trapezoidal ramp of step intervals from a one-shot timer, so the steps are evenly
+timed and the caller is free while the stepper moves. The ramp is symmetric, so the interval before
+each step is computed as it is taken rather than stored for the whole move.
+The position is kept in half steps, so that full and half step moves can be mixed.
 """
 
 
@@ -62,62 +88,181 @@ class StepperMotor:
         ["f", "f"],
     ]
 
+    # Slowest step rate, to start and end a move from, unless the move's maxRate is slower still.
+    startRate = 50
+
     def __init__(self, coilA, coilB):
         self.coils = [coilA, coilB]
+        # Index into halfStepSequence, every other entry of which is in stepSequence
         self.state = 0
+        self.halfSteps = 0
+        self.direction = "f"
+        self.halfStepping = False
+        # The move in progress: half steps still to go, and the steps taken out of all its steps
+        self.remaining = 0
+        self.stepIndex = 0
+        self.stepCount = 0
+        self.maxRate = 0
+        self.acceleration = 0
+        self.timer = None
+        # Bind the callback once, so that the timer does not allocate on every step
+        self.onTimerCallback = self.onTimer
+
+    # Full steps from the start, ending in .5 after an odd number of half steps
+    @property
+    def position(self):
+        return self.halfSteps / 2
 
     # Full stepping is 4 states, each coil only energised in turn and one at once.
     def step(self, direction="f"):
-        if direction == "f":
-            self.state += 1
-
-        elif direction == "r":
-            self.state -= 1
-
-        else:
-            # Harsh, but at least you'll know
-            raise Exception("INVALID DIRECTION")
-
-        if self.state > 3:
-            self.state = 0
-
-        if self.state < 0:
-            self.state = 3
-
-        for i in range(2):
-            self.coils[i].on(self.stepSequence[self.state][i], 100)
+        self.advance(direction, 2)
 
     # Half stepping is each coil energised in turn, but sometimes both at ones (holds halfway between positions)
     def halfStep(self, direction="f"):
-        if direction == "f":
-            self.state += 1
+        self.advance(direction, 1)
 
-        elif direction == "r":
-            self.state -= 1
+    # Move the coils on by a number of half steps through halfStepSequence
+    def advance(self, direction, halfSteps):
+        if direction == "r":
+            halfSteps = -halfSteps
 
-        else:
+        elif direction != "f":
             # Harsh, but at least you'll know
             raise Exception("INVALID DIRECTION")
 
-        if self.state > 7:
-            self.state = 0
-
-        if self.state < 0:
-            self.state = 7
+        self.state = (self.state + halfSteps) % 8
+        self.halfSteps += halfSteps
 
         for i in range(2):
             self.coils[i].on(self.halfStepSequence[self.state][i], 100)
 
+    # The interval in uSec before step i of a move, accelerating from startRate up to maxRate and back
+    @classmethod
+    def stepInterval(cls, i, steps, maxRate, acceleration):
+        startRate = min(cls.startRate, maxRate)
+        # speed after accelerating for i steps, or before decelerating for the remaining steps
+        rate = sqrt(startRate * startRate + 2 * acceleration * min(i, steps - 1 - i))
+        return int(1000000 / min(rate, maxRate))
+
+    # Start moving to a position in full steps without waiting for the move to finish
+    def moveTo(self, position, maxRate=500, acceleration=2000, halfStep=False):
+        if maxRate <= 0:
+            raise ValueError("maxRate must be more than 0 steps per second")
+
+        self.stop()
+
+        remaining = round(position * 2) - self.halfSteps
+        if remaining == 0:
+            return
+
+        self.direction = "f" if remaining > 0 else "r"
+        self.halfStepping = halfStep
+        self.remaining = abs(remaining)
+        # A full step move to or from a half step position ends with a half step
+        self.stepCount = self.remaining if halfStep else (self.remaining + 1) // 2
+        self.stepIndex = 0
+        self.maxRate = maxRate
+        self.acceleration = acceleration
+        self.timer = Timer()
+        self.armTimer()
+
+    def armTimer(self):
+        intervalUs = self.stepInterval(
+            self.stepIndex, self.stepCount, self.maxRate, self.acceleration
+        )
+        self.timer.init(
+            mode=Timer.ONE_SHOT, freq=1000000 / intervalUs, callback=self.onTimerCallback
+        )
+
+    def onTimer(self, timer):
+        if self.timer is None:
+            return  # stopped
+
+        halfSteps = 1 if self.halfStepping or self.remaining == 1 else 2
+        self.advance(self.direction, halfSteps)
+        self.remaining -= halfSteps
+
+        self.stepIndex += 1
+        if self.remaining > 0:
+            self.armTimer()
+        else:
+            self.stop()
+
+    def isMoving(self):
+        return self.timer is not None
+
+    def stop(self):
+        if self.timer is not None:
+            self.timer.deinit()
+            self.timer = None
+        self.remaining = 0
+
 
 # This class provides a simple wrapper to the micropython PWM pins to hold them in a set for each motor
+# The frequency and duty of each pin are cached, so that only the registers that change are written.
+# Reprogramming the PWM divider is slow and can glitch the output, and on() is called many times a second.
+#
+# The frequency may follow the speed through a table of (upper speed, frequency) bands, eg: a low
+# frequency gives DC motors more torque at low speed. The last band covers all higher speeds.
+# A band is only left for a lower one once the speed has fallen a hysteresis below its bound,
+# so that a speed hovering around a bound does not keep switching the frequency.
 class SimplePWMMotor:
-    def __init__(self, forwardPin, reversePin, startfreq=100):
+    # override frequency for coreless motor
+    corelessFrequency = 20000  # 20 kHz
+    # fraction of full speed that must be lost before dropping to a lower frequency band
+    bandHysteresis = 0.02
+
+    def __init__(self, forwardPin, reversePin, startfreq=100, frequencyBands=None):
         self.forwardPin = PWM(Pin(forwardPin))
         self.reversePin = PWM(Pin(reversePin))
         self.forwardPin.freq(startfreq)
         self.reversePin.freq(startfreq)
+        self.frequency = startfreq
+        self.frequencyBands = frequencyBands or ((100, self.corelessFrequency),)
+        self.band = 0
+        self.direction = None
+        # Duty of the forward and reverse pins, None until first written
+        self.duties = [None, None]
+        # Instrumentation: register writes made and skipped because the value was unchanged
+        self.writes = 0
+        self.skippedWrites = 0
         self.off()
 
+    def setFrequency(self, frequency):
+        if frequency == self.frequency:
+            self.skippedWrites += 2
+            return
+
+        self.forwardPin.freq(frequency)
+        self.reversePin.freq(frequency)
+        self.frequency = frequency
+        self.writes += 2
+
+    def selectBand(self, speed):
+        bands = self.frequencyBands
+        band = self.band
+
+        while band < len(bands) - 1 and speed >= bands[band][0]:
+            band += 1
+
+        # speeds here are percentages
+        while band > 0 and speed < bands[band - 1][0] - self.bandHysteresis * 100:
+            band -= 1
+
+        self.band = band
+        return bands[band][1]
+
+    def setDuties(self, forwardDuty, reverseDuty):
+        for i, (pin, duty) in enumerate(
+            ((self.forwardPin, forwardDuty), (self.reversePin, reverseDuty))
+        ):
+            if duty == self.duties[i]:
+                self.skippedWrites += 1
+            else:
+                pin.duty_u16(duty)
+                self.duties[i] = duty
+                self.writes += 1
+
     # Directions are "f" - forwards, "r" - reverse and "-" - off. The inclusion of off makes stepper code simpler
     def on(self, direction, speed=0.0):
         # Cap speed to 0-100%
@@ -127,47 +272,54 @@ class SimplePWMMotor:
         elif speed > 100:
             speed = 100
 
-        # Do something better here for adaptive frequency vs speed.
-        frequency = 100
-
-        if speed < 15:
-            frequency = 20
-
-        elif speed < 20:
-            frequency = 50
-
-        # override frequency for coreless motor
-        frequency = 20000  # 20 kHz
-
-        self.forwardPin.freq(frequency)
-        self.reversePin.freq(frequency)
+        # Adaptive frequency vs speed, only written when the band changes.
+        # Coreless motors are driven at a fixed frequency by default, so it is only written once.
+        self.setFrequency(self.selectBand(speed))
 
         # Convert 0-100 to 0-65535
         pwmVal = int(speed * 655.35)
 
         if direction == "f":
-            self.forwardPin.duty_u16(pwmVal)
-            self.reversePin.duty_u16(0)
+            self.setDuties(pwmVal, 0)
 
         elif direction == "r":
-            self.forwardPin.duty_u16(0)
-            self.reversePin.duty_u16(pwmVal)
+            self.setDuties(0, pwmVal)
 
         elif direction == "-":
-            self.forwardPin.duty_u16(0)
-            self.reversePin.duty_u16(0)
+            self.setDuties(0, 0)
 
         else:
             # Harsh, but at least you'll know
             raise Exception("INVALID DIRECTION")
 
+        self.direction = direction
+
     def off(self):
         self.on("-", 0)
 
+    def stats(self):
+        return {"writes": self.writes, "skipped": self.skippedWrites}
+
 
 # List of which StateMachines we have used
 usedSM = [False, False, False, False, False, False, False, False]
 
+
+# Claim the first unused StateMachine for the program
+def claimStateMachine(program, **kwargs):
+    for i in range(8):  #  StateMachine range from 0 to 7
+        if usedSM[i]:
+            continue  # Ignore this index if already used
+        try:
+            stateMachine = StateMachine(i, program, **kwargs)
+            usedSM[i] = True  # Set this index to used
+            return stateMachine  # Have claimed the SM, can leave now
+        except ValueError:
+            pass  # External resouce has SM, move on
+
+    # Cannot find an unused SM
+    raise ValueError("Could not claim a StateMachine, all in use")
+
 """
 Class that controls Serovs using the RP2040 PIO to generate the pulses.
 
@@ -246,26 +398,257 @@ class PIOServo:
             raise Exception("TRYING TO CONTROL UNREGISTERED SERVO")
 
     def __init__(self, servoPin):
-        for i in range(8):  #  StateMachine range from 0 to 7
-            if usedSM[i]:
-                continue  # Ignore this index if already used
-            try:
-                self.stateMachine = StateMachine(
-                    i, self._servo_pwm, freq=2000000, sideset_base=Pin(servoPin)
-                )
-                usedSM[i] = True  # Set this index to used
-                break  # Have claimed the SM, can leave now
-            except ValueError:
-                pass  # External resouce has SM, move on
-            if i == 7:
-                # Cannot find an unused SM
-                raise ValueError("Could not claim a StateMachine, all in use")
+        self.stateMachine = claimStateMachine(
+            self._servo_pwm, freq=2000000, sideset_base=Pin(servoPin)
+        )
 
         self.stateMachine.put(self.pulseTrain)
         self.stateMachine.exec("pull()")
         self.stateMachine.exec("mov(isr, osr)")
 
 
+"""
+Class that pulses a group of 4 servos on consecutive pins from a single PIO StateMachine.
+
+The servos are pulsed one after another, rather than all at once, followed by a gap of 10mS.
+Each pulse length is sent as a byte in units of 10uS, so the four fit in one 32 bit word.
+A zero byte sends no pulse at all, leaving the servo unpowered.
+The StateMachine is only claimed when the first pulse is needed.
+"""
+
+
+class PIOServoGroup:
+    pulseResolution = 10  # uS per count
+    frameGap = 1000  # counts of pulseResolution after the pulses in each frame
+
+    # This code runs at 1Mhz, so each loop of a jmp with a delay of 9 takes 10uS.
+    @asm_pio(set_init=(PIO.OUT_LOW,) * 4, out_shiftdir=PIO.SHIFT_RIGHT)
+    def _servo_group_pwm():
+        # Keep the most recent pulse lengths stashed in X, for recycling by noblock
+        pull(noblock)
+        mov(x, osr)
+        # Servo 0: read its pulse length, skipping it if zero
+        out(y, 8)
+        jmp(not_y, "skip0")
+        set(pins, 1)
+        label("servo0")
+        jmp(y_dec, "servo0")[9]
+        set(pins, 0)
+        label("skip0")
+        # Servo 1
+        out(y, 8)
+        jmp(not_y, "skip1")
+        set(pins, 2)
+        label("servo1")
+        jmp(y_dec, "servo1")[9]
+        set(pins, 0)
+        label("skip1")
+        # Servo 2
+        out(y, 8)
+        jmp(not_y, "skip2")
+        set(pins, 4)
+        label("servo2")
+        jmp(y_dec, "servo2")[9]
+        set(pins, 0)
+        label("skip2")
+        # Servo 3
+        out(y, 8)
+        jmp(not_y, "skip3")
+        set(pins, 8)
+        label("servo3")
+        jmp(y_dec, "servo3")[9]
+        set(pins, 0)
+        label("skip3")
+        # ISR must be preloaded with the gap between frames
+        mov(y, isr)
+        label("gap")
+        jmp(y_dec, "gap")[9]
+
+    def __init__(self, firstPin):
+        self.firstPin = firstPin
+        self.counts = bytearray(4)  # pulse length of each servo, 0 for none
+        self.stateMachine = None
+
+    def claim(self):
+        if self.stateMachine is not None:
+            return
+
+        self.stateMachine = claimStateMachine(
+            self._servo_group_pwm, freq=1000000, set_base=Pin(self.firstPin)
+        )
+        self.stateMachine.put(self.frameGap)
+        self.stateMachine.exec("pull()")
+        self.stateMachine.exec("mov(isr, osr)")
+        self.stateMachine.active(1)
+
+    # Set the pulse length of one servo in the group in uS, or None to stop pulsing it
+    def setPeriod(self, channel, period):
+        # The loop runs one more time than the count
+        self.counts[channel] = 0 if period is None else period // self.pulseResolution - 1
+
+        if self.stateMachine is None and not any(self.counts):
+            return  # nothing to pulse yet
+
+        self.claim()
+        self.stateMachine.put(int.from_bytes(self.counts, "little"))
+
+    def servo(self, servoPin):
+        return GroupServo(self, servoPin - self.firstPin)
+
+
+# A servo in a PIOServoGroup, with the same interface as PIOServo
+class GroupServo(PIOServo):
+    def __init__(self, group, channel):
+        self.group = group
+        self.channel = channel
+        self.registered = False
+        self.period = None  # last pulse length sent
+        self.mover = None  # ServoGroup that may move this servo
+
+    def registerServo(self):
+        self.registered = True
+        if self.period is not None:
+            self.group.setPeriod(self.channel, self.period)
+
+    def deregisterServo(self):
+        self.registered = False
+        self.group.setPeriod(self.channel, None)
+
+    # Moving the servo directly cancels any move still to be made by its ServoGroup
+    def goToPeriod(self, period):
+        if self.mover is not None:
+            self.mover.cancel(self)
+        self.setPeriod(period)
+
+    def setPeriod(self, period):
+        if period < 500:
+            period = 500
+
+        if period > 2500:
+            period = 2500
+
+        if not self.registered:
+            # Harsh, but at least you'll know
+            raise Exception("TRYING TO CONTROL UNREGISTERED SERVO")
+
+        self.period = period
+        self.group.setPeriod(self.channel, period)
+
+
+"""
+Class that moves many servos smoothly, eg: to change the points on a large layout.
+
+Each servo moves towards its target at no more than maxSpeed degrees per second, and at most
+maxMoving servos move at once, so that the current drawn by the servos is limited.
+A servo whose position is unknown jumps to its target, and then holds its place in the queue for
+settleMs while it moves.
+Moving a GroupServo directly, eg: with goToPosition, cancels its move here, so it is not overwritten.
+"""
+
+
+class ServoGroup:
+    def __init__(self, servos, maxSpeed=180, maxMoving=2, settleMs=300, periodMs=20):
+        self.servos = servos
+        self.maxRate = maxSpeed * PIOServo.degreesToUS  # uS per second
+        self.maxMoving = maxMoving
+        self.settleMs = settleMs
+        self.periodMs = periodMs
+        self.periods = [getattr(servo, "period", None) for servo in servos]
+        self.targets = [None] * len(servos)
+        self.waiting = []  # servos in the order they were asked to move
+        self.moving = {}  # servo: settle deadline for a jump, or None while interpolating
+        self.timer = None
+        self.last = ticks_ms()
+        for servo in servos:
+            if isinstance(servo, GroupServo):
+                servo.mover = self
+
+    def moveToPosition(self, servo, degrees):
+        self.moveToPeriod(servo, int(degrees * PIOServo.degreesToUS + 500))
+
+    def moveToPeriod(self, servo, period):
+        self.targets[servo] = max(500, min(period, 2500))
+        if servo not in self.moving and servo not in self.waiting:
+            self.waiting.append(servo)
+
+    def isMoving(self):
+        return bool(self.moving or self.waiting)
+
+    # Forget the move of a servo that is being moved directly
+    def cancel(self, servoObject):
+        servo = self.servos.index(servoObject)
+        if servo in self.waiting:
+            self.waiting.remove(servo)
+        self.moving.pop(servo, None)
+        self.targets[servo] = None
+        self.periods[servo] = None  # until the direct move has been made
+
+    # Send a period to a servo, without cancelling its move
+    def output(self, servo, period):
+        servoObject = self.servos[servo]
+        if isinstance(servoObject, GroupServo):
+            servoObject.setPeriod(period)
+        else:
+            servoObject.goToPeriod(period)
+
+    # Start the waiting servos that have room to move, jumping any whose position is unknown
+    def startWaiting(self, now):
+        while self.waiting and len(self.moving) < self.maxMoving:
+            servo = self.waiting.pop(0)
+            if self.periods[servo] is None:
+                # eg: since the servo was moved directly
+                self.periods[servo] = getattr(self.servos[servo], "period", None)
+            if self.periods[servo] is None:
+                self.periods[servo] = self.targets[servo]
+                self.output(servo, self.targets[servo])
+                self.moving[servo] = ticks_add(now, self.settleMs)
+            else:
+                self.moving[servo] = None
+
+    # Advance every moving servo towards its target, returning whether any are still moving
+    def update(self):
+        now = ticks_ms()
+        step = self.maxRate * ticks_diff(now, self.last) / 1000
+        self.last = now
+
+        self.startWaiting(now)
+
+        for servo, deadline in list(self.moving.items()):
+            if deadline is not None:
+                if ticks_diff(deadline, now) > 0:
+                    continue  # still settling
+                # interpolate to any target set while it was settling
+                self.moving[servo] = None
+
+            period = self.periods[servo]
+            target = self.targets[servo]
+            if period < target:
+                period = min(period + step, target)
+            else:
+                period = max(period - step, target)
+
+            self.periods[servo] = period
+            self.output(servo, int(period))
+            if period == target:
+                del self.moving[servo]
+
+        return self.isMoving()
+
+    def onTimer(self, timer):
+        if not self.update():
+            self.stopTimer()
+
+    def startTimer(self):
+        if self.timer is None:
+            self.last = ticks_ms()
+            self.timer = Timer(period=self.periodMs, callback=self.onTimer)
+
+    def stopTimer(self):
+        if self.timer is not None:
+            self.timer.deinit()
+            self.timer = None
+
+
 """
 A class to provide the functionality of the Kitronik 5348 Simply Robotics board.
 www.kitronik.co.uk/5348
@@ -292,20 +675,26 @@ class KitronikSimplyRobotics:
             StepperMotor(self.motors[0], self.motors[1]),
             StepperMotor(self.motors[2], self.motors[3]),
         ]
+        # Two StateMachines pulse all 8 servos, and are only claimed once a servo is moved
+        self.servoGroups = [PIOServoGroup(12), PIOServoGroup(16)]
         self.servos = [
-            PIOServo(15),
-            PIOServo(14),
-            PIOServo(13),
-            PIOServo(12),
-            PIOServo(19),
-            PIOServo(18),
-            PIOServo(17),
-            PIOServo(16),
+            self.servoGroups[0].servo(15),
+            self.servoGroups[0].servo(14),
+            self.servoGroups[0].servo(13),
+            self.servoGroups[0].servo(12),
+            self.servoGroups[1].servo(19),
+            self.servoGroups[1].servo(18),
+            self.servoGroups[1].servo(17),
+            self.servoGroups[1].servo(16),
         ]
+        self.servoMover = ServoGroup(self.servos)
 
         # Connect the servos by default on construction - advanced uses can disconnect them if required.
         for i in range(8):
             self.servos[i].registerServo()
             if centreServos:
-                # Set the servo outputs to middle of the range.
-                self.servos[i].goToPosition(90)
+                # Set the servo outputs to middle of the range, a few at a time to limit the current.
+                self.servoMover.moveToPosition(i, 90)
+
+        if centreServos:
+            self.servoMover.startTimer()
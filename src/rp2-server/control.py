@@ -0,0 +1,114 @@
+"""
+Coalesce throttle commands from websocket clients into one action per control tick.
+
+Holding a key in the browser floods the server with `move` messages.
+Rather than writing to the motor and replying once per message, commands are queued here and
+`CommandQueue.drain` returns one net acceleration, one point change and one batched ack per client
+for each control tick. `stop` is never queued, so it always takes effect immediately.
+"""
+
+from utime import ticks_diff, ticks_ms
+
+CONTROL_PERIOD_MS = 50
+MAX_COMMANDS_PER_SECOND = 20
+MAX_BURST = 10
+
+
+class RateLimiter:
+    """A token bucket allowing `rate` commands per second, in bursts of up to `burst`."""
+
+    def __init__(self, rate=MAX_COMMANDS_PER_SECOND, burst=MAX_BURST) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._last = ticks_ms()
+
+    def allow(self) -> bool:
+        """Return whether another command is allowed now, consuming a token if so."""
+        now = ticks_ms()
+        elapsed = ticks_diff(now, self._last)
+        self._last = now
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate / 1000)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+
+class Pending:
+    """Commands received from one client since the last control tick."""
+
+    def __init__(self, rate, burst) -> None:
+        self.limiter = RateLimiter(rate, burst)
+        self.reset()
+
+    def reset(self):
+        self.steps = 0  # net acceleration, positive is forward
+        self.point = None  # last requested point state, if any
+        self.count = 0  # commands to acknowledge, including dropped ones
+        self.dropped = 0
+
+
+class CommandQueue:
+    """Per-client queues of throttle commands, coalesced once per control tick."""
+
+    def __init__(self, rate=MAX_COMMANDS_PER_SECOND, burst=MAX_BURST) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._clients = {}
+
+    def add_client(self, client):
+        self._clients[client] = Pending(self.rate, self.burst)
+
+    def remove_client(self, client):
+        self._clients.pop(client, None)
+
+    def submit_move(self, client, steps: int) -> bool:
+        """Queue an acceleration, returning False if the client is rate limited."""
+        pending = self._admit(client)
+        if pending is None:
+            return False
+        pending.steps += steps
+        return True
+
+    def submit_point(self, client, diverging: bool) -> bool:
+        """Queue a point change, returning False if the client is rate limited."""
+        pending = self._admit(client)
+        if pending is None:
+            return False
+        pending.point = diverging
+        return True
+
+    def cancel_moves(self):
+        """Discard queued accelerations from all clients, as a stop overrides them."""
+        for pending in self._clients.values():
+            pending.steps = 0
+
+    def drain(self):
+        """
+        Coalesce and clear the queued commands.
+
+        Returns a tuple of (net_steps, point, acks) where point is the last requested point state
+        or None, and acks is a list of (client, steps, point, count, dropped) for each client with
+        commands to acknowledge.
+        """
+        net_steps = 0
+        point = None
+        acks = []
+        for client, pending in self._clients.items():
+            if pending.count == 0:
+                continue
+            net_steps += pending.steps
+            if pending.point is not None:
+                point = pending.point
+            acks.append((client, pending.steps, pending.point, pending.count, pending.dropped))
+            pending.reset()
+        return net_steps, point, acks
+
+    def _admit(self, client):
+        pending = self._clients[client]
+        pending.count += 1
+        if pending.limiter.allow():
+            return pending
+        pending.dropped += 1
+        return None
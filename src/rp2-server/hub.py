@@ -0,0 +1,198 @@
+"""
+Share throttle state between every connected websocket client.
+
+Each state change is serialised once by `SessionHub.update`, then the same text is queued to every
+subscriber. Each subscriber has its own bounded send queue drained by its own task through
+`WebSocket.send`, the same write path as the pong and close frames sent while receiving, so a slow
+phone only loses its own oldest messages rather than stalling the others.
+
+Read-only dashboards can instead follow the state as Server-Sent Events through an `EventStream`,
+which is cheaper than a websocket and only receives the values that changed.
+
+A client may take ownership of a locomotive with an `acquire` message, after which other clients
+may not drive it until it sends `release` or disconnects. Anyone may always stop it.
+"""
+
+import asyncio
+import json
+
+MAX_QUEUED_FRAMES = 8
+MAX_EVENT_STREAMS = 4
+HEARTBEAT_SECONDS = 15
+
+
+class Subscriber:
+    """A connected websocket client with its own bounded queue of serialised messages."""
+
+    def __init__(self, ws, max_queued=MAX_QUEUED_FRAMES) -> None:
+        self.ws = ws
+        self.max_queued = max_queued
+        self.messages = []
+        self.dropped = 0
+        self.ready = asyncio.Event()
+        self.task = None
+
+    def put(self, text):
+        """Queue a message, dropping the oldest if the client is not keeping up."""
+        if len(self.messages) >= self.max_queued:
+            self.messages.pop(0)
+            self.dropped += 1
+        self.messages.append(text)
+        self.ready.set()
+
+    async def run(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            while self.messages:
+                await self.ws.send(self.messages.pop(0))
+
+
+class EventStream:
+    """
+    A `text/event-stream` response body that yields queued events as they are published.
+
+    A comment is sent as a heartbeat when nothing has been published for a while, so that
+    proxies and browsers keep the connection open.
+    """
+
+    def __init__(self, hub, max_queued=MAX_QUEUED_FRAMES) -> None:
+        self.hub = hub
+        self.max_queued = max_queued
+        self.events = []
+        self.dropped = 0
+        self.ready = asyncio.Event()
+
+    def put(self, event):
+        """Queue an encoded event, dropping the oldest if the client is not keeping up."""
+        if len(self.events) >= self.max_queued:
+            self.events.pop(0)
+            self.dropped += 1
+        self.events.append(event)
+        self.ready.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.events:
+            self.ready.clear()
+            try:
+                await asyncio.wait_for(self.ready.wait(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                return b": heartbeat\n\n"
+        return self.events.pop(0)
+
+    async def aclose(self):
+        """Unsubscribe once the response has finished, usually because the client went away."""
+        self.hub.close_event_stream(self)
+
+
+class SessionHub:
+    """Tracks connected clients, the shared state and which client owns each locomotive."""
+
+    def __init__(self, max_queued=MAX_QUEUED_FRAMES) -> None:
+        self.max_queued = max_queued
+        self.subscribers = {}
+        self.event_streams = []
+        self.owners = {}
+        self.state = {}
+
+    def join(self, ws) -> Subscriber:
+        subscriber = Subscriber(ws, self.max_queued)
+        subscriber.task = asyncio.create_task(self._serve(subscriber))
+        self.subscribers[ws] = subscriber
+        if self.state:
+            subscriber.put(self._serialise(self._state_message()))
+        return subscriber
+
+    def leave(self, ws):
+        subscriber = self.subscribers.pop(ws, None)
+        if subscriber:
+            subscriber.task.cancel()
+        for loco_id, owner in list(self.owners.items()):
+            if owner is ws:
+                del self.owners[loco_id]
+                self.update(locked=False)
+
+    def send_to(self, ws, message: dict):
+        """Queue a message for one client."""
+        subscriber = self.subscribers.get(ws)
+        if subscriber:
+            subscriber.put(self._serialise(message))
+
+    def publish(self, message: dict):
+        """Serialise a message once and queue the same text for every client."""
+        if not self.subscribers:
+            return
+        text = self._serialise(message)
+        for subscriber in self.subscribers.values():
+            subscriber.put(text)
+
+    def update(self, **state) -> dict:
+        """
+        Merge changes into the shared state and publish it if anything changed.
+
+        Returns a dictionary of only the values that changed.
+        """
+        changed = {key: value for key, value in state.items() if self.state.get(key) != value}
+        if changed:
+            self.state.update(changed)
+            self.publish(self._state_message())
+            if self.event_streams:
+                event = self._event(changed)
+                for stream in self.event_streams:
+                    stream.put(event)
+        return changed
+
+    def open_event_stream(self, max_streams=MAX_EVENT_STREAMS):
+        """Subscribe to state changes as Server-Sent Events, or return None if at capacity."""
+        if len(self.event_streams) >= max_streams:
+            return None
+        stream = EventStream(self, self.max_queued)
+        stream.put(self._event(self.state))  # start from a full snapshot
+        self.event_streams.append(stream)
+        return stream
+
+    def close_event_stream(self, stream: EventStream):
+        if stream in self.event_streams:
+            self.event_streams.remove(stream)
+
+    def acquire(self, ws, loco_id) -> bool:
+        """Take ownership of a locomotive, returning False if another client owns it."""
+        owner = self.owners.get(loco_id)
+        if owner is not None and owner is not ws:
+            return False
+        self.owners[loco_id] = ws
+        self.update(locked=True)
+        return True
+
+    def release(self, ws, loco_id):
+        if self.owners.get(loco_id) is ws:
+            del self.owners[loco_id]
+            self.update(locked=False)
+
+    def can_control(self, ws, loco_id) -> bool:
+        """Return whether the client may drive the locomotive."""
+        owner = self.owners.get(loco_id)
+        return owner is None or owner is ws
+
+    def _state_message(self):
+        message = {"type": "state"}
+        message.update(self.state)
+        return message
+
+    @staticmethod
+    def _event(changes: dict):
+        return b"event: state\ndata: " + json.dumps(changes).encode() + b"\n\n"
+
+    @staticmethod
+    def _serialise(message: dict):
+        return json.dumps(message)
+
+    async def _serve(self, subscriber: Subscriber):
+        try:
+            await subscriber.run()
+        except OSError:
+            # the client has gone, its receive loop will call leave()
+            pass
@@ -129,6 +129,35 @@ class Response(BaseResponse):
                    default is "OK" for responses with a 200 status code and
                    "N/A" for any other status codes.
     """
+    #: The HTTP version reported in the status line. Persistent connections
+    #: switch this to ``'1.1'`` on the responses they send.
+    http_version = '1.0'
+
+    def frame(self):
+        """Add a ``Content-Length`` header when the size of the body can be
+        determined without reading it.
+
+        Returns ``True`` if the response is framed, so that another request
+        can follow it on the same connection. Generators and other streams of
+        unknown length are not framed, and must be delimited by closing the
+        connection.
+        """
+        self.complete()
+        if 'Content-Length' in self.headers:
+            return True
+        if not self.body:
+            self.headers['Content-Length'] = '0'
+            return True
+        if hasattr(self.body, 'seek') and hasattr(self.body, 'tell'):
+            try:
+                position = self.body.tell()
+                size = self.body.seek(0, 2)
+                self.body.seek(position)
+            except (OSError, ValueError):  # pragma: no cover
+                return False
+            self.headers['Content-Length'] = str(size - position)
+            return True
+        return False
 
     async def write(self, stream):
         self.complete()
@@ -137,8 +166,10 @@ class Response(BaseResponse):
             # status code
             reason = self.reason if self.reason is not None else \
                 ('OK' if self.status_code == 200 else 'N/A')
-            await stream.awrite('HTTP/1.0 {status_code} {reason}\r\n'.format(
-                status_code=self.status_code, reason=reason).encode())
+            await stream.awrite('HTTP/{version} {status_code} {reason}\r\n'
+                                .format(version=self.http_version,
+                                        status_code=self.status_code,
+                                        reason=reason).encode())
 
             # headers
             for header, value in self.headers.items():
@@ -160,6 +191,10 @@ class Response(BaseResponse):
                 pass
             else:
                 raise
+        finally:
+            if hasattr(self.body, 'aclose'):
+                # let async generator bodies release their resources
+                await self.body.aclose()
 
     def body_iter(self):
         if hasattr(self.body, '__anext__'):
@@ -208,6 +243,30 @@ class Response(BaseResponse):
 
 
 class Microdot(BaseMicrodot):
+    #: Allow HTTP/1.1 persistent connections, so that several requests can be
+    #: served on one connection without a new TCP handshake each time.
+    #: Responses on a persistent connection are framed by ``Content-Length``.
+    #: The default is ``False``, which closes the connection after every
+    #: response.
+    keep_alive = False
+
+    #: The number of seconds an idle persistent connection is held open while
+    #: waiting for the next request.
+    keep_alive_timeout = 5
+
+    #: The maximum number of requests served on one persistent connection
+    #: before it is closed.
+    max_keep_alive_requests = 20
+
+    #: The maximum number of open connections that may be kept alive. Further
+    #: connections are still served, but are closed after one response, so
+    #: that idle connections cannot exhaust a small socket pool.
+    max_keep_alive_connections = 3
+
+    def __init__(self):
+        super().__init__()
+        self.connections = 0
+
     async def start_server(self, host='0.0.0.0', port=5000, debug=False,
                            ssl=None):
         """Start the Microdot web server as a coroutine. This coroutine does
@@ -328,27 +387,77 @@ class Microdot(BaseMicrodot):
         self.server.close()
 
     async def handle_request(self, reader, writer):
-        req = None
+        self.connections += 1
+        served = 0
         try:
-            req = await Request.create(self, reader, writer,
-                                       writer.get_extra_info('peername'))
-        except Exception as exc:  # pragma: no cover
-            print_exception(exc)
-
-        res = await self.dispatch_request(req)
-        if res != Response.already_handled:  # pragma: no branch
-            await res.write(writer)
-        try:
-            await writer.aclose()
-        except OSError as exc:  # pragma: no cover
-            if exc.errno in MUTED_SOCKET_ERRORS:
-                pass
-            else:
-                raise
-        if self.debug and req:  # pragma: no cover
-            print('{method} {path} {status_code}'.format(
-                method=req.method, path=req.path,
-                status_code=res.status_code))
+            while True:
+                req = None
+                try:
+                    if served:
+                        req = await asyncio.wait_for(
+                            Request.create(self, reader, writer,
+                                           writer.get_extra_info('peername')),
+                            self.keep_alive_timeout)
+                        if req is None:
+                            # the client closed the persistent connection
+                            break
+                    else:
+                        req = await Request.create(
+                            self, reader, writer,
+                            writer.get_extra_info('peername'))
+                except asyncio.TimeoutError:
+                    break
+                except Exception as exc:  # pragma: no cover
+                    print_exception(exc)
+                served += 1
+
+                res = await self.dispatch_request(req)
+                keep_alive = False
+                if res != Response.already_handled:  # pragma: no branch
+                    keep_alive = self._keep_alive(req, res, served)
+                    if keep_alive:
+                        res.http_version = '1.1'
+                        res.headers['Connection'] = 'keep-alive'
+                        res.headers['Keep-Alive'] = \
+                            'timeout={}, max={}'.format(
+                                self.keep_alive_timeout,
+                                self.max_keep_alive_requests - served)
+                    elif self.keep_alive:
+                        res.headers['Connection'] = 'close'
+                    await res.write(writer)
+                if self.debug and req:  # pragma: no cover
+                    print('{method} {path} {status_code}'.format(
+                        method=req.method, path=req.path,
+                        status_code=res.status_code))
+                if not keep_alive:
+                    break
+        finally:
+            self.connections -= 1
+            try:
+                await writer.aclose()
+            except OSError as exc:  # pragma: no cover
+                if exc.errno in MUTED_SOCKET_ERRORS:
+                    pass
+                else:
+                    raise
+
+    def _keep_alive(self, req, res, served):
+        """Decide whether the connection can be reused after ``res``."""
+        if not self.keep_alive or req is None:
+            return False
+        connection = req.headers.get('Connection', '').lower()
+        if req.http_version == '1.1':
+            if connection == 'close':
+                return False
+        elif connection != 'keep-alive':
+            return False
+        if served >= self.max_keep_alive_requests or \
+                self.connections > self.max_keep_alive_connections:
+            return False
+        if req.content_length > Request.max_body_length:
+            # the body was left unread in the stream
+            return False
+        return res.frame()
 
     async def dispatch_request(self, req):
         after_request_handled = False
@@ -49,34 +49,37 @@ CODE = {
 }
 
 
-def flash(led, t):
-    #    led.low()
-    #    time.sleep(t)
-    led.high()
-    time.sleep(t)
-    led.low()
-    return
-
-
-def send(msg="SOS", pin="LED", wpm=WPM):
-    led = machine.Pin(pin, machine.Pin.OUT)
-
-    tdot = 1.2 / wpm
+def timings(msg="SOS", wpm=WPM):
+    """Yield (level, milliseconds) steps that key the message in Morse code."""
+    tdot = int(1200 / wpm)
     tdash = tdot * 3
     tspace = tdot * 2
     tword = tdot * 6
 
-    led.low()
     for letter in msg:
         code = CODE.get(letter.upper(), "")
         for each in code:
             if each == ".":
-                flash(led, tdot)
-                time.sleep(tdot)
+                yield 1, tdot
+                yield 0, tdot
             if each == "-":
-                flash(led, tdash)
-                time.sleep(tdot)
+                yield 1, tdash
+                yield 0, tdot
             if each == " ":
-                time.sleep(tspace)
-        time.sleep(tword)
+                yield 0, tspace
+        yield 0, tword
+
+
+def send(msg="SOS", pin="LED", wpm=WPM):
+    """
+    [Blocking] Flash the message in Morse code.
+
+    Use `effects.Sequence(led, timings(msg))` to send without blocking.
+    """
+    led = machine.Pin(pin, machine.Pin.OUT)
+
+    led.low()
+    for level, duration in timings(msg, wpm):
+        led.value(level)
+        time.sleep_ms(duration)
     led.low()
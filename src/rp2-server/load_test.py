@@ -0,0 +1,321 @@
+"""
+Load test the throttle server on CPython.
+
+Boots the `server.py` app with `mock_hardware` and a mocked `wifi` module, then drives it with
+simulated phones: websocket clients sending `move`/`stop`/`change-point` messages at a fixed rate,
+and optionally HTTP clients polling the REST endpoints over persistent connections.
+Throughput and latency percentiles are reported per command type.
+
+```sh
+python src/rp2-server/load_test.py --clients 4 --rate 20 --duration 10 --max-p99 75
+```
+
+The exit code is non-zero if `--max-p99` is exceeded or replies go missing,
+so the script can be used as a regression gate for server and protocol changes.
+"""
+
+import argparse
+import asyncio
+import base64
+import contextlib
+import io
+import json
+import os
+import random
+import struct
+import sys
+import time
+import types
+from collections import deque
+from pathlib import Path
+from unittest.mock import Mock
+
+SERVER_DIR = Path(__file__).resolve().parent
+SRC_DIR = SERVER_DIR.parent
+
+DEFAULT_MIX = "move=8,stop=1,change-point=1"
+DEFAULT_PATHS = "/stop,/point/diverge/true,/point/diverge/false"
+QUEUED_COMMANDS = ("move", "change-point")
+
+
+def install_micropython_shims():
+    """Provide the MicroPython-only modules that the server imports."""
+    for path in (SRC_DIR, SRC_DIR / "rp2", SERVER_DIR, SERVER_DIR / "lib"):
+        sys.path.insert(0, str(path))
+
+    utime = types.ModuleType("utime")
+    utime.ticks_ms = lambda: int(time.monotonic() * 1000)
+    utime.ticks_us = lambda: int(time.monotonic() * 1_000_000)
+    utime.ticks_add = lambda ticks, delta: ticks + delta
+    utime.ticks_diff = lambda end, start: end - start
+    utime.sleep_ms = lambda ms: time.sleep(ms / 1000)
+    utime.sleep = time.sleep
+    sys.modules["utime"] = utime
+
+    import mock_hardware
+
+    sys.modules["hardware"] = mock_hardware
+
+    wifi = types.ModuleType("wifi")
+    wifi.connect_with_saved_credentials = Mock(return_value="127.0.0.1")
+    sys.modules["wifi"] = wifi
+
+
+def boot_server():
+    """Import the server module without starting it."""
+    install_micropython_shims()
+    os.chdir(SERVER_DIR)  # templates and static files are served relative to the server
+
+    import server
+
+    return server
+
+
+class WebSocketClient:
+    """A minimal websocket client, sending masked text frames as browsers do."""
+
+    async def connect(self, host, port, path="/move"):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        key = base64.b64encode(os.urandom(16)).decode()
+        self.writer.write(
+            (
+                f"GET {path} HTTP/1.1\r\n"
+                f"Host: {host}:{port}\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Key: {key}\r\n"
+                "Sec-WebSocket-Version: 13\r\n\r\n"
+            ).encode()
+        )
+        await self.writer.drain()
+        response = await self.reader.readuntil(b"\r\n\r\n")
+        if b" 101 " not in response.split(b"\r\n", 1)[0]:
+            raise ConnectionError(f"Websocket upgrade failed: {response!r}")
+
+    async def send(self, text: str):
+        payload = text.encode()
+        header = bytearray([0x81])
+        if len(payload) < 126:
+            header.append(0x80 | len(payload))
+        else:
+            header.append(0x80 | 126)
+            header.extend(struct.pack("!H", len(payload)))
+        mask = os.urandom(4)
+        masked = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+        self.writer.write(bytes(header) + mask + masked)
+        await self.writer.drain()
+
+    async def receive(self) -> str:
+        header = await self.reader.readexactly(2)
+        length = header[1] & 0x7F
+        if length == 126:
+            (length,) = struct.unpack("!H", await self.reader.readexactly(2))
+        elif length == 127:
+            (length,) = struct.unpack("!Q", await self.reader.readexactly(8))
+        return (await self.reader.readexactly(length)).decode()
+
+    def close(self):
+        self.writer.close()
+
+
+class Stats:
+    """Latency samples in milliseconds, grouped by command type."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.sent = {}
+
+    def record_sent(self, kind):
+        self.sent[kind] = self.sent.get(kind, 0) + 1
+
+    def record(self, kind, latency_ms):
+        self.latencies.setdefault(kind, []).append(latency_ms)
+
+    def missing(self):
+        return sum(self.sent.values()) - sum(len(v) for v in self.latencies.values())
+
+
+def percentile(samples, fraction):
+    """Return the nearest-rank percentile of pre-sorted samples."""
+    if not samples:
+        return float("nan")
+    index = min(len(samples) - 1, max(0, int(round(fraction * len(samples))) - 1))
+    return samples[index]
+
+
+def message_for(kind):
+    if kind == "move":
+        return {"type": "move", "text": random.choice(["left", "right"])}
+    if kind == "change-point":
+        return {"type": "change-point", "text": random.choice(["point-through", "point-diverging"])}
+    return {"type": kind, "text": ""}
+
+
+async def run_ws_client(host, port, kinds, weights, rate, duration, stats: Stats):
+    """Send commands at the given rate, matching replies to commands in order."""
+    client = WebSocketClient()
+    await client.connect(host, port)
+    # coalesced commands are acknowledged in batches, others are answered immediately
+    queued = deque()
+    immediate = deque()
+
+    async def receiver():
+        while True:
+            reply = json.loads(await client.receive())
+            now = time.perf_counter()
+            if reply["type"] == "state":
+                continue  # broadcast to every client, not a reply
+            pending = queued if "count" in reply else immediate
+            for _ in range(reply.get("count", 1)):
+                if not pending:
+                    break
+                kind, sent_at = pending.popleft()
+                stats.record(kind, (now - sent_at) * 1000)
+
+    receiving = asyncio.create_task(receiver())
+    interval = 1 / rate
+    deadline = time.perf_counter() + duration
+    next_send = time.perf_counter()
+    while next_send < deadline:
+        kind = random.choices(kinds, weights)[0]
+        pending = queued if kind in QUEUED_COMMANDS else immediate
+        pending.append((kind, time.perf_counter()))
+        stats.record_sent(kind)
+        await client.send(json.dumps(message_for(kind)))
+        next_send += interval
+        await asyncio.sleep(max(0, next_send - time.perf_counter()))
+
+    # allow outstanding replies to arrive
+    drain_deadline = time.perf_counter() + 2
+    while (queued or immediate) and time.perf_counter() < drain_deadline:
+        await asyncio.sleep(0.01)
+    receiving.cancel()
+    client.close()
+
+
+async def run_http_client(host, port, paths, rate, duration, stats: Stats):
+    """Request the REST endpoints in turn, reusing the connection while the server allows it."""
+    reader = writer = None
+    interval = 1 / rate
+    deadline = time.perf_counter() + duration
+    next_send = time.perf_counter()
+    while next_send < deadline:
+        path = random.choice(paths)
+        if writer is None:
+            reader, writer = await asyncio.open_connection(host, port)
+        started = time.perf_counter()
+        stats.record_sent(path)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+        await writer.drain()
+        head = (await reader.readuntil(b"\r\n\r\n")).decode().lower()
+        headers = dict(line.split(": ", 1) for line in head.split("\r\n")[1:] if ": " in line)
+        if "content-length" in headers:
+            await reader.readexactly(int(headers["content-length"]))
+        else:
+            await reader.read()
+        stats.record(path, (time.perf_counter() - started) * 1000)
+        if headers.get("connection") != "keep-alive":
+            writer.close()
+            reader = writer = None
+        next_send += interval
+        await asyncio.sleep(max(0, next_send - time.perf_counter()))
+    if writer:
+        writer.close()
+
+
+def report(title, stats: Stats, duration):
+    print(f"\n{title}")
+    print(
+        f"{'command':<24}{'count':>8}{'per s':>9}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max':>9}"
+    )
+    worst_p99 = 0.0
+    for kind, samples in sorted(stats.latencies.items()):
+        samples.sort()
+        p99 = percentile(samples, 0.99)
+        worst_p99 = max(worst_p99, p99)
+        print(
+            f"{kind:<24}{len(samples):>8}{len(samples) / duration:>9.1f}"
+            f"{percentile(samples, 0.5):>9.2f}{percentile(samples, 0.9):>9.2f}"
+            f"{p99:>9.2f}{samples[-1]:>9.2f}"
+        )
+    if stats.missing():
+        print(f"{stats.missing()} replies missing")
+    return worst_p99
+
+
+def parse_mix(mix):
+    kinds, weights = [], []
+    for item in mix.split(","):
+        kind, weight = item.split("=")
+        kinds.append(kind)
+        weights.append(float(weight))
+    return kinds, weights
+
+
+async def run(args):
+    server = boot_server()
+    app = server.app
+    server_task = asyncio.create_task(server.main(port=args.port))
+    while app.server is None:
+        await asyncio.sleep(0.01)
+
+    kinds, weights = parse_mix(args.mix)
+    ws_stats = Stats()
+    http_stats = Stats()
+    clients = [
+        run_ws_client(args.host, args.port, kinds, weights, args.rate, args.duration, ws_stats)
+        for _ in range(args.clients)
+    ]
+    clients += [
+        run_http_client(
+            args.host, args.port, args.paths.split(","), args.rate, args.duration, http_stats
+        )
+        for _ in range(args.http_clients)
+    ]
+
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with quiet:
+        await asyncio.gather(*clients)
+        await asyncio.sleep(0.1)  # let the server finish closing connections
+
+    app.shutdown()
+    server_task.cancel()
+
+    worst_p99 = report(
+        f"Websocket: {args.clients} clients at {args.rate}/s", ws_stats, args.duration
+    )
+    missing = ws_stats.missing()
+    if args.http_clients:
+        http_p99 = report(
+            f"HTTP: {args.http_clients} clients at {args.rate}/s", http_stats, args.duration
+        )
+        worst_p99 = max(worst_p99, http_p99)
+        missing += http_stats.missing()
+
+    if missing:
+        return 1
+    if args.max_p99 is not None and worst_p99 > args.max_p99:
+        print(f"\nFAIL: p99 latency {worst_p99:.2f} ms exceeds {args.max_p99} ms")
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--host", default="127.0.0.1", help="address to connect clients to")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--clients", type=int, default=4, help="websocket clients")
+    parser.add_argument("--http-clients", type=int, default=0, help="HTTP clients")
+    parser.add_argument("--rate", type=float, default=10, help="messages per second per client")
+    parser.add_argument("--duration", type=float, default=5, help="seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weighted websocket commands")
+    parser.add_argument("--paths", default=DEFAULT_PATHS, help="HTTP paths to request")
+    parser.add_argument("--max-p99", type=float, help="fail if any p99 latency exceeds this (ms)")
+    parser.add_argument("--verbose", action="store_true", help="show server output")
+    args = parser.parse_args()
+
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
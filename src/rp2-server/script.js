@@ -43,10 +43,11 @@ serverSocket.onmessage = (event) => {
       maxValue: maximum,
     });
     setTicks(maximum);
-  } else if (message["type"] == "ack") {
+  } else if (message["type"] == "ack" || message["type"] == "denied") {
     display_message(message["text"]);
-    const speed = Math.abs(message["velocity"]);
-    gauge.value = speed;
+  } else if (message["type"] == "state") {
+    // shared by every connected client
+    gauge.value = Math.abs(message["velocity"]);
   }
 };
 
@@ -1,9 +1,12 @@
+import asyncio
 import json
 import time
 
 import hardware
 import throttle
 import wifi
+from control import CONTROL_PERIOD_MS, CommandQueue
+from hub import SessionHub
 from layout import RelativeDirection
 from microdot_asyncio import Microdot, send_file
 from microdot_asyncio_websocket import with_websocket
@@ -13,11 +16,12 @@ ONE_DAY_IN_SECONDS = ONE_HOUR_IN_SECONDS * 24
 
 flash_led = hardware.flash_led
 
-address = wifi.connect_with_saved_credentials()
-flash_led(n=2)  # show that wifi connection was successful
-
+commands = CommandQueue()
+commands_ready = asyncio.Event()  # set when a command is queued, to wake the control loop
+hub = SessionHub()
 
 app = Microdot()
+app.keep_alive = True  # reuse connections for assets and REST calls
 
 
 def title(string: str):
@@ -26,7 +30,7 @@ def title(string: str):
 
 @app.before_request
 def before(request):
-    flash_led(t=0.01)
+    flash_led(t=0.01, blocking=False)
 
 
 @app.get("/favicon.ico")
@@ -55,69 +59,144 @@ def index(request):
 @app.route("/move")
 @with_websocket
 async def move_ws(request, ws):
+    hub.join(ws)
+    commands.add_client(ws)
+    try:
+        while True:
+            incoming = await ws.receive()
+            flash_led(t=0.005, blocking=False)
+            message = json.loads(incoming)
+            if message["type"] == "ping":
+                reply = {"type": "pong", "date": time.time()}
+            elif message["type"] == "init":
+                reply = {
+                    "type": "init",
+                    "text": f"initialised with engine={throttle.engine_id()}",
+                    "date": time.time(),
+                    "maximum": throttle.profile().get("max_speed", 100),
+                }
+            elif message["type"] == "stop":
+                # stop bypasses the command queue, and any client may stop any locomotive
+                commands.cancel_moves()
+                throttle.stop()
+                publish_state()
+                reply = {"type": "ack", "text": "commanded: stop", "date": time.time()}
+            elif message["type"] == "acquire":
+                acquired = hub.acquire(ws, throttle.engine_id())
+                reply = {
+                    "type": "ack" if acquired else "denied",
+                    "text": f"engine={throttle.engine_id()} "
+                    + ("acquired" if acquired else "is controlled by another client"),
+                    "date": time.time(),
+                }
+            elif message["type"] == "release":
+                hub.release(ws, throttle.engine_id())
+                reply = {"type": "ack", "text": "released", "date": time.time()}
+            elif message["type"] == "move":
+                if not hub.can_control(ws, throttle.engine_id()):
+                    reply = {
+                        "type": "denied",
+                        "text": f"engine={throttle.engine_id()} is controlled by another client",
+                        "date": time.time(),
+                        "count": 1,
+                    }
+                else:
+                    direction_in = message["text"]
+                    forward = direction_in in ("forward", "left")
+                    commands.submit_move(ws, 1 if forward else -1)
+                    commands_ready.set()
+                    continue  # acknowledged by control_loop
+            elif message["type"] == "change-point":
+                diverging = message["text"] == "point-diverging"
+                commands.submit_point(ws, diverging)
+                commands_ready.set()
+                continue  # acknowledged by control_loop
+            else:
+                # echo message
+                print(message)
+                reply = message
+
+            hub.send_to(ws, reply)
+    finally:
+        commands.remove_client(ws)
+        hub.leave(ws)
+
+
+def publish_state():
+    """Send the throttle state to every client, if it has changed."""
+    hub.update(
+        velocity=throttle.velocity(),
+        step=throttle.step(),
+        route="diverging" if throttle.is_point_diverging() else "through",
+    )
+
+
+def ack_text(steps, point, dropped):
+    actions = []
+    if steps:
+        direction = "forward" if steps > 0 else "reverse"
+        actions.append(f"accelerate {direction}" + (f" x{abs(steps)}" if abs(steps) > 1 else ""))
+    if point is not None:
+        actions.append(f"point {'diverging' if point else 'through'}")
+    text = "commanded: " + (", ".join(actions) or "nothing")
+    if dropped:
+        text += f" ({dropped} dropped)"
+    return text
+
+
+async def control_loop():
+    """
+    Apply the coalesced commands and any ramp, acknowledge the commands and share the new state.
+
+    A command arriving while the loop is idle is applied at once. The loop then holds off for a
+    control period, so that the commands of a burst are coalesced into one action per period.
+    """
     while True:
-        incoming = await ws.receive()
-        flash_led(t=0.005)
-        message = json.loads(incoming)
-        if message["type"] == "ping":
-            reply = {"type": "pong", "date": time.time()}
-        elif message["type"] == "init":
-            reply = {
-                "type": "init",
-                "text": f"initialised with engine={throttle.engine_id()}",
-                "date": time.time(),
-                "maximum": throttle.profile().get("max_speed", 100),
-            }
-        elif message["type"] == "stop":
-            throttle.stop()
-            reply = {
-                "type": "ack",
-                "text": "commanded: stop",
-                "date": time.time(),
-                "velocity": throttle.velocity(),
-                "step": throttle.step(),
-            }
-        elif message["type"] == "move":
-            direction_in = message["text"]
-            if direction_in == "left":
-                direction_in = "forward"
-            if direction_in == "right":
-                direction_in = "reverse"
-
-            direction = (
-                RelativeDirection.FORWARD
-                if direction_in == "forward"
-                else RelativeDirection.REVERSE
-            )
-
-            throttle.accelerate(direction)
-            reply = {
-                "type": "ack",
-                "text": f"commanded: accelerate {direction_in}",
-                "date": time.time(),
-                "velocity": throttle.velocity(),
-                "step": throttle.step(),
-            }
-        elif message["type"] == "change-point":
-            diverging = message["text"] == "point-diverging"
-            throttle.change_point(diverging)
+        try:
+            await asyncio.wait_for(commands_ready.wait(), CONTROL_PERIOD_MS / 1000)
+        except asyncio.TimeoutError:
+            pass  # no commands, but points may still need turning off
+        commands_ready.clear()
+        if throttle.is_ramping():
+            throttle.update_ramp()
+            publish_state()
+        if throttle.update_points():
+            publish_state()
+        net_steps, point, acks = commands.drain()
+        if not acks:
+            continue
+
+        if net_steps:
+            throttle.accelerate(RelativeDirection.FORWARD, net_steps)
+        if point is not None:
+            throttle.change_point(point)
+
+        for ws, steps, point, count, dropped in acks:
             reply = {
                 "type": "ack",
-                "text": f"commanded: point {'diverging' if diverging else 'through'}",
+                "text": ack_text(steps, point, dropped),
                 "date": time.time(),
-                "route": "diverging" if diverging else "through",
+                "count": count,
             }
-        else:
-            # echo message
-            print(message)
-            reply = message
+            hub.send_to(ws, reply)
+
+        publish_state()
+        await asyncio.sleep(CONTROL_PERIOD_MS / 1000)
 
-        await ws.send(json.dumps(reply))
+
+@app.get("/events")
+def events(request):
+    """Stream state changes to read-only dashboards as Server-Sent Events."""
+    stream = hub.open_event_stream()
+    if stream is None:
+        return "Too many event streams", 503
+    return stream, 200, {"Content-Type": "text/event-stream", "Cache-Control": "no-cache"}
 
 
 @app.get("/stop")
 def stop(request):
     throttle.stop()
+    publish_state()
     return "stopping"
 
 
@@ -135,6 +214,7 @@ def move(request, dir):
 
     direction = RelativeDirection.FORWARD if dir == "forward" else RelativeDirection.REVERSE
     throttle.move(direction)
+    publish_state()
     return f"moving {title(dir)}"
 
 
@@ -144,6 +224,7 @@ def point_diverge(request, diverging):
         return "Diverging must be 'true' or 'false'", 400
 
     throttle.change_point(diverging == "true")
+    publish_state()
     return f"point diverging={diverging}"
 
 
@@ -152,14 +233,30 @@ def not_found(request):
     return "This is not the page you're looking for", 404
 
 
-try:
-    print(f"Running app on http://{address}")
-    app.run(port=80)
-except KeyboardInterrupt:
-    throttle.stop()
-    app.shutdown()
-except Exception as err:
-    flash_led(t=1, n=5)
-    import sys
+async def main(port=80):
+    """Serve the app while the status-indicator effects and control loop run alongside it."""
+    asyncio.create_task(hardware.effects.run())
+    asyncio.create_task(control_loop())
+    publish_state()  # so the first clients receive a snapshot
+    await app.start_server(port=port)
+
+
+def run():
+    address = wifi.connect_with_saved_credentials()
+    flash_led(n=2, blocking=False)  # show that wifi connection was successful
+
+    try:
+        print(f"Running app on http://{address}")
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        throttle.stop()
+        app.shutdown()
+    except Exception as err:
+        flash_led(t=1, n=5)
+        import sys
+
+        sys.print_exception(err)
+
 
-    sys.print_exception(err)
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,146 @@
+"""
+Calibrate the speed of a locomotive against its motor step, using two detectors a known distance apart.
+
+Set the point to through and place the locomotive before the POINT_BASE detector, so that running
+forwards takes it over POINT_BASE and then POINT_THROUGH. At each step in CALIBRATION_STEPS the
+locomotive is timed between the detectors, alternating direction after every successful run.
+A step that does not reach the first detector in time is recorded as not moving. A step that
+passes the first detector but stalls before the second is not recorded, and the locomotive is
+driven back before the first detector to carry on from there.
+
+The fitted step to mm/s line and the lowest moving step for each direction are saved to the profile
+store, `profiles.json`, and used as the profile's start steps.
+"""
+
+from time import sleep_ms, ticks_diff, ticks_ms
+
+from detectors import AnalogueDetector, BehaviourEvent, EventOnChangeBehaviour, SchmittConverter
+from layout import AbsoluteDirection as facing
+from layout import Locomotive, RelativeDirection, save_profile
+from motion import fit_speed_curve
+
+LOCOMOTIVE_ID = "test_fast"
+DISTANCE_MM = 300  # between the POINT_BASE and POINT_THROUGH detectors, measure on the layout
+CALIBRATION_STEPS = range(4, 41, 4)
+START_TIMEOUT_MS = 10000  # not moving if the first detector is not reached within this time
+RUN_TIMEOUT_MS = 30000
+SETTLE_MS = 1000  # to come to a stop between runs
+RETURN_STEP = 24  # reliably moving, to drive back before the first detector after a stall
+
+engine = Locomotive(motor_number=0, id=LOCOMOTIVE_ID, orientation=facing.RIGHT)
+
+
+def create_sensor(pin, trigger=200, release=650):
+    return EventOnChangeBehaviour(
+        SchmittConverter(
+            AnalogueDetector(pin), trigger_threshold=trigger, release_threshold=release
+        )
+    )
+
+
+sensors = {
+    "POINT_BASE": create_sensor(26),
+    "POINT_THROUGH": create_sensor(27),
+}
+
+# (first detector, second detector) for each direction
+routes = {
+    RelativeDirection.FORWARD: ("POINT_BASE", "POINT_THROUGH"),
+    RelativeDirection.REVERSE: ("POINT_THROUGH", "POINT_BASE"),
+}
+
+
+def timed_run(step, direction) -> float | None:
+    """
+    Run between the detectors at the motor step, returning the speed in mm/s.
+
+    Returns 0 if the first detector was not reached, or None if the locomotive passed the first
+    detector and stalled before the second.
+    """
+    first, second = routes[direction]
+    engine.drive_step(step, direction)
+
+    started = ticks_ms()
+    first_ticks = None
+    speed = 0
+    while True:
+        now = ticks_ms()
+        triggered = {
+            name
+            for name, sensor in sensors.items()
+            if sensor.check_event() == BehaviourEvent.TRIGGER
+        }
+        if first_ticks is None:
+            if first in triggered:
+                first_ticks = now
+            elif ticks_diff(now, started) > START_TIMEOUT_MS:
+                break  # stuck, or too slow to be useful
+        elif second in triggered:
+            speed = DISTANCE_MM * 1000 / ticks_diff(now, first_ticks)
+            break
+        elif ticks_diff(now, started) > RUN_TIMEOUT_MS:
+            speed = None
+            break
+        sleep_ms(1)
+
+    engine.stop()
+    sleep_ms(SETTLE_MS)
+    return speed
+
+
+def return_before(detector, direction):
+    """Drive against the direction until clear of the detector, eg: after stalling past it."""
+    engine.drive_step(RETURN_STEP, 1 - direction)
+    started = ticks_ms()
+    try:
+        while sensors[detector].check_event() != BehaviourEvent.RELEASE:
+            if ticks_diff(ticks_ms(), started) > RUN_TIMEOUT_MS:
+                raise RuntimeError(
+                    f"Could not return before {detector}, place the locomotive there"
+                )
+            sleep_ms(1)
+    finally:
+        engine.stop()
+    sleep_ms(SETTLE_MS)
+
+
+def calibrate() -> dict:
+    """Return the samples of (step, mm/s) for each direction."""
+    samples = {direction: [] for direction in routes}
+    direction = RelativeDirection.FORWARD
+    for step in CALIBRATION_STEPS:
+        for _ in routes:
+            speed = timed_run(step, direction)
+            if speed is None:
+                print(f"step={step} direction={direction} stalled between the detectors")
+                return_before(routes[direction][0], direction)
+                break  # before the same detector again, so try the next step this way
+            samples[direction].append((step, speed))
+            print(f"step={step} direction={direction} speed={speed:.0f} mm/s")
+            if speed == 0:
+                break  # still before the same detector, so try the next step this way
+            direction = 1 - direction  # now past the second detector, so come back
+    return samples
+
+
+if __name__ == "__main__":
+    try:
+        samples = calibrate()
+        forward = fit_speed_curve(samples[RelativeDirection.FORWARD])
+        reverse = fit_speed_curve(samples[RelativeDirection.REVERSE])
+        print(f"forward: {forward}")
+        print(f"reverse: {reverse}")
+
+        save_profile(
+            LOCOMOTIVE_ID,
+            {
+                "start_step_forward": forward["min_step"],
+                "start_step_reverse": reverse["min_step"],
+                "calibration": {"forward": forward, "reverse": reverse},
+            },
+        )
+        print(f"Saved calibration of '{LOCOMOTIVE_ID}'")
+    except KeyboardInterrupt:
+        print("Keyboard exit detected")
+    finally:
+        engine.stop()
@@ -19,7 +19,7 @@ from detectors import (
     SimpleThresholdConverter,
 )
 from layout import AbsoluteDirection as Facing
-from layout import Locomotive, Point
+from layout import Locomotive, Point, apply_saved_profiles
 
 FOUND_THRESHOLD = 20
 
@@ -35,6 +35,7 @@ with open("config.json", "r") as f:
     config = json.load(f)
 
 
+apply_saved_profiles()
 point = Point(motor_number=1, id="Point")
 loco = Locomotive(motor_number=0, id="test", orientation=Facing.LEFT)
 
@@ -0,0 +1,167 @@
+"""
+Run status-indicator effects without blocking the caller.
+
+Effects are small state machines that are advanced by an `EffectsEngine`.
+The engine can be updated from a polling loop, run as an asyncio task or driven by a hardware timer.
+
+```py
+effects = EffectsEngine()
+effects.play(Flash(led, t=0.01))
+effects.start_timer()  # or `asyncio.create_task(effects.run())`
+```
+"""
+
+import asyncio
+import random
+
+from machine import Timer
+from utime import ticks_add, ticks_diff, ticks_ms
+
+
+class Effect:
+    """A base class for effects, which finishes at once unless `update` is overridden."""
+
+    def __init__(self, output) -> None:
+        self.output = output
+
+    def start(self, now: int):
+        """Begin the effect at the given ticks."""
+        pass
+
+    def update(self, now: int) -> bool:
+        """Advance the effect to the given ticks, returning True once it has finished."""
+        return True
+
+    def stop(self):
+        """Leave the output in its resting state."""
+        self.output.value(0)
+
+
+class Sequence(Effect):
+    """Drive an output through a sequence of (level, duration_ms) steps."""
+
+    def __init__(self, output, steps) -> None:
+        """
+        Create a sequence effect.
+
+        Args:
+            output (Pin): Output with a `value` method.
+            steps (iterable): Pairs of (level, duration_ms), consumed lazily so may be a generator.
+        """
+        super().__init__(output)
+        self._steps = iter(steps)
+        self._deadline = None
+
+    def start(self, now: int):
+        self._deadline = now
+        self.update(now)
+
+    def update(self, now: int) -> bool:
+        while ticks_diff(self._deadline, now) <= 0:
+            try:
+                level, duration_ms = next(self._steps)
+            except StopIteration:
+                self.stop()
+                return True
+            self.output.value(level)
+            self._deadline = ticks_add(self._deadline, duration_ms)
+        return False
+
+
+def _flash_steps(t: float, n: int):
+    duration_ms = int(t * 1000)
+    while n > 0:
+        yield 1, duration_ms
+        if n > 1:
+            yield 0, duration_ms
+        n -= 1
+
+
+class Flash(Sequence):
+    """Flash an output for t seconds n times, matching `hardware.flash_led`."""
+
+    def __init__(self, output, t: float = 0.12, n: int = 1) -> None:
+        super().__init__(output, _flash_steps(t, n))
+
+
+class Flicker(Effect):
+    """
+    Now and then re-show an indicator's current guise with new random levels, like a flame.
+
+    The indicator must provide `guise` and `show_guise(guise)`, as `Indicator` does in
+    rp2-fire-and-ice. The chance of a flicker is taken once per period, so the flicker rate does not
+    depend on how often the engine is updated.
+    """
+
+    def __init__(self, indicator, period_ms: int = 100, probability: float = 0.005) -> None:
+        super().__init__(indicator)
+        self.period_ms = period_ms
+        self.probability = probability
+        self._deadline = None
+
+    def start(self, now: int):
+        self._deadline = ticks_add(now, self.period_ms)
+
+    def update(self, now: int) -> bool:
+        flicker = False
+        while ticks_diff(self._deadline, now) <= 0:
+            self._deadline = ticks_add(self._deadline, self.period_ms)
+            flicker = flicker or random.random() < self.probability
+        if flicker:
+            self.output.show_guise(self.output.guise)
+        return False
+
+    def stop(self):
+        pass  # leave the indicator showing its guise
+
+
+class EffectsEngine:
+    """Advance any number of effects, with at most one effect playing per output."""
+
+    def __init__(self) -> None:
+        self._effects = []
+        self._timer = None
+
+    def play(self, effect: Effect) -> Effect:
+        """Start an effect immediately, replacing any effect already playing on its output."""
+        self.cancel(effect.output)
+        effect.start(ticks_ms())
+        self._effects.append(effect)
+        return effect
+
+    def cancel(self, output):
+        """Stop any effect playing on the given output."""
+        for effect in self._effects:
+            if effect.output is output:
+                self._effects.remove(effect)
+                effect.stop()
+                return
+
+    def is_playing(self, output=None) -> bool:
+        """Return whether an effect is playing on the output, or on any output if omitted."""
+        if output is None:
+            return len(self._effects) > 0
+        return any(effect.output is output for effect in self._effects)
+
+    def update(self):
+        """Advance all effects, removing those that have finished."""
+        now = ticks_ms()
+        for effect in self._effects[:]:
+            if effect.update(now):
+                self._effects.remove(effect)
+
+    async def run(self, period_ms: int = 5):
+        """Update the effects forever as an asyncio task."""
+        while True:
+            self.update()
+            await asyncio.sleep(period_ms / 1000)
+
+    def start_timer(self, period_ms: int = 5):
+        """Update the effects from a hardware timer, leaving the caller's loop free."""
+        self.stop_timer()
+        self._timer = Timer(period=period_ms, callback=lambda _timer: self.update())
+
+    def stop_timer(self):
+        if self._timer:
+            self._timer.deinit()
+            self._timer = None
@@ -2,6 +2,7 @@ import socket
 import struct
 from time import gmtime, sleep_ms, ticks_ms
 
+from effects import EffectsEngine, Flash
 from lib.SimplyRobotics import SimplePWMMotor
 from machine import ADC, RTC, Pin
 
@@ -18,10 +19,18 @@ rtc = RTC()
 led = Pin("LED", Pin.OUT)
 motors = {}
 speaker = None
+effects = EffectsEngine()
 
 
-def flash_led(t: float = 0.12, n: int = 1):
-    """[Blocking] Flash the LED for t seconds n times."""
+def flash_led(t: float = 0.12, n: int = 1, blocking=True):
+    """
+    Flash the LED for t seconds n times.
+
+    Blocks the caller unless `blocking` is False, in which case the flashes are played by `effects`.
+    """
+    if not blocking:
+        effects.play(Flash(led, t, n))
+        return
     while n > 0:
         led.on()
         sleep_ms(int(t * 1000))
@@ -73,21 +82,22 @@ def get_iso_datetime() -> str:
     )
 
 
-def init_motor(number):
+def init_motor(number, pwm_frequencies=None):
     """
     Initialise a SimplePWMMotor.
 
     Choose the motor number from the SimplyRobotics board.
+    Optionally provide a table of (upper speed percentage, PWM frequency) bands for the motor.
     """
     global motors
     if number == 0:
-        motors[0] = SimplePWMMotor(2, 5, 100)
+        motors[0] = SimplePWMMotor(2, 5, 100, pwm_frequencies)
     elif number == 1:
-        motors[1] = SimplePWMMotor(4, 3, 100)
+        motors[1] = SimplePWMMotor(4, 3, 100, pwm_frequencies)
     elif number == 2:
-        motors[2] = SimplePWMMotor(6, 9, 100)
+        motors[2] = SimplePWMMotor(6, 9, 100, pwm_frequencies)
     elif number == 3:
-        motors[3] = SimplePWMMotor(8, 7, 100)
+        motors[3] = SimplePWMMotor(8, 7, 100, pwm_frequencies)
 
 
 def motor_on(number, direction, percentage_vmax: float):
@@ -135,11 +145,18 @@ def speaker_off():
     speaker.off()
 
 
-def click_speaker(t: float = 0.12, n: int = 1):
-    """[Blocking] Click the speaker for t seconds n times."""
+def click_speaker(t: float = 0.12, n: int = 1, blocking=True):
+    """
+    Click the speaker for t seconds n times.
+
+    Blocks the caller unless `blocking` is False, in which case the clicks are played by `effects`.
+    """
     global speaker
     if speaker is None:
         raise Exception("speaker not initialised")
+    if not blocking:
+        effects.play(Flash(speaker, t, n))
+        return
     while n > 0:
         speaker.on()
         sleep_ms(int(t * 1000))
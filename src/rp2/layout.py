@@ -1,9 +1,21 @@
+import json
+import os
+from array import array
+
 try:
     import hardware
 except Exception:
     # in normal python
     import mock_hardware as hardware
 
+try:
+    from scheduler import Scheduler
+    from ticks import ticks_ms
+except ImportError:
+    # in normal python
+    from rp2.scheduler import Scheduler
+    from rp2.ticks import ticks_ms
+
 
 class AbsoluteDirection:
     """Direction when facing layout."""
@@ -22,15 +34,61 @@ class RelativeDirection:
 # direction locomotive moves when powered forwards
 TRACK_POLARITY = AbsoluteDirection.LEFT
 
-# motor steps per unit velocity
+# motor steps per unit velocity, unless the profile has a speed curve
 STEPS_PER_UNIT = 1
 
+# smallest change of motor step that is written to the motor
+MOTOR_STEP_QUANTUM = 0.1
+
+# milliseconds to power a point motor for a change
+POINT_PULSE_MS = 3000
+
+# PWM frequency for DC motors by (upper motor step, frequency), for more torque at low speed.
+# Opt in by adding it to a profile as "pwm_frequencies", others keep the fixed coreless frequency.
+DC_PWM_FREQUENCIES = ((15, 20), (20, 50), (100, 100))
+
+# Profiles may also have a "speed_curve", like a DCC speed table: the motor steps above the start
+# step at evenly spaced speeds from 0 to max_speed, eg: [0, 1, 3, 6, 10, 15, 21] for a gentle start.
 LOCOMOTIVE_PROFILES = {
     "test": {"start_step_forward": 8, "start_step_reverse": 9, "max_speed": 12},
     "test_fast": {"start_step_forward": 8, "start_step_reverse": 9, "max_speed": 20},
     "lourie": {"start_step_forward": 7, "start_step_reverse": 8, "max_speed": 30},
 }
 
+# calibrated profile values, saved by calibrate.py and applied over LOCOMOTIVE_PROFILES
+PROFILES_FILE = "profiles.json"
+
+
+def load_profiles(path: str = PROFILES_FILE) -> dict:
+    """Read the saved profile values, or an empty dictionary if none have been saved."""
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):  # missing, or corrupt from an interrupted write
+        return {}
+
+
+def apply_saved_profiles(path: str = PROFILES_FILE):
+    """
+    Update LOCOMOTIVE_PROFILES with the saved profile values.
+
+    Call before creating a Locomotive, so that its profile includes the calibration.
+    """
+    for id, values in load_profiles(path).items():
+        LOCOMOTIVE_PROFILES.setdefault(id, {}).update(values)
+
+
+def save_profile(id: str, values: dict, path: str = PROFILES_FILE):
+    """Save values for the profile, eg: from a calibration, and apply them to LOCOMOTIVE_PROFILES."""
+    id = id.lower()
+    profiles = load_profiles(path)
+    profiles.setdefault(id, {}).update(values)
+    # write a temporary file first so that a reset part way through keeps the previous profiles
+    with open(path + ".tmp", "w") as f:
+        json.dump(profiles, f)
+    os.rename(path + ".tmp", path)
+    LOCOMOTIVE_PROFILES.setdefault(id, {}).update(values)
+
 
 class Locomotive:
     """An instance of a locomotive containing a DC motor."""
@@ -52,12 +110,47 @@ class Locomotive:
         self.velocity_direction = self.orientation
         self._motor_step = 0
         self._motor_dir = hardware.FORWARD
-        hardware.init_motor(motor_number)
+        self._output = None  # (direction, quanta) last written to the motor, None if unknown
+        self.writes_issued = 0
+        self.writes_suppressed = 0  # unchanged outputs that were not written
+        self.apply_profile()
+        # coreless motors keep the default fixed frequency
+        hardware.init_motor(motor_number, self.profile.get("pwm_frequencies"))
+
+    def apply_profile(self):
+        """
+        Compile the profile into a motor step for each whole unit of speed, in each direction.
+
+        Call again after changing the profile, eg: to lower its max_speed.
+        """
+        self.max_speed = self.profile.get("max_speed", 100)
+        curve = self.profile.get("speed_curve")
+        curve_steps = []
+        for speed in range(int(self.max_speed) + 2):  # to interpolate up to and including max_speed
+            if curve:
+                position = min(speed / self.max_speed, 1) * (len(curve) - 1)
+                index = min(int(position), len(curve) - 2)
+                fraction = position - index
+                curve_steps.append(curve[index] + (curve[index + 1] - curve[index]) * fraction)
+            else:
+                curve_steps.append(speed * STEPS_PER_UNIT)
+
+        start_step_forward = self.profile.get("start_step_forward", 5)
+        start_step_reverse = self.profile.get("start_step_reverse", 5)
+        self._forward_steps = array("f", [start_step_forward + step for step in curve_steps])
+        self._reverse_steps = array("f", [start_step_reverse + step for step in curve_steps])
 
     def stop(self):
         self.velocity = 0
         self._set_motor_step()
 
+    def drive_step(self, step: float, velocity_direction: int = RelativeDirection.FORWARD):
+        """Drive the motor at a fixed step, ignoring the profile, eg: for calibration."""
+        self.velocity_direction = velocity_direction
+        self._set_motor_dir()
+        self._motor_step = step
+        self._set_motor()
+
     @property
     def speed(self):
         """Return current speed of motion based on velocity."""
@@ -80,39 +173,47 @@ class Locomotive:
         Set motor to motor step and direction.
 
         Will stop motor if step is negative.
+        The step is quantised to MOTOR_STEP_QUANTUM and only written if it or the direction changes.
         """
-        if self._motor_step <= 0:
+        quanta = round(self._motor_step / MOTOR_STEP_QUANTUM)
+        output = (self._motor_dir, quanta) if quanta > 0 else (None, 0)
+        if output == self._output:
+            self.writes_suppressed += 1
+            return
+
+        self._output = output
+        self.writes_issued += 1
+        if quanta <= 0:
             hardware.motor_off(self.motor_number)
         else:
-            hardware.motor_on(self.motor_number, self._motor_dir, self._motor_step)
+            hardware.motor_on(self.motor_number, self._motor_dir, quanta * MOTOR_STEP_QUANTUM)
 
-    def _set_motor_step(self):
-        """Set the motor step from the locomotive's current velocity."""
+    def _set_motor_dir(self):
+        """Set the motor direction from the locomotive's orientation and velocity direction."""
         direction_inversions = TRACK_POLARITY + self.orientation + self.velocity_direction
         self._motor_dir = hardware.FORWARD if direction_inversions % 2 == 0 else hardware.REVERSE
 
-        speed = self.speed
+    def _set_motor_step(self):
+        """Set the motor step from the locomotive's current velocity."""
+        self._set_motor_dir()
 
-        if self.velocity > 0:
-            # moving forwards
-            min_step = self.profile.get("start_step_forward", 5)
-        elif self.velocity < 0:
-            # moving in reverse
-            min_step = self.profile.get("start_step_reverse", 5)
+        if self.velocity == 0:
+            self._motor_step = 0
         else:
-            # not moving
-            min_step = 0
+            steps = self._forward_steps if self.velocity > 0 else self._reverse_steps
+            speed = min(self.speed, len(steps) - 1)
+            index = min(int(speed), len(steps) - 2)
+            self._motor_step = steps[index] + (steps[index + 1] - steps[index]) * (speed - index)
 
-        self._motor_step = min_step + speed * STEPS_PER_UNIT
         self._set_motor()
 
     def accelerate(self, amount: float = 0.2):
         """Accelerate at amount/s^2 where positive corresponds to forward."""
         new_velocity = self.velocity + amount
         if new_velocity < 0:
-            self.velocity = max(new_velocity, -self.profile.get("max_speed", 100))
+            self.velocity = max(new_velocity, -self.max_speed)
         else:
-            self.velocity = min(new_velocity, self.profile.get("max_speed", 100))
+            self.velocity = min(new_velocity, self.max_speed)
 
         if self.velocity > 0:
             self.velocity_direction = RelativeDirection.FORWARD
@@ -134,6 +235,36 @@ class Locomotive:
         self._set_motor_step()
 
 
+class CruiseControl:
+    """
+    Hold a locomotive at a set speed in mm/s, by running a `motion.SpeedController` at its period.
+
+    Speed is measured by a `motion.SpeedMeter`, pulsed eg: by `run_sensors.WheelCounter`.
+    `update` may be called as often as the control loop runs, but the controller is only run once
+    per period, as its gains assume.
+    """
+
+    def __init__(self, locomotive: Locomotive, controller, meter) -> None:
+        self.locomotive = locomotive
+        self.controller = controller
+        self.meter = meter
+        self.velocity_direction = RelativeDirection.FORWARD
+        self._scheduler = Scheduler(controller.period_ms)
+
+    def set_speed(self, speed: float, velocity_direction: int = RelativeDirection.FORWARD):
+        """Set the speed to hold in mm/s and the direction, where a speed of 0 stops the train."""
+        self.controller.set_speed(speed)
+        self.velocity_direction = velocity_direction
+
+    def update(self) -> bool:
+        """Drive the locomotive at the controller's next step if a period has passed."""
+        if not self._scheduler.is_ready():
+            return False
+        self.controller.measure(self.meter.speed(ticks_ms()))
+        self.locomotive.drive_step(self.controller.update(), self.velocity_direction)
+        return True
+
+
 class PointState:
     """State of a set of points on the railway."""
 
@@ -144,8 +275,11 @@ class PointState:
 class Point:
     """A point on the railway that can be switched."""
 
-    def __init__(self, motor_number, id, through_is_forward=True) -> None:
+    def __init__(
+        self, motor_number, id, through_is_forward=True, pulse_ms: int = POINT_PULSE_MS
+    ) -> None:
         self.id = id
+        self.pulse_ms = pulse_ms  # how long the motor takes to change the point
         self._diverging = False
         self.motor_number = motor_number
         self.through_direction = hardware.FORWARD if through_is_forward else hardware.REVERSE
@@ -157,7 +291,8 @@ class Point:
         """
         Change the point to the given state.
 
-        Note that there will be about a 3 second delay before the point change has been completed.
+        Note that there will be a delay of `pulse_ms` before the point change has been completed,
+        and the motor is left on until `off` is called. Use a `PointSequencer` to turn it off.
         """
         if self.motor_number:
             direction = self.diverging_direction if diverging else self.through_direction
@@ -187,6 +322,76 @@ class Point:
         return not self._diverging
 
 
+class PointSequencer:
+    """
+    Pulse point motors for their configured duration, turning each off automatically.
+
+    Changes are queued so that at most `max_active` point motors are powered at once.
+    `update` must be called regularly, eg: from a control loop, and returns the points that have
+    finished changing. These are also passed to `on_complete`, if provided.
+    """
+
+    def __init__(self, max_active: int = 1, on_complete=None) -> None:
+        self.max_active = max_active
+        self.on_complete = on_complete
+        self._queue = []  # (point, diverging) in the order requested
+        self._active = []  # (point, one-shot Scheduler) for each powered point motor
+
+    def request(self, point: Point, diverging: bool):
+        """Queue a change of the point, replacing any change to it that has not yet started."""
+        for index, (queued_point, _diverging) in enumerate(self._queue):
+            if queued_point is point:
+                self._queue[index] = (point, diverging)
+                return
+        self._queue.append((point, diverging))
+
+    def toggle(self, point: Point):
+        """Queue a change of the point to the opposite of its latest requested state."""
+        diverging = point.is_diverging()
+        for queued_point, queued_diverging in self._queue:
+            if queued_point is point:
+                diverging = queued_diverging
+        self.request(point, not diverging)
+
+    def is_busy(self, point: Point = None) -> bool:
+        """Return whether the point, or any point if omitted, is changing or waiting to change."""
+        if point is None:
+            return bool(self._queue or self._active)
+        return any(p is point for p, _ in self._queue) or any(p is point for p, _ in self._active)
+
+    def update(self) -> list:
+        """Turn off the points that have finished changing and start any that are waiting."""
+        completed = []
+        for active in self._active[:]:
+            point, scheduler = active
+            if scheduler.is_ready():
+                point.off()
+                self._active.remove(active)
+                completed.append(point)
+
+        for queued in self._queue[:]:
+            if len(self._active) >= self.max_active:
+                break
+            point, diverging = queued
+            if any(p is point for p, _ in self._active):
+                continue  # wait for its current change to end
+            self._queue.remove(queued)
+            point.change(diverging)
+            self._active.append((point, Scheduler(point.pulse_ms, one_shot=True)))
+
+        if self.on_complete:
+            for point in completed:
+                self.on_complete(point)
+        return completed
+
+    def cancel(self):
+        """Turn off every point motor and forget any queued changes."""
+        for point, _scheduler in self._active:
+            point.off()
+        self._active = []
+        self._queue = []
+
+
 class Evaluator:
     """A piece of railway bordered at each ingress by Train Detectors."""
 
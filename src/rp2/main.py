@@ -1,8 +1,8 @@
-import utime
 from hardware import click_speaker, init_speaker, led
 from layout import AbsoluteDirection as facing
-from layout import Locomotive
+from layout import Locomotive, apply_saved_profiles
 from lever import Lever
+from stately import StateMachine
 
 REG_MOVE = 70
 REG_BRAKE = 30
@@ -14,11 +14,14 @@ print(f"Regulator position: {regulator_position:.0f}%")
 
 if regulator_position > 50:
     print("Starting web server")
-    import server  # noqa: F401  # imports server and takes over thread
+    import server
+
+    server.run()  # takes over thread
 else:
     print("Using regulator control")
 
     init_speaker()
+    apply_saved_profiles()
     engine = Locomotive(motor_number=0, id="test", orientation=facing.LEFT)
 
     def move_forwards(regulator_position):
@@ -46,7 +49,7 @@ else:
     def stop(regulator_position):
         engine.stop()
 
-    state_machine = {
+    regulator_states = {
         # state: (callback, lt, lt_state, gt, gt_state)
         "move_forwards": (move_forwards, REG_MOVE, "coast_forwards", 100, "move_forwards"),
         "move_reverse": (move_reverse, REG_MOVE, "coast_reverse", 100, "move_reverse"),
@@ -57,38 +60,41 @@ else:
         "change_forwards": (stop, 0, "change_forwards", 5, "brake_forwards"),
         "change_reverse": (stop, 0, "change_reverse", 5, "brake_reverse"),
     }
-    state = "change_forwards"
 
-    def herald_transition(new_state):
+    def regulator_state(callback, lt, lt_state, gt, gt_state):
+        """Return a state function that leaves the state once the regulator is outside lt-gt."""
+
+        def state_function():
+            callback(regulator_position)
+            if regulator_position < lt:
+                return lt_state
+            if regulator_position > gt:
+                return gt_state
+
+        return state_function
+
+    def read_regulator():
+        global regulator_position
+        regulator_position = regulator.read()
+
+    def herald_transition(old_state, new_state):
         if "move" in new_state:
             led.on()
         else:
             led.off()
         click_speaker(t=0.01)
-
-    def run_state_machine(state, regulator_position):
-        (callback, lt, lt_state, gt, gt_state) = state_machine[state]
-        callback(regulator_position)
-        if regulator_position < lt:
-            herald_transition(lt_state)
-            return lt_state
-        if regulator_position > gt:
-            herald_transition(gt_state)
-            return gt_state
-        return state
-
-    try:
-        while True:
-            regulator_position = regulator.read()
-
-            state = run_state_machine(state, regulator_position)
-
-            print(
-                f"state={state}, regulator={regulator_position:.0f}, velocity={engine.velocity:.1f}",
-                end="    \r",
-            )
-
-            utime.sleep_ms(50)
-
-    except KeyboardInterrupt:
-        engine.stop()
+        print(
+            f"state={new_state}, regulator={regulator_position:.0f}, velocity={engine.velocity:.1f}"
+        )
+
+    state_machine = StateMachine(
+        {state: regulator_state(*row) for state, row in regulator_states.items()},
+        on_before_state=read_regulator,
+        on_transition=herald_transition,
+        initial_state="change_forwards",
+        period_ms=50,
+    )
+    state_machine.run_loop()  # until interrupted
+
+    engine.stop()
+    print(state_machine.report())
@@ -0,0 +1,327 @@
+"""
+Relate locomotive motor steps to real speeds and positions on the layout.
+
+The functions here are pure, so that they can be tested on CPython and shared by `calibrate.py`.
+A calibration for one direction is a dictionary of:
+
+- `min_step`: the lowest motor step at which the locomotive moves, overcoming stiction
+- `slope`: mm/s gained for each motor step
+- `intercept`: mm/s of the fitted line at step 0, usually negative
+"""
+
+try:
+    from ticks import ticks_diff
+except ImportError:
+    # in normal python
+    from rp2.ticks import ticks_diff
+
+
+def fit_speed_curve(samples) -> dict:
+    """
+    Fit a straight line of speed against motor step to calibration runs.
+
+    Args:
+        samples (iterable): Pairs of (motor step, measured speed in mm/s), with a speed of 0 for
+            steps at which the locomotive did not move.
+
+    Raises:
+        ValueError: If fewer than two different steps moved the locomotive.
+    """
+    moving = [(step, speed) for step, speed in samples if speed > 0]
+    steps = {step for step, _speed in moving}
+    if len(steps) < 2:
+        raise ValueError("At least two different moving steps are needed to fit a speed curve")
+
+    count = len(moving)
+    mean_step = sum(step for step, _speed in moving) / count
+    mean_speed = sum(speed for _step, speed in moving) / count
+    covariance = sum((step - mean_step) * (speed - mean_speed) for step, speed in moving)
+    variance = sum((step - mean_step) ** 2 for step, _speed in moving)
+
+    slope = covariance / variance
+    return {
+        "min_step": min(steps),
+        "slope": slope,
+        "intercept": mean_speed - slope * mean_step,
+    }
+
+
+def speed_for_step(calibration: dict, step: float) -> float:
+    """Return the speed in mm/s expected at the motor step, or 0 if it is too low to move."""
+    if step < calibration["min_step"]:
+        return 0
+    return max(0, calibration["slope"] * step + calibration["intercept"])
+
+
+def step_for_speed(calibration: dict, speed: float) -> float:
+    """Return the motor step expected to give the speed in mm/s, or 0 for no speed."""
+    if speed <= 0:
+        return 0
+    step = (speed - calibration["intercept"]) / calibration["slope"]
+    return max(step, calibration["min_step"])
+
+
+class PositionEstimator:
+    """
+    Estimate a train's position along a route by dead reckoning from the last detector it crossed.
+
+    The speed is taken from a calibration, follows changes of motor step with a first-order lag and
+    falls at a known deceleration while braking. Each detector crossing resets the position and,
+    once two detectors have been crossed, scales the calibrated speed by the distance actually
+    travelled between them, so that the estimate improves as the train runs.
+    """
+
+    def __init__(
+        self,
+        calibration: dict,
+        detectors: dict,
+        deceleration: float,
+        response_ms: int = 300,
+        learning_rate: float = 1.0,
+    ) -> None:
+        """
+        Create a position estimator.
+
+        Args:
+            calibration (dict): From `fit_speed_curve`, for the direction of travel.
+            detectors (dict): Position in mm along the route of each detector, by name.
+            deceleration (float): mm/s^2 while braking.
+            response_ms (int): Time constant of the speed following a change of motor step.
+            learning_rate (float): Fraction of each detector's speed correction to apply, less than 1
+                to smooth out noisy detectors, or 0 for none.
+        """
+        self.calibration = calibration
+        self.detectors = detectors
+        self.deceleration = deceleration
+        self.response_ms = response_ms
+        self.learning_rate = learning_rate
+
+        self.position = None  # mm along the route, None until the first detector
+        self.speed = 0  # mm/s
+        self.scale = 1.0  # correction of the calibrated speed
+        self.braking = False
+        self.error = None  # mm the estimate was out by at the last detector
+        self._target_speed = 0
+        self._last_detector = None  # (position, unscaled distance travelled since)
+
+    def set_step(self, step: float):
+        """Drive at the motor step, ending any braking."""
+        self.braking = False
+        self._target_speed = speed_for_step(self.calibration, step)
+
+    def brake(self):
+        """Slow to a stop at the deceleration."""
+        self.braking = True
+
+    def update(self, elapsed_ms: int) -> float:
+        """Advance the estimate by the elapsed time, returning the estimated position."""
+        seconds = elapsed_ms / 1000
+        if self.braking:
+            self.speed = max(0, self.speed - self.deceleration * seconds)
+        else:
+            target = self._target_speed * self.scale
+            self.speed += (target - self.speed) * min(1, elapsed_ms / self.response_ms)
+
+        distance = self.speed * seconds
+        if self.position is not None:
+            self.position += distance
+        if self._last_detector is not None:
+            position, travelled = self._last_detector
+            self._last_detector = (position, travelled + distance / self.scale)
+        return self.position
+
+    def detected(self, name: str):
+        """Correct the estimate as the train crosses the named detector."""
+        position = self.detectors[name]
+        if self.position is not None:
+            self.error = self.position - position
+        if self._last_detector is not None and self.learning_rate:
+            last_position, travelled = self._last_detector
+            if travelled > 0 and position > last_position:
+                scale = (position - last_position) / travelled
+                scale = self.scale + (scale - self.scale) * self.learning_rate
+                self.speed *= scale / self.scale  # the current speed was out by as much
+                self.scale = scale
+        self.position = position
+        self._last_detector = (position, 0)
+
+    def stopping_distance(self) -> float:
+        """Return the mm travelled if braking now."""
+        return self.speed * self.speed / (2 * self.deceleration)
+
+    def should_brake(self, stop_position: float, latency_ms: int = 0) -> bool:
+        """Return whether braking must start now to stop at the position, allowing for latency."""
+        if self.position is None or self.braking:
+            return False
+        margin = self.speed * latency_ms / 1000
+        return stop_position - self.position <= self.stopping_distance() + margin
+
+
+class SpeedMeter:
+    """
+    Measure speed from the intervals between pulses a known distance apart.
+
+    Pulses may come from successive detectors or from a wheel counter, eg: `run_sensors.WheelCounter`.
+    If the next pulse is overdue, the speed is limited to what would already have produced it, so
+    that a stalling train reads as slowing down rather than holding its last speed.
+    """
+
+    def __init__(self, spacing_mm: float) -> None:
+        self.spacing_mm = spacing_mm
+        self._last_ticks = None
+        self._speed = 0
+
+    def pulse(self, now: int):
+        """Record a pulse at the ticks in milliseconds."""
+        if self._last_ticks is not None and now != self._last_ticks:
+            self._speed = self.spacing_mm * 1000 / ticks_diff(now, self._last_ticks)
+        self._last_ticks = now
+
+    def speed(self, now: int) -> float:
+        """Return the measured speed in mm/s at the ticks in milliseconds."""
+        if self._last_ticks is None or now == self._last_ticks:
+            return self._speed
+        return min(self._speed, self.spacing_mm * 1000 / ticks_diff(now, self._last_ticks))
+
+
+class SpeedController:
+    """
+    Hold a set speed by adjusting the motor step with a PID controller, run at a fixed period.
+
+    With a calibration the controller adds its correction to the step expected to give the set
+    speed, so that the PID only has to make up for load, grades and track voltage.
+    The integral is not accumulated while the output is saturated in the direction of the error,
+    so that it does not wind up while the train is held back or stalled.
+    The derivative is taken of the measured speed, so that changing the set speed gives no kick.
+    """
+
+    def __init__(
+        self,
+        kp: float,
+        ki: float,
+        kd: float = 0,
+        calibration: dict = None,
+        min_step: float = 0,
+        max_step: float = 100,
+        period_ms: int = 100,
+    ) -> None:
+        """
+        Create a speed controller.
+
+        Args:
+            kp (float): Steps per mm/s of error.
+            ki (float): Steps per mm of accumulated error.
+            kd (float): Steps per mm/s^2 of the measured speed changing.
+            calibration (dict): From `fit_speed_curve`, for feedforward, or None for pure PID.
+            min_step (float): Lowest motor step output while moving.
+            max_step (float): Highest motor step output.
+            period_ms (int): Fixed interval between calls to `update`.
+        """
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.calibration = calibration
+        self.min_step = min_step
+        self.max_step = max_step
+        self.period_ms = period_ms
+
+        self.setpoint = 0  # mm/s
+        self.measured = 0  # mm/s
+        self.step = 0
+        self.reset()
+
+    def reset(self):
+        """Forget the accumulated error, eg: after a stop."""
+        self.integral = 0
+        self._last_measured = None
+
+    def set_speed(self, speed: float):
+        """Set the speed to hold in mm/s, where 0 stops the train."""
+        self.setpoint = speed
+        if speed <= 0:
+            self.reset()
+
+    def measure(self, speed: float):
+        """Provide the latest measured speed in mm/s."""
+        self.measured = speed
+
+    def update(self) -> float:
+        """Return the motor step for the next period."""
+        if self.setpoint <= 0:
+            self.step = 0
+            return self.step
+
+        seconds = self.period_ms / 1000
+        error = self.setpoint - self.measured
+
+        feedforward = step_for_speed(self.calibration, self.setpoint) if self.calibration else 0
+        derivative = 0
+        if self._last_measured is not None:
+            derivative = (self.measured - self._last_measured) / seconds
+        self._last_measured = self.measured
+
+        integral = self.integral + error * seconds
+        step = feedforward + self.kp * error + self.ki * integral - self.kd * derivative
+
+        # anti-windup: only accumulate while the output is not held at a limit by the error
+        if step > self.max_step:
+            step = self.max_step
+            if error < 0:
+                self.integral = integral
+        elif step < self.min_step:
+            step = self.min_step
+            if error > 0:
+                self.integral = integral
+        else:
+            self.integral = integral
+
+        self.step = step
+        return step
+
+
+class MotorModel:
+    """
+    A simulated locomotive whose speed follows its motor step with a lag, scaled by its load.
+
+    For tuning a `SpeedController` on CPython, see `tune_speed.py`, and for tests.
+    """
+
+    def __init__(self, load=1.0, stiction_step=10, slope=20, response_ms=300):
+        self.load = load  # eg: below 1 on a grade or with a heavier train
+        self.stiction_step = stiction_step
+        self.slope = slope
+        self.response_ms = response_ms
+        self.speed = 0
+        self.position = 0
+
+    def calibration(self) -> dict:
+        """Return the calibration that `fit_speed_curve` would measure at a load of 1."""
+        return {
+            "min_step": self.stiction_step,
+            "slope": self.slope,
+            "intercept": -self.stiction_step * self.slope,
+        }
+
+    def update(self, step, elapsed_ms):
+        target = max(0, (step - self.stiction_step) * self.slope * self.load)
+        self.speed += (target - self.speed) * min(1, elapsed_ms / self.response_ms)
+        self.position += self.speed * elapsed_ms / 1000
+
+
+def simulate_hold(controller, model, setpoint=200, duration_ms=10000, spacing_mm=20, tick_ms=10):
+    """Run the controller at its period against the model, returning the speed after each period."""
+    meter = SpeedMeter(spacing_mm)
+    controller.set_speed(setpoint)
+    speeds = []
+    next_pulse = spacing_mm
+    step = 0
+    for now in range(0, duration_ms, tick_ms):
+        model.update(step, tick_ms)
+        while model.position >= next_pulse:
+            meter.pulse(now)
+            next_pulse += spacing_mm
+        if now % controller.period_ms == 0:
+            controller.measure(meter.speed(now))
+            step = controller.update()
+            speeds.append(model.speed)
+    return speeds
@@ -0,0 +1,104 @@
+"""
+Ramp an output towards a target level without blocking the caller.
+
+The caller only sets a target and a rate, and may read back the current level at any time.
+A `RampModel` holds the ramp itself and is advanced by elapsed time, so that it can be tested
+without hardware. A `RampDriver` advances the model to the current time and writes the new level to
+its output, eg: a locomotive's velocity, each time the caller's loop calls `update`.
+So the output is only ever changed from the loop, however often or late `update` is called.
+
+```py
+ramp = RampDriver(set_velocity)
+ramp.ramp_to(12, rate=20, start=0)  # 0 -> 12 units at 20 units/s
+while ramp.is_ramping():
+    ramp.update()  # eg: once per control loop tick
+```
+"""
+
+try:
+    from ticks import ticks_diff, ticks_ms
+except ImportError:
+    # in normal python
+    from rp2.ticks import ticks_diff, ticks_ms
+
+
+class RampModel:
+    """A level that moves towards a target at a constant rate, advanced by elapsed time."""
+
+    def __init__(self, level: float = 0, rate: float = 1) -> None:
+        self.level = level
+        self.target = level
+        self.rate = rate  # level units per second
+
+    def set_target(self, target: float, rate: float = None):
+        if rate is not None:
+            self.rate = rate
+        self.target = target
+
+    def is_settled(self) -> bool:
+        return self.level == self.target
+
+    def advance(self, elapsed_ms: int) -> float:
+        """Move the level towards the target for the elapsed time, returning the new level."""
+        step = self.rate * elapsed_ms / 1000
+        if self.level < self.target:
+            self.level = min(self.level + step, self.target)
+        elif self.level > self.target:
+            self.level = max(self.level - step, self.target)
+        return self.level
+
+
+class RampDriver:
+    """Drive an output along a `RampModel`, advanced and written by `update`."""
+
+    def __init__(self, output, model: RampModel = None) -> None:
+        """
+        Create a ramp driver.
+
+        Args:
+            output (callable): Called with each new level.
+            model (RampModel): Ramp to follow, a new one if omitted.
+        """
+        self.output = output
+        self.model = model or RampModel()
+        self._last = None
+        self._written = None  # level last written to the output
+
+    @property
+    def level(self) -> float:
+        return self.model.level
+
+    @property
+    def target(self) -> float:
+        return self.model.target
+
+    def is_ramping(self) -> bool:
+        """Return whether the output has yet to be written with the target level."""
+        return self._last is not None
+
+    def ramp_to(self, target: float, rate: float = None, start: float = None):
+        """Begin ramping to the target, from the start level if given, eg: after a manual change."""
+        if start is not None:
+            self.model.level = start
+        self.model.set_target(target, rate)
+        self._written = self.model.level
+        self._last = ticks_ms()
+
+    def update(self):
+        """Advance the ramp to now and write the level if it has changed, ending once settled."""
+        if self._last is None:
+            return
+        now = ticks_ms()
+        self.model.advance(ticks_diff(now, self._last))
+        self._last = now
+        level = self.model.level
+        if level != self._written:
+            self._written = level
+            self.output(level)
+        if self.model.is_settled():
+            self.cancel()
+
+    def cancel(self):
+        """Hold the current level, eg: when the output is changed directly."""
+        self.model.target = self.model.level
+        self._last = None
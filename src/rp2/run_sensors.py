@@ -2,22 +2,42 @@
 Control train with push buttons on Pins 2 and 3, while sensor data is recorded using MQTT.
 
 Measured train speed as approximately 0.3 m/s or 300 mm/s.
+Set CRUISE_SPEED to instead hold the train at a speed, measured by the POINT_BASE wheel counter.
 """
 
 import json
-from time import sleep_ms
+from time import sleep_ms, ticks_ms
 
 import wifi
 from detectors import AnalogueDetector, BehaviourEvent, EventOnChangeBehaviour, SchmittConverter
 from hardware import flash_led, get_iso_datetime, set_rtc_time
-from layout import AbsoluteDirection, Locomotive
+from layout import AbsoluteDirection, CruiseControl, Locomotive, apply_saved_profiles
 from layout import AbsoluteDirection as facing
 from machine import Pin
+from motion import SpeedController, SpeedMeter
 from umqtt.simple import MQTTClient
 
 MQTT_BROKER = "192.168.88.108"
 
+CRUISE_SPEED = None  # mm/s to hold, or None to drive with the buttons
+WHEEL_SPACING_MM = 50  # between pulses of the wheel counter, measure on the train
+SPEED_KP = 0.02  # see tune_speed.py
+SPEED_KI = 0.05
+SPEED_PERIOD_MS = 100
+
+apply_saved_profiles()
 engine = Locomotive(motor_number=0, id="test_fast", orientation=facing.RIGHT)
+speed_meter = SpeedMeter(WHEEL_SPACING_MM)
+cruise = CruiseControl(
+    engine,
+    SpeedController(
+        SPEED_KP,
+        SPEED_KI,
+        calibration=engine.profile.get("calibration", {}).get("forward"),
+        period_ms=SPEED_PERIOD_MS,
+    ),
+    speed_meter,
+)
 
 button_right = Pin(12, Pin.IN, Pin.PULL_UP)
 button_left = Pin(13, Pin.IN, Pin.PULL_UP)
@@ -34,15 +54,18 @@ def create_sensor(pin, trigger=200, release=650):
 class WheelCounter:
     """Handles sensor events and updates block counts based on direction of travel."""
 
-    def __init__(self, name, sensor, left_block, right_block):
+    def __init__(self, name, sensor, left_block, right_block, meter=None):
         self.name = name
         self.sensor = sensor
         self.left_block = left_block
         self.right_block = right_block
+        self.meter = meter  # SpeedMeter pulsed as each wheel arrives, if any
         self.last_event = BehaviourEvent.NONE
 
     def evaluate(self):
         self.last_event = self.sensor.check_event()
+        if self.meter and self.last_event == BehaviourEvent.TRIGGER:
+            self.meter.pulse(ticks_ms())
         return self.last_event
 
     def update_blocks(self, absolute_direction):
@@ -109,6 +132,7 @@ wheel_counters = {
     name: WheelCounter(name, sensors[name], blocks[left_block], blocks[right_block])
     for name, (left_block, right_block) in mapping.items()
 }
+wheel_counters["POINT_BASE"].meter = speed_meter
 
 
 def control_train(acceleration=100):
@@ -156,7 +180,10 @@ def send_sensor_data(sensor_data):
 
 def main_loop():
     # print("Running main loop")
-    control_train()
+    if CRUISE_SPEED is None:
+        control_train()
+    else:
+        cruise.update()  # runs the speed controller at its fixed period
     # print("Engine velocity:", engine.velocity)
     sensor_data = read_sensors()
     send_sensor_data(sensor_data)
@@ -172,6 +199,8 @@ if __name__ == "__main__":
         qt = MQTTClient("pico", MQTT_BROKER, keepalive=300)
         qt.connect()
         print("Connected to MQTT")
+        if CRUISE_SPEED is not None:
+            cruise.set_speed(CRUISE_SPEED)
         print("Running main")
         while True:
             main_loop()
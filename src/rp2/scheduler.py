@@ -1,4 +1,8 @@
-from utime import ticks_add, ticks_diff, ticks_ms
+try:
+    from ticks import ticks_add, ticks_diff, ticks_ms
+except ImportError:
+    # in normal python
+    from rp2.ticks import ticks_add, ticks_diff, ticks_ms
 
 
 class Scheduler:
@@ -1,10 +1,22 @@
-import utime
 from layout import AbsoluteDirection as facing
-from layout import Locomotive, Point
+from layout import Locomotive, Point, PointSequencer, apply_saved_profiles
 from layout import RelativeDirection as rel_dir
+from ramp import RampDriver
 
+MOVE_RATE = 20  # units/s, as 0.2 units every 10 ms
+MOVE_DURATION = 600  # milliseconds
+
+apply_saved_profiles()
 _engine = Locomotive(motor_number=0, id="Lourie", orientation=facing.LEFT)
 _point = Point(motor_number=1, id="Point", through_is_forward=True)
+_points = PointSequencer()
+
+
+def _set_velocity(velocity):
+    _engine.accelerate(velocity - _engine.velocity)
+
+
+_ramp = RampDriver(_set_velocity)
 
 
 def engine_id():
@@ -23,32 +35,49 @@ def step():
     return _engine._motor_step
 
 
+def is_point_diverging():
+    return _point.is_diverging()
+
+
+def is_ramping():
+    return _ramp.is_ramping()
+
+
+def update_ramp():
+    """Apply the ramp's latest velocity to the locomotive, from the control loop."""
+    _ramp.update()
+
+
 def stop():
+    _ramp.cancel()
     _engine.stop()
     print(f"velocity={_engine.velocity:.2f} units/s")
 
 
-def accelerate(direction):
+def accelerate(direction, steps=1):
     dir = 1 if direction == rel_dir.FORWARD else -1
-    a = 1
+    a = steps
     a *= dir
+    _ramp.cancel()
     _engine.accelerate(a)
 
     print(f"velocity={_engine.velocity:.2f} units/s")
 
 
 def move(direction):
+    """Start moving in the direction, ramping up in the background rather than blocking."""
     dir = 1 if direction == rel_dir.FORWARD else -1
-    a = 0.2 * dir
     start_step = 2 * dir
 
+    _ramp.cancel()
     _engine.accelerate(start_step)
 
-    for _ in range(60):
-        _engine.accelerate(a)
-        utime.sleep_ms(10)
+    max_speed = _engine.max_speed
+    target = _engine.velocity + dir * MOVE_RATE * MOVE_DURATION / 1000
+    target = max(-max_speed, min(target, max_speed))
+    _ramp.ramp_to(target, rate=MOVE_RATE, start=_engine.velocity)
 
-    print(f"velocity={_engine.velocity:.2f} units/s")
+    print(f"velocity={_engine.velocity:.2f} units/s, ramping to {target:.2f} units/s")
 
     # print("Coasting")
     # utime.sleep(0.5)
@@ -60,9 +89,15 @@ def move(direction):
 
 
 def change_point(diverging):
-    _point.change(diverging)
+    _points.request(_point, diverging)
+    _points.update()  # start now if no other point is changing
+
+    print(f"point '{_point.id}' set to {'diverging' if diverging else 'through'}")
+
 
-    print(f"point '{_point.id}' set to {'diverging' if _point.is_diverging() else 'through'}")
+def update_points():
+    """Turn off point motors that have finished changing, returning the points that did."""
+    return _points.update()
 
 
 # move(dir.FORWARD)
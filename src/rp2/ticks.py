@@ -0,0 +1,19 @@
+"""
+Millisecond ticks from `utime`, or equivalents from `time` when running under CPython, eg: in tests.
+
+Modules that should also run on CPython import the ticks functions from here rather than `utime`.
+"""
+
+try:
+    from utime import ticks_add, ticks_diff, ticks_ms
+except ImportError:
+    from time import monotonic
+
+    def ticks_ms():
+        return int(monotonic() * 1000)
+
+    def ticks_add(ticks, delta):
+        return ticks + delta
+
+    def ticks_diff(ticks_1, ticks_2):
+        return ticks_1 - ticks_2
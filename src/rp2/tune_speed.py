@@ -0,0 +1,51 @@
+"""
+Compare SpeedController gains on CPython against a simulated locomotive.
+
+Each set of gains holds a set speed on a `MotorModel` carrying a load, and the overshoot and the
+time taken to settle within 5% of the set speed are reported, to help choose gains before trying
+them on the layout.
+
+```sh
+python src/rp2/tune_speed.py --load 0.7 --gains 0.01,0.02 0.02,0.05 0.04,0.1 0.02,0.05,0.002
+```
+"""
+
+import argparse
+
+from motion import MotorModel, SpeedController, simulate_hold
+
+DEFAULT_GAINS = ["0.01,0.02", "0.02,0.05", "0.04,0.1", "0.02,0.05,0.002"]
+
+
+def settling_time(speeds, setpoint, period_ms, tolerance=0.05):
+    """Return the ms after which the speeds stay within the tolerance of the setpoint, or None."""
+    for i in range(len(speeds)):
+        if all(abs(speed - setpoint) <= setpoint * tolerance for speed in speeds[i:]):
+            return i * period_ms
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--load", type=float, default=0.7, help="below 1 for a heavier train")
+    parser.add_argument("--speed", type=float, default=200, help="set speed in mm/s")
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--gains", nargs="+", default=DEFAULT_GAINS, help="kp,ki[,kd] to compare")
+    args = parser.parse_args()
+
+    for gains in args.gains:
+        model = MotorModel(args.load)
+        controller = SpeedController(
+            *(float(gain) for gain in gains.split(",")), calibration=model.calibration()
+        )
+        speeds = simulate_hold(controller, model, args.speed, int(args.duration * 1000))
+        settled = settling_time(speeds, args.speed, controller.period_ms)
+        print(
+            f"kp={controller.kp} ki={controller.ki} kd={controller.kd}: "
+            f"overshoot {max(speeds) - args.speed:.0f} mm/s, "
+            f"settled {'never' if settled is None else f'{settled} ms'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
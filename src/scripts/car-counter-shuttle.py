@@ -11,7 +11,7 @@ from detectors import (
 )
 from hardware import led
 from layout import AbsoluteDirection as Facing
-from layout import Locomotive, Point
+from layout import Locomotive, Point, apply_saved_profiles
 
 COUNT_THRESHOLD = 50
 CLEAR_THRESHOLD = 60
@@ -24,9 +24,11 @@ REFLECTOR_LENGTH = 5  # mm
 min_trigger_interval = int(MIN_WAGON_LENGTH / MAX_SPEED * 1000)  # 83 ms
 min_trigger_duration = int(REFLECTOR_LENGTH / MAX_SPEED * 1000)  # 17 ms
 
+apply_saved_profiles()
 point = Point(motor_number=1, id="Point")
 loco = Locomotive(motor_number=0, id="test", orientation=Facing.RIGHT)
 loco.profile["max_speed"] = 2  # set really slow for shuttle tests
+loco.apply_profile()
 
 
 def create_touch_sensor(gpio_number):
@@ -43,6 +43,7 @@ loco.orientation = Facing.RIGHT
 loco.profile["max_speed"] = 1  # set really slow for shuttle tests
 loco.profile["start_step_forward"] = 15
 loco.profile["start_step_reverse"] = 7
+loco.apply_profile()
 
 # Set up the script
 
@@ -1,8 +1,9 @@
 from detectors import AnalogueDetector
 from layout import AbsoluteDirection as facing
-from layout import Locomotive, Point
+from layout import Locomotive, Point, PointSequencer, apply_saved_profiles
 from machine import Pin
 from scheduler import Scheduler
+from stately import StateMachine
 
 LOW_FREQUENCY_PERIOD_MS = 100
 SENSORS_PERIOD_MS = 10
@@ -14,12 +15,17 @@ wait_flag = False
 led = Pin("LED", Pin.OUT)
 detector = AnalogueDetector(28, threshold=128)
 
+apply_saved_profiles()
 engine = Locomotive(motor_number=0, id="test", orientation=facing.RIGHT)
 engine.profile["max_speed"] = 3  # set really slow for shuttle tests
+engine.apply_profile()
 
 point = Point(motor_number=1, id="Point", through_is_forward=True)
 
 event_queue = []
+point_sequencer = PointSequencer(
+    on_complete=lambda _point: event_queue.append(Events.TASK_COMPLETE)
+)
 
 
 class Events:
@@ -65,17 +71,16 @@ def home_stop():
 
 
 def change_point():
-    point.toggle()
+    point_sequencer.toggle(point)
     event_queue.append(Events.TASK_COMPLETE)
 
 
 def point_changing():
-    if wait_for(3000):
-        event_queue.append(Events.TASK_COMPLETE)
+    pass  # the point sequencer raises TASK_COMPLETE once the point motor is turned off
 
 
-state_machine = {
-    # state: (callback, {event: state})
+transitions = {
+    # state: {event: state}
     "home_ready": {Events.SHUTTLE_START: "home_start"},
     "home_start": {Events.SHUTTLE_STOP: "away_stop"},
     "away_stop": {Events.SHUTTLE_START: "away_start"},
@@ -84,23 +89,19 @@ state_machine = {
     "change_point": {Events.TASK_COMPLETE: "point_changing"},
     "point_changing": {Events.TASK_COMPLETE: "home_ready"},
 }
-state = "home_ready"
 
 
-def run_state_machine(state):
-    event_state_mapping = state_machine[state]
-    callback = locals()[state]
-    callback()
-    try:
-        event = event_queue.pop(0)
-    except IndexError:
-        # no events in queue
-        event = -1
-    try:
-        return event_state_mapping[event]
-    except KeyError:
-        # event is not in event_state_mapping
-        return state
+def show_transition(old_state, new_state):
+    wait_str = f"wait={((wait_trigger - up_time) / 1000 if wait_trigger else 0.0):.1f}s"
+    print(f"state={new_state}, velocity={engine.velocity:.1f} events={event_queue} {wait_str}")
+
+
+state_machine = StateMachine(
+    {state: globals()[state] for state in transitions},
+    transitions=transitions,
+    on_transition=show_transition,
+    initial_state="home_ready",
+)
 
 
 def wait_for(milliseconds):
@@ -125,20 +126,16 @@ def sensors_loop():
 
 
 def low_frequency_loop(ticks_delta):
-    global up_time, state, wait_trigger, wait_flag
+    global up_time, wait_trigger, wait_flag
     up_time += ticks_delta
 
     if wait_trigger and up_time >= wait_trigger:
         wait_flag = True
 
-    state = run_state_machine(state)
-
-    wait_str = f"wait={((wait_trigger - up_time) / 1000 if wait_trigger else 0.0):.1f}s"
-
-    print(
-        f"state={state}, velocity={engine.velocity:.1f} events={event_queue} {wait_str}",
-        end="    \r",
-    )
+    point_sequencer.update()
+    state_machine.step()
+    if event_queue:
+        state_machine.handle(event_queue.pop(0))  # events with no transition are discarded
 
 
 sensors_scheduler = Scheduler(SENSORS_PERIOD_MS)
@@ -154,6 +151,8 @@ try:
 
 except KeyboardInterrupt:
     print("Keyboard exit detected")
+    print(state_machine.report())
 finally:
     led.off()
     engine.stop()
+    point_sequencer.cancel()
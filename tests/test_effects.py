@@ -0,0 +1,91 @@
+import importlib.util
+import sys
+import types
+from pathlib import Path
+from unittest.mock import Mock
+
+import pytest
+
+EFFECTS = Path(__file__).parent.parent / "src" / "rp2" / "effects.py"
+
+
+@pytest.fixture
+def ticks():
+    return [0]
+
+
+@pytest.fixture
+def effects(monkeypatch, ticks):
+    """Import the effects with the MicroPython modules they need replaced by fakes."""
+    utime = types.ModuleType("utime")
+    utime.ticks_ms = lambda: ticks[0]
+    utime.ticks_add = lambda ticks_1, delta: ticks_1 + delta
+    utime.ticks_diff = lambda ticks_1, ticks_2: ticks_1 - ticks_2
+    monkeypatch.setitem(sys.modules, "machine", Mock())
+    monkeypatch.setitem(sys.modules, "utime", utime)
+
+    spec = importlib.util.spec_from_file_location("effects", EFFECTS)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run(engine, ticks, until_ms, tick_ms=10):
+    while ticks[0] < until_ms:
+        ticks[0] += tick_ms
+        engine.update()
+
+
+class TestFlash:
+    def test_timing(self, effects, ticks):
+        led = Mock()
+        engine = effects.EffectsEngine()
+        engine.play(effects.Flash(led, t=0.1, n=2))
+        levels = []
+        led.value.side_effect = lambda level: levels.append((ticks[0], level))
+
+        run(engine, ticks, 500)
+        # on at 0 ms, off at 100 ms, on again at 200 ms and off at 300 ms
+        assert levels == [(100, 0), (200, 1), (300, 0)]
+        assert not engine.is_playing()
+
+    def test_replace(self, effects):
+        led = Mock()
+        engine = effects.EffectsEngine()
+        engine.play(effects.Flash(led, n=3))
+        engine.play(effects.Flash(led))
+
+        assert len(engine._effects) == 1
+        led.value.assert_called_with(1)
+
+    def test_base_effect(self, effects):
+        engine = effects.EffectsEngine()
+        engine.play(effects.Effect(Mock()))
+        engine.update()
+        assert not engine.is_playing()
+
+
+class TestFlicker:
+    @pytest.mark.parametrize("tick_ms", [5, 20, 100])
+    def test_rate(self, effects, ticks, monkeypatch, tick_ms):
+        """The chance of a flicker is taken once per period, however often the engine updates."""
+        chances = []
+        monkeypatch.setattr(effects.random, "random", lambda: chances.append(ticks[0]) or 0.5)
+        indicator = Mock(guise="ORANGE")
+        engine = effects.EffectsEngine()
+        engine.play(effects.Flicker(indicator, period_ms=100, probability=0.01))
+
+        run(engine, ticks, 1000, tick_ms)
+        assert len(chances) == 10
+        indicator.show_guise.assert_not_called()
+
+    def test_show_current_guise(self, effects, ticks, monkeypatch):
+        monkeypatch.setattr(effects.random, "random", lambda: 0)
+        indicator = Mock(guise="ORANGE")
+        engine = effects.EffectsEngine()
+        engine.play(effects.Flicker(indicator, period_ms=100))
+
+        indicator.guise = "BLUE"  # eg: changed by a state
+        run(engine, ticks, 300, tick_ms=300)  # a late update flickers once, not three times
+        indicator.show_guise.assert_called_once_with("BLUE")
+        assert engine.is_playing()
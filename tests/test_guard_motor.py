@@ -0,0 +1,57 @@
+import importlib.util
+import sys
+from pathlib import Path
+from unittest.mock import Mock
+
+import pytest
+
+LIBRARY = Path(__file__).parent.parent / "src" / "rp2-guard" / "simply_robotics.py"
+
+
+@pytest.fixture
+def simply_robotics(monkeypatch):
+    """Import the Guard's motor library, with a separate fake PWM for each pin."""
+    monkeypatch.setitem(sys.modules, "machine", Mock(PWM=lambda pin: Mock()))
+    spec = importlib.util.spec_from_file_location("simply_robotics", LIBRARY)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def motor(simply_robotics):
+    bands = ((0.3, 100), (0.6, 1000), (1.0, 20000))
+    return simply_robotics.PWM_Motor(1, 20000, frequency_bands=bands)
+
+
+@pytest.mark.parametrize(
+    ("speeds", "frequency"),
+    [
+        ((0.299,), 100),
+        ((0.3,), 1000),  # up at the bound
+        ((0.3, 0.281), 1000),  # within the hysteresis of the bound
+        ((0.3, 0.279), 100),  # below the hysteresis
+        ((0.7, 0.581), 20000),
+        ((0.7, 0.2), 100),  # down several bands at once
+    ],
+)
+def test_band_hysteresis(simply_robotics, motor, speeds, frequency):
+    for speed in speeds:
+        motor.on(simply_robotics.Direction.FORWARD, speed)
+    assert motor.frequency == frequency
+
+
+def test_frequency_writes(simply_robotics, motor):
+    """The PWM divider is only reprogrammed when the band changes."""
+    forward = simply_robotics.Direction.FORWARD
+    for speed in (0.1, 0.2, 0.29, 0.3, 0.4, 0.29, 0.28, 0.27):
+        motor.on(forward, speed)
+
+    # at startup, then by off() to 100 Hz, up to 1000 Hz, and back down to 100 Hz
+    assert motor.forwardPin.freq.call_count == 4
+    assert [call.args[0] for call in motor.forwardPin.freq.call_args_list] == [
+        20000,
+        100,
+        1000,
+        100,
+    ]
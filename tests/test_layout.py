@@ -1,8 +1,9 @@
+import sys
 from unittest.mock import patch
 
 import pytest
 
-from rp2 import layout
+from rp2 import layout, motion
 
 mock_hardware = layout.hardware
 Locomotive = layout.Locomotive
@@ -94,3 +95,194 @@ class TestLocomotive:
             locomotive.brake(0.1)
         assert locomotive.velocity == 0.00
         mock_set_motor_step.assert_called()
+
+    def test_pwm_frequencies(self):
+        with patch.dict(
+            layout.LOCOMOTIVE_PROFILES, dc={"pwm_frequencies": layout.DC_PWM_FREQUENCIES}
+        ):
+            layout.Locomotive(1, id="dc")
+        mock_hardware.init_motor.assert_called_with(1, layout.DC_PWM_FREQUENCIES)
+
+        layout.Locomotive(1, id="test")
+        mock_hardware.init_motor.assert_called_with(1, None)
+
+        layout.Locomotive(1, id="lourie")
+        mock_hardware.init_motor.assert_called_with(1, None)
+
+    def test_suppress_unchanged_writes(self, locomotive: Locomotive):
+        mock_hardware.motor_on.reset_mock()
+        locomotive.accelerate(1)
+        locomotive.accelerate(0.01)  # less than MOTOR_STEP_QUANTUM
+        locomotive.accelerate(0.1)
+        locomotive.accelerate(-2)  # reverse
+
+        assert locomotive.writes_issued == 3
+        assert locomotive.writes_suppressed == 1
+        assert mock_hardware.motor_on.call_args_list[-1][0][1] == mock_hardware.REVERSE
+
+        locomotive.stop()
+        locomotive.stop()
+        assert locomotive.writes_issued == 4
+        assert locomotive.writes_suppressed == 2
+
+    def test_regulator_trace_snapshot(self, locomotive: Locomotive):
+        """
+        Replay 20 s of regulator positions, sampled every 50 ms as in main.py.
+
+        A regression snapshot, not a benchmark: no trace has been recorded from a real regulator,
+        so this one is synthetic (rest, move, a long coast, brake and rest) using the regulator
+        bands of main.py. The expected writes are derived from the quantised motor output after
+        each sample, and compared with the writes the motor driver actually received.
+        """
+        trace = [0] * 20 + [85] * 100 + [50] * 200 + [20] * 60 + [0] * 20
+        mock_hardware.motor_on.reset_mock()
+        mock_hardware.motor_off.reset_mock()
+        outputs = []
+        for position in trace:
+            if position > 70:  # move
+                locomotive.accelerate((position - 70) / 200)
+            elif position > 30:  # coast
+                locomotive.brake(0.01)
+            elif position > 3:  # brake
+                locomotive.brake(abs(position - 30) / 150)
+            else:
+                locomotive.stop()
+            quanta = round(locomotive._motor_step / layout.MOTOR_STEP_QUANTUM)
+            outputs.append((locomotive._motor_dir, quanta) if quanta > 0 else (None, 0))
+
+        # the first output is always written, then only those that differ from the previous one
+        changes = 1 + sum(previous != output for previous, output in zip(outputs, outputs[1:]))
+        assert locomotive.writes_issued == changes
+        assert locomotive.writes_suppressed == len(trace) - changes
+        hardware_writes = mock_hardware.motor_on.call_count + mock_hardware.motor_off.call_count
+        assert hardware_writes == changes
+        # most samples change the motor step by less than MOTOR_STEP_QUANTUM, or not at all
+        assert locomotive.writes_suppressed > locomotive.writes_issued
+
+    def test_speed_curve(self):
+        with patch.dict(
+            layout.LOCOMOTIVE_PROFILES, curved={"max_speed": 10, "speed_curve": [0, 2, 10]}
+        ):
+            locomotive = layout.Locomotive(0, id="curved")
+        for velocity, expected_step in [(0, 0), (2.5, 6), (5, 7), (7.5, 11), (10, 15), (-5, 7)]:
+            locomotive.velocity = velocity
+            locomotive._set_motor_step()
+            assert locomotive._motor_step == pytest.approx(expected_step)
+
+    def test_apply_profile(self):
+        with patch.dict(layout.LOCOMOTIVE_PROFILES, changed={"max_speed": 20}):
+            locomotive = layout.Locomotive(0, id="changed")
+            locomotive.profile["max_speed"] = 3
+            locomotive.apply_profile()
+        locomotive.accelerate(5)
+        assert locomotive.velocity == 3
+        assert locomotive._motor_step == 8
+
+
+def test_save_profile(tmp_path):
+    path = str(tmp_path / "profiles.json")
+    assert layout.load_profiles(path) == {}
+
+    with patch.dict(layout.LOCOMOTIVE_PROFILES, saved={"max_speed": 10}):
+        layout.save_profile("Saved", {"start_step_forward": 6}, path)
+        layout.save_profile("saved", {"start_step_reverse": 7}, path)
+        assert layout.LOCOMOTIVE_PROFILES["saved"]["start_step_forward"] == 6
+
+    assert layout.load_profiles(path) == {
+        "saved": {"start_step_forward": 6, "start_step_reverse": 7}
+    }
+    assert not (tmp_path / "profiles.json.tmp").exists()
+
+    # eg: interrupted by a reset while writing
+    (tmp_path / "profiles.json").write_text('{"saved": {"start_')
+    assert layout.load_profiles(path) == {}
+
+
+def test_cruise_control():
+    """Hold the set speed on a heavy train, running the controller once per period."""
+    ticks = [0]
+    scheduler = sys.modules[layout.Scheduler.__module__]
+    with (
+        patch.object(scheduler, "ticks_ms", side_effect=lambda: ticks[0]),
+        patch.object(layout, "ticks_ms", side_effect=lambda: ticks[0]),
+    ):
+        model = motion.MotorModel(load=0.8)
+        meter = motion.SpeedMeter(20)
+        controller = motion.SpeedController(0.02, 0.03, calibration=model.calibration())
+        locomotive = layout.Locomotive(0, id="test")
+        cruise = layout.CruiseControl(locomotive, controller, meter)
+        cruise.set_speed(200)
+
+        runs = 0
+        next_pulse = 20
+        for now in range(10, 10001, 10):
+            ticks[0] = now
+            runs += cruise.update()
+            model.update(locomotive._motor_step, 10)
+            while model.position >= next_pulse:
+                meter.pulse(now)
+                next_pulse += 20
+
+    assert runs == 100
+    assert model.speed == pytest.approx(200, rel=0.03)
+
+
+class TestPointSequencer:
+    @pytest.fixture
+    def ticks(self):
+        ticks = [0]
+        scheduler = sys.modules[layout.Scheduler.__module__]
+        with patch.object(scheduler, "ticks_ms", side_effect=lambda: ticks[0]):
+            yield ticks
+
+    def test_pulse(self, ticks):
+        point = layout.Point(1, "A", pulse_ms=500)
+        completed = []
+        sequencer = layout.PointSequencer(on_complete=completed.append)
+
+        sequencer.request(point, True)
+        mock_hardware.motor_off.reset_mock()
+        assert sequencer.update() == []
+        assert point.is_diverging()
+        assert sequencer.is_busy(point)
+
+        ticks[0] = 499
+        assert sequencer.update() == []
+        mock_hardware.motor_off.assert_not_called()
+
+        ticks[0] = 500
+        assert sequencer.update() == [point]
+        mock_hardware.motor_off.assert_called_with(1)
+        assert completed == [point]
+        assert not sequencer.is_busy()
+
+    def test_max_active(self, ticks):
+        points = [layout.Point(1, name, pulse_ms=100) for name in "ABC"]
+        sequencer = layout.PointSequencer(max_active=2)
+        for point in points:
+            sequencer.toggle(point)
+
+        sequencer.update()
+        assert [point.is_diverging() for point in points] == [True, True, False]
+
+        ticks[0] = 100
+        assert sequencer.update() == points[:2]
+        assert points[2].is_diverging()
+
+        ticks[0] = 200
+        assert sequencer.update() == points[2:]
+
+    def test_repeated_request(self, ticks):
+        point = layout.Point(1, "A", pulse_ms=100)
+        sequencer = layout.PointSequencer()
+
+        sequencer.request(point, True)
+        sequencer.update()
+        sequencer.toggle(point)  # waits for the first change to end
+        sequencer.toggle(point)  # replaces the queued change
+        sequencer.toggle(point)
+
+        ticks[0] = 100
+        assert sequencer.update() == [point]
+        assert not point.is_diverging()
+        assert sequencer.is_busy(point)
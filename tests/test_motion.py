@@ -0,0 +1,136 @@
+import pytest
+
+from rp2 import motion
+
+
+class TestSpeedCurve:
+    def test_fit(self):
+        samples = [(4, 0), (8, 0), (12, 100), (16, 200), (20, 300)]
+        calibration = motion.fit_speed_curve(samples)
+
+        assert calibration["min_step"] == 12
+        assert calibration["slope"] == pytest.approx(25)
+        assert calibration["intercept"] == pytest.approx(-200)
+
+    def test_not_enough_samples(self):
+        with pytest.raises(ValueError):
+            motion.fit_speed_curve([(4, 0), (8, 100), (8, 110)])
+
+    @pytest.mark.parametrize(
+        ("step", "expected_speed"),
+        [(0, 0), (11, 0), (12, 100), (16, 200)],
+    )
+    def test_speed_for_step(self, step, expected_speed):
+        calibration = {"min_step": 12, "slope": 25, "intercept": -200}
+        assert motion.speed_for_step(calibration, step) == expected_speed
+
+    @pytest.mark.parametrize(
+        ("speed", "expected_step"),
+        [(0, 0), (10, 12), (100, 12), (200, 16)],
+    )
+    def test_step_for_speed(self, speed, expected_step):
+        calibration = {"min_step": 12, "slope": 25, "intercept": -200}
+        assert motion.step_for_speed(calibration, speed) == expected_step
+
+
+CALIBRATION = {"min_step": 10, "slope": 20, "intercept": -100}
+DETECTORS = {"A": 0, "B": 300, "C": 600}
+DECELERATION = 400  # mm/s^2
+STOP_POSITION = 1000  # mm
+
+
+def simulate_stop(step, learning_rate, true_scale=1.2, tick_ms=10, start=-500):
+    """Drive a simulated train at the step and return the error of its stopping position in mm."""
+    estimator = motion.PositionEstimator(
+        CALIBRATION, DETECTORS, DECELERATION, learning_rate=learning_rate
+    )
+    estimator.set_step(step)
+
+    # the real train runs faster than calibrated, with the same response and braking
+    train = motion.PositionEstimator(CALIBRATION, {}, DECELERATION)
+    train.position = start
+    train.scale = true_scale
+    train.set_step(step)
+
+    while train.speed > 0 or not train.braking:
+        last_position = train.position
+        train.update(tick_ms)
+        estimator.update(tick_ms)
+        for name, position in DETECTORS.items():
+            if last_position < position <= train.position:
+                estimator.detected(name)
+
+        if estimator.should_brake(STOP_POSITION, latency_ms=tick_ms):
+            estimator.brake()
+            train.brake()
+
+    return train.position - STOP_POSITION
+
+
+class TestPositionEstimator:
+    def test_detected(self):
+        estimator = motion.PositionEstimator(CALIBRATION, DETECTORS, DECELERATION)
+        estimator.set_step(15)  # 200 mm/s
+        assert estimator.update(2000) is None  # before the first detector
+
+        estimator.detected("A")
+        for _ in range(300):
+            estimator.update(10)
+        assert estimator.position == pytest.approx(600)
+        estimator.detected("B")
+
+        assert estimator.error == pytest.approx(300)
+        assert estimator.position == 300
+        assert estimator.scale == pytest.approx(0.5)
+        assert estimator.speed == pytest.approx(100)
+
+    @pytest.mark.parametrize("step", [15, 20, 25, 30])
+    def test_stopping_error(self, step):
+        uncorrected = simulate_stop(step, learning_rate=0)
+        corrected = simulate_stop(step, learning_rate=1)
+
+        assert abs(uncorrected) > 80  # braking too late, as the train is faster than calibrated
+        assert abs(corrected) < 10
+
+
+MOTOR_CALIBRATION = motion.MotorModel().calibration()
+
+
+class TestSpeedMeter:
+    def test_speed(self):
+        meter = motion.SpeedMeter(20)
+        assert meter.speed(0) == 0
+        meter.pulse(0)
+        meter.pulse(100)
+        assert meter.speed(150) == 200
+        assert meter.speed(200) == 200
+        assert meter.speed(400) == pytest.approx(20000 / 300)  # overdue, so slowing down
+
+
+class TestSpeedController:
+    @pytest.mark.parametrize("load", [1.0, 0.8, 0.6])
+    def test_hold_speed(self, load):
+        """Hold the set speed within 3% despite the load, where open loop control falls short."""
+        open_loop = motion.SpeedController(0, 0, calibration=MOTOR_CALIBRATION)
+        closed_loop = motion.SpeedController(0.02, 0.03, calibration=MOTOR_CALIBRATION)
+
+        open_speeds = motion.simulate_hold(open_loop, motion.MotorModel(load))
+        closed_speeds = motion.simulate_hold(closed_loop, motion.MotorModel(load))
+
+        assert open_speeds[-1] == pytest.approx(200 * load)
+        assert closed_speeds[-1] == pytest.approx(200, rel=0.03)
+        assert max(closed_speeds) < 200 * 1.25
+
+    def test_anti_windup(self):
+        """Hold back the integral of a stalled train, so that it recovers once freed."""
+        controller = motion.SpeedController(0.02, 0.03, calibration=MOTOR_CALIBRATION, max_step=30)
+        model = motion.MotorModel(load=0)  # stalled
+        motion.simulate_hold(controller, model, duration_ms=5000)
+        assert controller.step == 30
+        # only as much as reaches the limit, rather than 5 s of the full error
+        feedforward = motion.step_for_speed(MOTOR_CALIBRATION, 200)
+        assert controller.ki * controller.integral <= 30 - feedforward
+
+        model.load = 1
+        speeds = motion.simulate_hold(controller, model)
+        assert speeds[-1] == pytest.approx(200, rel=0.03)
@@ -0,0 +1,210 @@
+import importlib.util
+import struct
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+SRC = Path(__file__).parent.parent / "src"
+
+
+@pytest.fixture
+def ticks():
+    return [0]
+
+
+@pytest.fixture(params=["rp2-guard", "rp2-fire-and-ice"])
+def protocol(request, monkeypatch, ticks):
+    """Import a copy of the protocol, with `utime` replaced by a fake clock."""
+    utime = types.ModuleType("utime")
+    utime.ticks_ms = lambda: ticks[0]
+    utime.ticks_add = lambda ticks_1, delta: ticks_1 + delta
+    utime.ticks_diff = lambda ticks_1, ticks_2: ticks_1 - ticks_2
+    monkeypatch.setitem(sys.modules, "utime", utime)
+
+    spec = importlib.util.spec_from_file_location("protocol", SRC / request.param / "protocol.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeWiFi:
+    broadcast = "255.255.255.255"
+    buffer_size = 64
+
+    def __init__(self) -> None:
+        self.sent = []  # (packet, ip_address)
+        self.inbox = []  # packets to be received
+
+    def send(self, packet, ip_address):
+        self.sent.append((bytes(packet), ip_address))
+
+    def receive_into(self, include_ip_address):
+        if not self.inbox:
+            return None
+        packet = self.inbox.pop(0)
+        return (packet, "192.168.4.2") if include_ip_address else packet
+
+
+def sent_messages(protocol, wifi):
+    messages = []
+    for packet, _ip_address in wifi.sent:
+        message = protocol.Message()
+        message.parse(packet)
+        messages.append(message)
+    return messages
+
+
+class TestReliable:
+    def test_retransmit_until_acknowledged(self, protocol, ticks):
+        wifi = FakeWiFi()
+        link = protocol.Link(wifi, sender_id=1)
+        sequence = link.send(protocol.Type.STOP, ip_address="192.168.4.2")
+
+        ticks[0] = protocol.RETRANSMIT_MS - 1
+        link.retransmit()
+        assert len(wifi.sent) == 1
+        ticks[0] = protocol.RETRANSMIT_MS
+        link.retransmit()
+        assert len(wifi.sent) == 2
+        assert wifi.sent[1] == wifi.sent[0]
+
+        ack = struct.pack("!HH", 1, sequence)
+        wifi.inbox.append(protocol.encode(protocol.Type.ACK, 2, 1, ack))
+        assert link.receive() is None  # handled by the link
+        assert not link.is_pending(sequence)
+
+        ticks[0] = 10 * protocol.RETRANSMIT_MS
+        link.retransmit()
+        assert len(wifi.sent) == 2
+
+    def test_give_up(self, protocol, ticks):
+        wifi = FakeWiFi()
+        link = protocol.Link(wifi, sender_id=1)
+        link.send(protocol.Type.STOP, ip_address="192.168.4.2")
+
+        for _ in range(protocol.MAX_RETRANSMITS + 2):
+            ticks[0] += protocol.RETRANSMIT_MS
+            link.retransmit()
+
+        assert link.retransmits == protocol.MAX_RETRANSMITS
+        assert link.failures == 1
+        assert not link.is_pending()
+
+    def test_acknowledge_every_copy(self, protocol):
+        wifi = FakeWiFi()
+        link = protocol.Link(wifi, sender_id=1)
+        stop = protocol.encode(protocol.Type.STOP, 2, 7)
+        wifi.inbox.extend([stop, stop])
+
+        assert link.receive().type == protocol.Type.STOP
+        assert link.receive() is None  # the retransmitted copy is suppressed
+
+        acks = sent_messages(protocol, wifi)
+        assert [ack.type for ack in acks] == [protocol.Type.ACK] * 2
+        assert acks[0].acknowledged() == (2, 7)
+
+    def test_transient_status(self, protocol):
+        wifi = FakeWiFi()
+        link = protocol.Link(wifi, sender_id=1)
+        link.send_status(protocol.Status.FORWARD)
+        link.send_status(protocol.Status.BOUNCE)
+        assert link.is_pending(2)
+        assert not link.is_pending(1)
+
+
+class TestDuplicates:
+    def test_suppressed(self, protocol):
+        wifi = FakeWiFi()
+        link = protocol.Link(wifi, sender_id=1)
+        control = protocol.encode(protocol.Type.CONTROL, 2, 5, bytes((1, 50)))
+        wifi.inbox.extend([control, control, protocol.encode(protocol.Type.CONTROL, 3, 5, b"\1\1")])
+
+        assert link.receive().sender == 2
+        assert link.receive().sender == 3  # the same sequence from another sender is new
+        assert link.receive() is None
+
+    def test_sequence_wrap(self, protocol):
+        wifi = FakeWiFi()
+        sender = protocol.Link(FakeWiFi(), sender_id=2)
+        sender._sequence = 0xFFFE
+        receiver = protocol.Link(wifi, sender_id=1)
+
+        for expected in (0xFFFF, 0, 1):
+            assert sender.send(protocol.Type.TRIGGER) == expected
+            wifi.inbox.append(sender.wifi.sent[-1][0])
+            assert receiver.receive().sequence == expected
+
+
+class TestControl:
+    def test_control_for(self, protocol):
+        wifi = FakeWiFi()
+        link = protocol.Link(wifi, sender_id=1)
+        link.send_control_multi([(0x0102, 1, 50), (0xABCD, -1, 20)])
+        message = sent_messages(protocol, wifi)[0]
+
+        assert message.type == protocol.Type.CONTROL_MULTI
+        assert message.control_for(0x0102) == (1, 50)
+        assert message.control_for(0xABCD) == (-1, 20)
+        assert message.control_for(0x0201) is None
+
+    def test_control(self, protocol):
+        message = protocol.Message()
+        message.parse(protocol.encode(protocol.Type.CONTROL, 2, 1, bytes((0xFF, 30))))
+        assert message.control_for(0xABCD) == (-1, 30)  # addressed to every Guard
+
+
+class TestCollision:
+    def test_own_broadcast(self, protocol):
+        wifi = FakeWiFi()
+        link = protocol.Link(wifi, sender_id=1)
+        link.send_marco()
+        wifi.inbox.append(wifi.sent[-1][0])  # echoed by the broadcast
+
+        assert link.receive() is None
+        assert link.collisions == 0
+
+    def test_another_board(self, protocol):
+        wifi = FakeWiFi()
+        link = protocol.Link(wifi, sender_id=1)
+        link.send_marco()
+        wifi.inbox.append(protocol.encode(protocol.Type.POLO, 1, 0x8000))
+
+        assert link.receive() is None
+        assert link.collisions == 1
+
+    def test_sender_id(self, protocol):
+        assert protocol.sender_id(b"\xe6\x61\x41\x04\x03\x4f\x2a\x31") == 0x2A31
+
+
+class TestStatusMonitor:
+    def status(self, protocol, status, counter):
+        message = protocol.Message()
+        payload = bytes((status, 40, counter >> 8, counter & 0xFF))
+        message.parse(protocol.encode(protocol.Type.STATUS, 2, counter, payload))
+        return message
+
+    def test_lost(self, protocol):
+        monitor = protocol.StatusMonitor()
+        assert monitor.observe(self.status(protocol, protocol.Status.FORWARD, 0xFFFE))
+        assert not monitor.observe(self.status(protocol, protocol.Status.FORWARD, 1))
+        assert monitor.lost == 2  # 0xFFFF and 0, across the wrap
+
+    def test_late(self, protocol):
+        """A retransmitted BOUNCE arriving after the newer status does not replace it."""
+        monitor = protocol.StatusMonitor()
+        monitor.observe(self.status(protocol, protocol.Status.REVERSE, 1))
+        monitor.observe(self.status(protocol, protocol.Status.FORWARD, 3))
+        assert monitor.lost == 1
+
+        assert not monitor.observe(self.status(protocol, protocol.Status.BOUNCE, 2))
+        assert monitor.status == protocol.Status.FORWARD
+        assert monitor.lost == 0
+        assert monitor.late == 1
+
+    def test_restart(self, protocol):
+        monitor = protocol.StatusMonitor()
+        monitor.observe(self.status(protocol, protocol.Status.FORWARD, 1000))
+        assert monitor.observe(self.status(protocol, protocol.Status.STOPPED, 0))
+        assert monitor.lost == 0
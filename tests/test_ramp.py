@@ -0,0 +1,84 @@
+from unittest.mock import Mock, patch
+
+import pytest
+
+from rp2 import layout, ramp
+
+
+class TestRampModel:
+    @pytest.mark.parametrize(
+        ("level", "target", "elapsed_ms", "expected_level"),
+        [
+            (0, 10, 100, 2),  # ramp up
+            (10, 0, 100, 8),  # ramp down
+            (0, 1, 100, 1),  # stop at the target
+            (0, -1, 100, -1),  # stop at a negative target
+            (5, 5, 100, 5),  # settled
+        ],
+    )
+    def test_advance(self, level, target, elapsed_ms, expected_level):
+        model = ramp.RampModel(level, rate=20)
+        model.set_target(target)
+        assert model.advance(elapsed_ms) == pytest.approx(expected_level)
+        assert model.is_settled() == (expected_level == target)
+
+    def test_ramp_time(self):
+        model = ramp.RampModel(2, rate=20)
+        model.set_target(14)
+        for tick in range(60):
+            assert not model.is_settled()
+            model.advance(10)
+        assert model.level == pytest.approx(14)
+
+
+class TestRampDriver:
+    def run(self, driver, ticks):
+        with patch.object(ramp, "ticks_ms", side_effect=ticks):
+            driver.ramp_to(10, rate=25, start=0)
+            while driver.is_ramping():
+                driver.update()
+
+    def test_ramp_to(self):
+        output = Mock()
+        driver = ramp.RampDriver(output)
+        self.run(driver, range(0, 10000, 20))
+
+        assert driver.level == 10
+        assert output.call_count == 20  # 0.5 units every 20 ms
+        output.assert_called_with(10)
+
+    def test_cancel(self):
+        output = Mock()
+        driver = ramp.RampDriver(output)
+        with patch.object(ramp, "ticks_ms", side_effect=[0, 100]):
+            driver.ramp_to(10, rate=20, start=0)
+            driver.update()
+        driver.cancel()
+
+        assert driver.level == pytest.approx(2)
+        assert not driver.is_ramping()
+        driver.update()
+        assert output.call_count == 1
+
+    def test_late_update(self):
+        """Keep ramping until the target is written, however late the loop calls `update`."""
+        output = Mock()
+        driver = ramp.RampDriver(output)
+        with patch.object(ramp, "ticks_ms", side_effect=[0, 100, 1000]):
+            driver.ramp_to(10, rate=20, start=0)
+            driver.update()
+            assert driver.is_ramping()
+            driver.update()  # long after the ramp would have settled
+
+        assert not driver.is_ramping()
+        output.assert_called_with(10)
+
+    def test_locomotive(self):
+        locomotive = layout.Locomotive(0, id="test")
+        driver = ramp.RampDriver(
+            lambda velocity: locomotive.accelerate(velocity - locomotive.velocity)
+        )
+        self.run(driver, range(0, 10000, 20))
+
+        assert locomotive.velocity == 10
+        assert locomotive._motor_step == 8 + 10
@@ -0,0 +1,177 @@
+import importlib.util
+import sys
+import types
+from pathlib import Path
+from unittest.mock import Mock
+
+import pytest
+
+LIBRARY = Path(__file__).parent.parent / "src" / "rp2-motors" / "lib" / "SimplyRobotics.py"
+
+
+@pytest.fixture
+def ticks():
+    return [0]
+
+
+@pytest.fixture
+def robotics(monkeypatch, ticks):
+    """Import the library with the MicroPython modules it needs replaced by fakes."""
+    utime = types.ModuleType("utime")
+    utime.ticks_ms = lambda: ticks[0]
+    utime.ticks_add = lambda ticks_1, delta: ticks_1 + delta
+    utime.ticks_diff = lambda ticks_1, ticks_2: ticks_1 - ticks_2
+    rp2 = Mock(asm_pio=lambda **kwargs: lambda program: program)
+    monkeypatch.setitem(sys.modules, "machine", Mock())
+    monkeypatch.setitem(sys.modules, "rp2", rp2)
+    monkeypatch.setitem(sys.modules, "utime", utime)
+
+    spec = importlib.util.spec_from_file_location("SimplyRobotics", LIBRARY)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def group_servos(robotics, count):
+    servos = [robotics.GroupServo(Mock(), channel) for channel in range(count)]
+    for servo in servos:
+        servo.registerServo()
+    return servos
+
+
+class TestServoGroup:
+    def test_stagger(self, robotics, ticks):
+        """Servos of unknown position jump to their targets, a few at a time."""
+        servos = group_servos(robotics, 4)
+        mover = robotics.ServoGroup(servos, maxMoving=2, settleMs=300)
+        for servo in range(4):
+            mover.moveToPosition(servo, 90)
+
+        mover.update()
+        assert [servo.period for servo in servos] == [1500, 1500, None, None]
+
+        ticks[0] = 299
+        mover.update()
+        assert servos[2].period is None  # the first two are still settling
+
+        ticks[0] = 300
+        mover.update()  # the first two have arrived, making room for the others
+        ticks[0] = 320
+        mover.update()
+        assert [servo.period for servo in servos] == [1500, 1500, 1500, 1500]
+
+        ticks[0] = 640
+        assert not mover.update()
+
+    def test_max_speed(self, robotics, ticks):
+        servos = group_servos(robotics, 1)
+        servos[0].goToPeriod(500)
+        mover = robotics.ServoGroup(servos, maxSpeed=180)
+        mover.moveToPosition(0, 180)
+
+        for tick in range(20, 1001, 20):
+            ticks[0] = tick
+            mover.update()
+            assert servos[0].period == pytest.approx(500 + 2 * tick, abs=1)
+        assert not mover.isMoving()
+
+    def test_direct_move(self, robotics, ticks):
+        """Moving a servo directly cancels its move, so it is not sent back later."""
+        servos = group_servos(robotics, 3)
+        mover = robotics.ServoGroup(servos, maxMoving=1)
+        for servo in range(3):
+            mover.moveToPosition(servo, 90)
+        mover.update()
+
+        servos[0].goToPosition(0)  # settling
+        servos[2].goToPosition(180)  # waiting
+        for tick in range(0, 2000, 20):
+            ticks[0] = tick
+            mover.update()
+
+        assert [servo.period for servo in servos] == [500, 1500, 2500]
+        assert not mover.isMoving()
+
+        mover.moveToPosition(2, 0)  # from its known position, rather than a jump
+        ticks[0] += 20
+        mover.update()
+        assert 500 < servos[2].period < 2500
+
+
+class TestStepperMotor:
+    def move(self, robotics, motor, position, **kwargs):
+        """Run a move to the end, returning the interval before each step in uSec."""
+        timer = robotics.Timer.return_value
+        timer.init.reset_mock()
+        motor.moveTo(position, **kwargs)
+        while motor.isMoving():
+            motor.onTimer(timer)
+        return [round(1000000 / call.kwargs["freq"]) for call in timer.init.call_args_list]
+
+    @pytest.mark.parametrize("halfStep", [False, True])
+    def test_move_to(self, robotics, halfStep):
+        motor = robotics.StepperMotor(Mock(), Mock())
+        for position, steps in [
+            (10, 20 if halfStep else 10),
+            (7.5, 5 if halfStep else 3),
+            (0, 15 if halfStep else 8),
+        ]:
+            assert len(self.move(robotics, motor, position, halfStep=halfStep)) == steps
+            assert motor.position == position
+            assert motor.state == motor.halfSteps % 8
+
+    def test_slow_rate(self, robotics):
+        """A maxRate below startRate is kept for the whole move."""
+        motor = robotics.StepperMotor(Mock(), Mock())
+        assert self.move(robotics, motor, 5, maxRate=10) == [100000] * 5
+
+    def test_trapezoid(self, robotics):
+        motor = robotics.StepperMotor(Mock(), Mock())
+        intervals = self.move(robotics, motor, 200, maxRate=500, acceleration=2000)
+
+        assert len(intervals) == 200
+        assert intervals[0] == 1000000 // motor.startRate
+        assert intervals == intervals[::-1]  # decelerates as it accelerated
+        # 62 steps to reach 500 steps/s from 50 steps/s, as 50^2 + 2 * 2000 * 62 >= 500^2
+        accelerating = intervals[:100]
+        assert sum(interval > 2000 for interval in accelerating) == 62
+        assert accelerating == sorted(accelerating, reverse=True)
+        assert intervals[62:138] == [2000] * 76
+
+
+class TestSimplePWMMotor:
+    @pytest.fixture
+    def motor(self, robotics, monkeypatch):
+        monkeypatch.setattr(robotics, "PWM", lambda pin: Mock())  # a separate fake for each pin
+        return robotics.SimplePWMMotor(2, 5, frequencyBands=((30, 100), (60, 1000), (100, 20000)))
+
+    def test_skip_unchanged(self, motor):
+        writes = motor.writes
+        motor.on("f", 50)
+        motor.on("f", 50)
+        motor.on("f", 50)
+        assert motor.writes == writes + 3  # frequency of both pins and the forward duty
+        assert motor.forwardPin.duty_u16.call_count == 2  # by off(), then once at 50%
+        assert motor.reversePin.duty_u16.call_count == 1
+
+        motor.on("r", 50)
+        assert motor.writes == writes + 5
+        assert motor.forwardPin.freq.call_count == 2  # at startup, then once for the band
+
+    @pytest.mark.parametrize(
+        ("speeds", "frequency"),
+        [
+            ((29.9,), 100),
+            ((30,), 1000),  # up at the bound
+            ((30, 28.1), 1000),  # within the hysteresis of the bound
+            ((30, 28), 1000),
+            ((30, 27.9), 100),  # below the hysteresis
+            ((70, 58.1), 20000),
+            ((70, 20), 100),  # down several bands at once
+        ],
+    )
+    def test_band_hysteresis(self, motor, speeds, frequency):
+        for speed in speeds:
+            motor.on("f", speed)
+        assert motor.frequency == frequency
+        assert motor.forwardPin.freq.call_args.args == (frequency,)